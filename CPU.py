@@ -2,9 +2,21 @@ from core_blocks import *
 from myhdl._Signal import _Signal, Signal
 from enum import Enum
 from myhdl import always, StopSimulation, delay
+from ram import RAM, MEM_SIZE
 
 
-MEM_SIZE = 1024
+class t_state(Enum):
+    F = 1
+    D = 2
+    E = 3
+    M = 4
+    W = 5
+    PC = 6
+    HALT = 7
+
+
+# Controller phases F, D, E, M, W and PC take one clock cycle each
+CYCLES_PER_INSTRUCTION = 6
 
 
 @block
@@ -29,8 +41,92 @@ def reset_generator(reset, clk, reset_cycles=3):
             reset.next = 0
     return gen
 
+class Counters:
+    """Performance counters of a CPU() instance, readable at any time during simulation"""
+
+    def __init__(self):
+        self.cycles = 0
+        self.instructions = 0
+        self.by_icode = [0] * 16
+        self.taken = [0] * 16
+        self.not_taken = [0] * 16
+        self.mem_reads = 0
+        self.mem_writes = 0
+        self.call_depth = 0
+        self.max_call_depth = 0
+
+    def report(self) -> dict:
+        """Machine-readable summary with CPI and instruction mix"""
+        return {
+            "cycles": self.cycles,
+            "instructions": self.instructions,
+            "cpi": self.cycles / self.instructions if self.instructions else None,
+            "mix": {icode_names[i]: n for i, n in enumerate(self.by_icode) if n},
+            "branches": {cond_names.get(f, str(f)): {"taken": self.taken[f], "not_taken": self.not_taken[f]}
+                         for f in range(16) if self.taken[f] or self.not_taken[f]},
+            "mem_reads": self.mem_reads,
+            "mem_writes": self.mem_writes,
+            "call_depth": self.call_depth,
+            "max_call_depth": self.max_call_depth,
+        }
+
+
+@block
+def counters_block(clk: _Signal, reset: _Signal, retire: _Signal, state: _Signal, icode: _Signal, ifun: _Signal,
+                   Cnd: _Signal, Stat: _Signal, counts: Counters):
+    """Count cycles out of reset and every instruction as it retires"""
+    @always(clk.posedge)
+    def count_cycles():
+        if not reset.val:
+            counts.cycles += 1
+
+    def count():
+        code = int(icode.val)
+        counts.instructions += 1
+        counts.by_icode[code] += 1
+        if code == IJXX:
+            if Cnd.val:
+                counts.taken[int(ifun.val)] += 1
+            else:
+                counts.not_taken[int(ifun.val)] += 1
+        elif code in (IMRMOVQ, IPOPQ):
+            counts.mem_reads += 1
+        elif code in (IRMMOVQ, IPUSHQ):
+            counts.mem_writes += 1
+        elif code == ICALL:
+            counts.mem_writes += 1
+            counts.call_depth += 1
+            counts.max_call_depth = max(counts.max_call_depth, counts.call_depth)
+        elif code == IRET:
+            counts.mem_reads += 1
+            counts.call_depth -= 1
+
+    # retire changes together with the state update of an instruction, while
+    # icode and friends still describe it; halt never retires but stops the CPU
+    @always(retire)
+    def count_retired():
+        count()
+
+    @always(state)
+    def count_halt():
+        if state.val == t_state.HALT and Stat.val == SHLT:
+            count()
+
+    return count_cycles, count_retired, count_halt
+
+
 @block 
-def CPU(program: list[intbv], clk: _Signal, reset: _Signal, main: int):
+def CPU(program: list[intbv], clk: _Signal, reset: _Signal, main: int, mem_size: int = MEM_SIZE,
+        checkpoint: "Checkpoint | None" = None, verbose: bool = True, counters: Counters | None = None,
+        profiler: "Profiler | None" = None, cache: "Cache | None" = None, mem: RAM | None = None,
+        halt_stops: bool = True, registers: list[int] | None = None):
+    # A checkpoint replaces the program, main and mem_size as the initial state.
+    # Given mem, the core runs on that (possibly shared) RAM instead of its own;
+    # without halt_stops it idles in HALT instead of stopping the simulation.
+    # registers, if given, are the initial register values instead of zeros and %rsp at the top.
+    if checkpoint is not None:
+        main = checkpoint.pc
+        mem_size = checkpoint.mem_size
     pc = Signal(intbv(main)[64:])
     icode = Signal(intbv(0)[4:])
     ifun = Signal(intbv(0)[4:])
@@ -40,26 +136,33 @@ def CPU(program: list[intbv], clk: _Signal, reset: _Signal, main: int):
     valB = Signal(intbv(0)[64:].signed())
     valC = Signal(intbv(0)[64:].signed())
     valE = Signal(intbv(0)[64:].signed())
-    valM = Signal(intbv(0)[64:])
+    valM = Signal(intbv(0)[64:].signed())
     valP = Signal(intbv(0)[64:])
     srcA = Signal(intbv(0)[4:])
     srcB = Signal(intbv(0)[4:])
     Regs = [Signal(intbv(0)[64:].signed()) for _ in range(15)]
     #rsp
-    Regs[4] = Signal(intbv(MEM_SIZE - 1)[64:])
-    old_Regs = [Signal(Regs[i].val) for i in range(15)]
+    Regs[4] = Signal(intbv(mem_size - 1, min=-2**63, max=2**63))
+    if checkpoint is not None:
+        registers = checkpoint.registers
+    if registers is not None:
+        Regs = [Signal(intbv(val)[64:].signed()) for val in registers]
 
     dstE = Signal(intbv(0)[4:])
     dstM = Signal(intbv(0)[4:])
     Cnd = Signal(intbv(0)[1:])
-    Stat = Signal(intbv(0)[3:])
-    CC = Signal(intbv(0)[3:])
-    old_CC = Signal(intbv(0)[3:])
+    Stat = Signal(intbv(0 if checkpoint is None else checkpoint.stat)[3:])
+    CC = Signal(intbv(0 if checkpoint is None else checkpoint.cc)[3:])
+    old_CC = Signal(CC.val)
     imem_error = Signal(intbv(0)[1:])
     dmem_error = Signal(intbv(0)[1:])
     instr_valid = Signal(intbv(1)[1:])
-    mem = [Signal(intbv(0)[64:].signed()) for _ in range(MEM_SIZE)]
-    old_mem = [Signal(intbv(0)[64:].signed()) for _ in range(MEM_SIZE)]
+    if mem is None and checkpoint is None:
+        mem = RAM(mem_size, program)
+    elif mem is None:
+        mem = RAM(mem_size, checkpoint.memory(), checkpoint.code_end)
+    # The per-cycle change report is only collected when it will be printed
+    journal = Journal() if verbose else None
 
 
     # Stage enables (only one active at a time)
@@ -70,33 +173,35 @@ def CPU(program: list[intbv], clk: _Signal, reset: _Signal, main: int):
     en_writeback = Signal(bool(0))
     en_PC_update = Signal(bool(0))
 
-    fetching_inst = fetching(program, clk, reset, pc, icode, ifun, rA, rB, valC, valP, instr_valid, imem_error, en_fetch)
+    fetching_inst = fetching(mem, clk, reset, pc, icode, ifun, rA, rB, valC, valP, instr_valid, imem_error, en_fetch, profiler)
     decoding_inst = decoding(clk, reset, icode, rA, rB, valA, valB, srcA, srcB, Regs, en_decode)
     execution_inst = execution(clk, reset, icode, ifun, valA, valB, valC, valE, Cnd, CC, dstE, dstM, rA, rB, en_execute)
-    memory_access_inst = memory_access(clk, reset, icode, valE, valA, valP, valM, imem_error, dmem_error, instr_valid, Stat, mem, en_memory)
-    writing_back_inst = writing_back(clk, reset, valM, valE, dstE, dstM, Regs, en_writeback, icode)
-    PC_update_inst = PC_update(clk, reset, valP, valM, Cnd, Stat, pc, icode, valC, en_PC_update)
-
-    class t_state(Enum):
-        F = 1
-        D = 2
-        E = 3
-        M = 4
-        W = 5
-        PC = 6
-        HALT = 7
+    memory_access_inst = memory_access(clk, reset, icode, valE, valA, valP, valM, imem_error, dmem_error, instr_valid, Stat, mem, en_memory, journal, pc, cache)
+    writing_back_inst = writing_back(clk, reset, valM, valE, dstE, dstM, Regs, en_writeback, icode, journal)
+    PC_update_inst = PC_update(clk, reset, valP, valM, Cnd, Stat, pc, icode, valC, en_PC_update, profiler)
+
     state = Signal(t_state.F)
+    # Number of retired instructions (modulo 2**32), changes together with their PC update
+    retire = Signal(intbv(0)[32:])
+    cache_wait = cache.wait if cache is not None else None
 
     @always_seq(clk.posedge, reset=reset)
     def controller():
-        check_diff(old_Regs, Regs, old_mem, mem, old_CC, CC)
-        if state.val == t_state.HALT:
+        if verbose:
+            check_diff(journal, old_CC, CC)
+        halted = state.val == t_state.HALT
+        if halted and halt_stops:
             raise StopSimulation(f"Executions was stopped at time {myhdl.now()}. State:{bin(Stat.val)}")
+        # A slow data access holds every stage until its latency has passed
+        if halted or (cache_wait is not None and cache_wait()):
+            en_fetch.next = 0
+            en_decode.next = 0
+            en_execute.next = 0
+            en_memory.next = 0
+            en_writeback.next = 0
+            en_PC_update.next = 0
+            return
 
-        for i in range(15):
-            old_Regs[i].next = Regs[i].val
-        for i in range(MEM_SIZE):
-            old_mem[i].next = mem[i].val
         old_CC.next = CC.val
         # Set enables based on current state
         en_fetch.next = (state.val == t_state.F)
@@ -109,6 +214,8 @@ def CPU(program: list[intbv], clk: _Signal, reset: _Signal, main: int):
         # Advance to next state
         if state.val == t_state.F:
             state.next = t_state.D
+            if en_PC_update.val:
+                retire.next = (retire.val + 1) % retire.max
         elif state.val == t_state.D:
             state.next = t_state.E
         elif state.val == t_state.E:
@@ -123,5 +230,8 @@ def CPU(program: list[intbv], clk: _Signal, reset: _Signal, main: int):
             else:
                 state.next = t_state.F
                 
-    return fetching_inst, decoding_inst, execution_inst, memory_access_inst, writing_back_inst, PC_update_inst, controller
+    instances = [fetching_inst, decoding_inst, execution_inst, memory_access_inst, writing_back_inst, PC_update_inst, controller]
+    if counters is not None:
+        instances.append(counters_block(clk, reset, retire, state, icode, ifun, Cnd, Stat, counters))
+    return instances
 
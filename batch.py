@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import yasm
+from utils import *
+from ram import MEM_SIZE
+from CPU import CYCLES_PER_INSTRUCTION
+
+
+DEFAULT_MAX_CYCLES = 6_000_000
+DEFAULT_TIMEOUT = 60.0
+BACKENDS = ("hdl", "interp", "translate")
+# Instructions (or clock cycles for hdl) simulated between timeout checks
+CHUNK = 10_000
+
+
+def find_programs(path: str) -> list[str]:
+    """List the .ys programs in a directory tree, or the ones named in a manifest file.
+
+    A manifest has one path per line, relative to the manifest itself; blank
+    lines and lines starting with '#' are ignored.
+    """
+    if os.path.isdir(path):
+        found = []
+        for root, _, files in os.walk(path):
+            found.extend(os.path.join(root, name) for name in files if name.endswith('.ys'))
+        return sorted(found)
+    base = os.path.dirname(path)
+    with open(path, 'r') as file:
+        lines = [line.strip() for line in file]
+    return [os.path.join(base, line) for line in lines if line and not line.startswith('#')]
+
+
+def changed_memory(image: list, data: bytearray | bytes) -> dict[str, int]:
+    """Bytes of data that differ from the freshly loaded program image"""
+    initial = bytearray(len(data))
+    initial[:len(image)] = bytes(int(b) for b in image)
+    return {str(addr): data[addr] for addr in range(len(data)) if data[addr] != initial[addr]}
+
+
+def _run_functional(backend: str, program: list, main: int, mem_size: int, max_cycles: int, deadline: float) -> dict:
+    if backend == "translate":
+        from translator import Translator as Machine
+    else:
+        from interpreter import Interpreter as Machine
+    machine = Machine(program, main, mem_size)
+    max_instructions = max_cycles // CYCLES_PER_INSTRUCTION
+    stopped = "halt"
+    while machine.stat == SAOK:
+        if machine.instructions >= max_instructions:
+            stopped = "max_cycles"
+            break
+        if time.monotonic() > deadline:
+            stopped = "timeout"
+            break
+        machine.run(min(CHUNK, max_instructions - machine.instructions))
+    return {
+        "stat": machine.stat,
+        "stopped": stopped,
+        "pc": machine.pc,
+        "registers": machine.regs,
+        "cc": machine.cc,
+        "cycles": machine.instructions * CYCLES_PER_INSTRUCTION,
+        "instructions": machine.instructions,
+        "mem": machine.mem,
+    }
+
+
+def _run_hdl(program: list, main: int, mem_size: int, max_cycles: int, deadline: float, mode: str) -> dict:
+    from simulate import run
+
+    result = run(program, main, max_cycles=max_cycles, timeout=max(deadline - time.monotonic(), 0),
+                 mem_size=mem_size, verbose=False, mode=mode)
+    return {
+        "stat": result.status,
+        "stopped": result.stopped,
+        "pc": result.pc,
+        "registers": result.registers,
+        "cc": result.cc,
+        "cycles": result.cycles,
+        "instructions": result.instructions,
+        "mem": result.mem,
+        "counters": result.counters.report(),
+    }
+
+
+def run_image(program: list | bytes | memoryview, main: int, backend: str = "hdl",
+              max_cycles: int = DEFAULT_MAX_CYCLES, timeout: float = DEFAULT_TIMEOUT, mem_size: int = MEM_SIZE,
+              mode: str = "multi") -> dict:
+    """Simulate an assembled program, returning a JSON-serialisable summary"""
+    start = time.monotonic()
+    if main == -1:
+        raise ValueError("No main function found")
+    if backend == "hdl":
+        run = _run_hdl(program, main, mem_size, max_cycles, start + timeout, mode)
+    else:
+        run = _run_functional(backend, program, main, mem_size, max_cycles, start + timeout)
+    result = {
+        "stat": stat_names.get(run["stat"], str(run["stat"])),
+        "stopped": run["stopped"],
+        "pc": run["pc"],
+        "registers": {regs[i]: int(val) for i, val in enumerate(run["registers"])},
+        "cc": run["cc"],
+        "memory": changed_memory(program, run["mem"]),
+        "cycles": run["cycles"],
+        "instructions": run["instructions"],
+    }
+    if "counters" in run:
+        result["counters"] = run["counters"]
+    return result
+
+
+def run_job(path: str, backend: str = "hdl", max_cycles: int = DEFAULT_MAX_CYCLES,
+            timeout: float = DEFAULT_TIMEOUT, mem_size: int = MEM_SIZE, mode: str = "multi",
+            cache: str | None = None) -> dict:
+    """Assemble and simulate one program, returning a JSON-serialisable summary.
+
+    Given a cache directory, assembled programs are kept in and loaded from
+    an ObjectCache there.
+    """
+    start = time.monotonic()
+    result = {"path": path, "backend": backend}
+    try:
+        if cache is not None:
+            from objcache import ObjectCache
+            program, labels = ObjectCache(cache).assemble_file(path)
+        else:
+            program, labels = yasm.assemble_file(path)
+        result.update(run_image(program, labels.get('main', -1), backend, max_cycles,
+                                timeout - (time.monotonic() - start), mem_size, mode))
+    except Exception as e:
+        result.update(error=f"{type(e).__name__}: {e}", wall_time=time.monotonic() - start)
+        return result
+    result["wall_time"] = time.monotonic() - start
+    return result
+
+
+def run_batch(paths: list[str], backend: str = "hdl", max_cycles: int = DEFAULT_MAX_CYCLES,
+              timeout: float = DEFAULT_TIMEOUT, jobs: int | None = None, out=sys.stdout, mode: str = "multi",
+              cache: str | None = None, mem_size: int = MEM_SIZE):
+    """Simulate every program in a process pool and write one JSON line per program as it finishes"""
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        futures = [pool.submit(run_job, path, backend, max_cycles, timeout, mem_size, mode, cache) for path in paths]
+        for future in as_completed(futures):
+            out.write(json.dumps(future.result()) + "\n")
+            out.flush()
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Assemble and simulate many Y86 programs in parallel")
+    parser.add_argument("path", help="directory with .ys programs or a manifest listing them")
+    parser.add_argument("--backend", choices=BACKENDS, default="hdl")
+    parser.add_argument("--mode", choices=("multi", "seq", "pipe"), default="multi",
+                        help="hdl processor: multi-phase CPU(), single-cycle SEQ() or pipelined PIPE()")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--max-cycles", type=int, default=DEFAULT_MAX_CYCLES)
+    parser.add_argument("--mem-size", type=int, default=MEM_SIZE)
+    parser.add_argument("--cache", help="directory of cached assembled programs")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="seconds per program")
+    args = parser.parse_args(argv)
+    run_batch(find_programs(args.path), args.backend, args.max_cycles, args.timeout, args.jobs, mode=args.mode,
+              cache=args.cache, mem_size=args.mem_size)
+
+
+if __name__ == "__main__":
+    main()
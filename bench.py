@@ -0,0 +1,150 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import yasm
+from isa import *
+
+
+SCHEMA_VERSION = 1
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+BENCH_MEM_SIZE = 8192
+# HDL processor modes run through simulate.run(), functional models through run()
+HDL_BACKENDS = ("multi", "seq", "pipe")
+BACKENDS = HDL_BACKENDS + ("interp", "translate")
+DEFAULT_MAX_INSTRUCTIONS = 100_000
+ASSEMBLE_REPEAT = 20
+# Relative throughput drop reported as a regression by compare_results()
+DEFAULT_TOLERANCE = 0.2
+
+
+def bench_assembler(path: str, repeat: int = ASSEMBLE_REPEAT) -> dict:
+    """Assemble the file repeat times and report machine code and source bytes per second"""
+    source_bytes = os.path.getsize(path)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        program, _ = yasm.assemble_file(path)
+    seconds = time.perf_counter() - start
+    return {
+        "bytes": len(program),
+        "source_bytes": source_bytes,
+        "seconds": seconds / repeat,
+        "bytes_per_sec": len(program) * repeat / seconds,
+        "source_bytes_per_sec": source_bytes * repeat / seconds,
+    }
+
+
+def bench_backend(path: str, backend: str, max_instructions: int = DEFAULT_MAX_INSTRUCTIONS) -> dict:
+    """Simulate one workload on one backend; meant to run in a fresh process so peak RSS is its own"""
+    program, labels = yasm.assemble_file(path)
+    main = labels['main']
+    if backend in HDL_BACKENDS:
+        from simulate import run
+
+        start = time.perf_counter()
+        result = run(program, main, max_instructions=max_instructions, mem_size=BENCH_MEM_SIZE,
+                     verbose=False, mode=backend)
+        seconds = time.perf_counter() - start
+        stat, instructions, cycles, rax = result.status, result.instructions, result.cycles, result.registers[0]
+    else:
+        if backend == "translate":
+            from translator import Translator as Machine
+        else:
+            from interpreter import Interpreter as Machine
+        machine = Machine(program, main, BENCH_MEM_SIZE)
+        start = time.perf_counter()
+        machine.run(max_instructions)
+        seconds = time.perf_counter() - start
+        stat, instructions, cycles, rax = machine.stat, machine.instructions, None, machine.regs[0]
+    return {
+        "stat": stat_names.get(stat, str(stat)),
+        "rax": int(rax),
+        "instructions": instructions,
+        "cycles": cycles,
+        "seconds": seconds,
+        "instructions_per_sec": instructions / seconds if seconds else None,
+        "cycles_per_sec": cycles / seconds if cycles is not None and seconds else None,
+        # kilobytes on Linux
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def run_suite(paths: list[str], backends: tuple[str, ...] = BACKENDS,
+              max_instructions: int = DEFAULT_MAX_INSTRUCTIONS) -> dict:
+    """Benchmark every workload on every backend, one at a time, each simulation in its own process"""
+    results = {
+        "schema": SCHEMA_VERSION,
+        "python": platform.python_version(),
+        "max_instructions": max_instructions,
+        "workloads": {},
+    }
+    ctx = get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=ctx, max_tasks_per_child=1) as pool:
+        for path in paths:
+            name = os.path.splitext(os.path.basename(path))[0]
+            entry = {"assembler": bench_assembler(path), "backends": {}}
+            for backend in backends:
+                entry["backends"][backend] = pool.submit(bench_backend, path, backend, max_instructions).result()
+            results["workloads"][name] = entry
+    return results
+
+
+def compare_results(old: dict, new: dict, tolerance: float = DEFAULT_TOLERANCE) -> list[str]:
+    """Describe every throughput drop beyond tolerance and every change in simulated results"""
+    problems = []
+    for name, entry in new["workloads"].items():
+        before = old["workloads"].get(name)
+        if before is None:
+            continue
+        rate, old_rate = entry["assembler"]["bytes_per_sec"], before["assembler"]["bytes_per_sec"]
+        if rate < old_rate * (1 - tolerance):
+            problems.append(f"{name} assembler: {rate:.0f} < {old_rate:.0f} bytes/sec")
+        for backend, res in entry["backends"].items():
+            prev = before["backends"].get(backend)
+            if prev is None:
+                continue
+            for key in ("stat", "rax", "instructions", "cycles"):
+                if res[key] != prev[key]:
+                    problems.append(f"{name} {backend}: {key} {res[key]} != {prev[key]}")
+            rate, old_rate = res["instructions_per_sec"], prev["instructions_per_sec"]
+            if rate is not None and old_rate is not None and rate < old_rate * (1 - tolerance):
+                problems.append(f"{name} {backend}: {rate:.0f} < {old_rate:.0f} instructions/sec")
+    return problems
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Benchmark the assembler and the Y86 simulators")
+    parser.add_argument("paths", nargs="*", help=f".ys workloads (default: every program in {BENCH_DIR})")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--max-instructions", type=int, default=DEFAULT_MAX_INSTRUCTIONS)
+    parser.add_argument("--out", help="write the JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    paths = args.paths or sorted(os.path.join(BENCH_DIR, name) for name in os.listdir(BENCH_DIR)
+                                 if name.endswith('.ys'))
+    results = run_suite(paths, tuple(args.backends), args.max_instructions)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            problems = compare_results(json.load(file), results, args.tolerance)
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
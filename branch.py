@@ -0,0 +1,220 @@
+from abc import ABC, abstractmethod
+
+from isa import *
+from interpreter import COND_TABLE
+
+
+# Cycles lost by PIPE() on a mispredicted branch: the two wrongly fetched instructions become bubbles
+MISPREDICT_PENALTY = 2
+DEFAULT_ENTRIES = 1024
+DEFAULT_HISTORY = 8
+
+
+class Predictor(ABC):
+    """Predicts whether a conditional jump at pc to target is taken and learns from the outcome"""
+    name = "predictor"
+
+    @abstractmethod
+    def predict(self, pc: int, target: int) -> bool:
+        ...
+
+    def update(self, pc: int, target: int, taken: bool):
+        pass
+
+
+class AlwaysTaken(Predictor):
+    """The static rule of PIPE(): every branch is taken"""
+    name = "taken"
+
+    def predict(self, pc: int, target: int) -> bool:
+        return True
+
+
+class BTFNT(Predictor):
+    """Backward taken, forward not taken: loops close with backward jumps"""
+    name = "btfnt"
+
+    def predict(self, pc: int, target: int) -> bool:
+        return target <= pc
+
+
+class TwoBit(Predictor):
+    """A table of 2-bit saturating counters indexed by the branch PC, starting weakly taken"""
+    name = "2bit"
+
+    def __init__(self, entries: int = DEFAULT_ENTRIES):
+        if entries <= 0 or entries & (entries - 1):
+            raise ValueError(f"Number of entries must be a power of two, got {entries}")
+        self.mask = entries - 1
+        self.counters = bytearray([2]) * entries
+
+    def index(self, pc: int) -> int:
+        return pc & self.mask
+
+    def predict(self, pc: int, target: int) -> bool:
+        return self.counters[self.index(pc)] >= 2
+
+    def update(self, pc: int, target: int, taken: bool):
+        i = self.index(pc)
+        if taken:
+            if self.counters[i] < 3:
+                self.counters[i] += 1
+        elif self.counters[i] > 0:
+            self.counters[i] -= 1
+
+
+class GShare(TwoBit):
+    """2-bit counters indexed by the branch PC xor the outcomes of the last history_bits branches"""
+    name = "gshare"
+
+    def __init__(self, history_bits: int = DEFAULT_HISTORY, entries: int = DEFAULT_ENTRIES):
+        super().__init__(entries)
+        self.history_mask = (1 << history_bits) - 1
+        self.history = 0
+
+    def index(self, pc: int) -> int:
+        return (pc ^ self.history) & self.mask
+
+    def update(self, pc: int, target: int, taken: bool):
+        super().update(pc, target, taken)
+        self.history = (self.history << 1 | taken) & self.history_mask
+
+
+PREDICTORS = {cls.name: cls for cls in (AlwaysTaken, BTFNT, TwoBit, GShare)}
+
+
+class BranchStats:
+    """Accuracy of several predictors on the conditional jumps of one run.
+
+    record() is called once per executed conditional jump with its PC,
+    target and outcome; every predictor predicts it and is then updated.
+    Unconditional jumps, calls and returns are not counted. The penalty
+    estimate charges MISPREDICT_PENALTY cycles per misprediction, as PIPE()
+    does.
+    """
+
+    def __init__(self, predictors: list[Predictor], penalty: int = MISPREDICT_PENALTY):
+        self.predictors = predictors
+        self.penalty = penalty
+        self.branches = 0
+        self.taken = 0
+        # pc -> [executions, taken, correct predictions of every predictor...]
+        self.by_pc = {}
+
+    def record(self, pc: int, target: int, taken: bool):
+        row = self.by_pc.get(pc)
+        if row is None:
+            row = self.by_pc[pc] = [0] * (2 + len(self.predictors))
+        row[0] += 1
+        row[1] += taken
+        self.branches += 1
+        self.taken += taken
+        for i, predictor in enumerate(self.predictors):
+            if predictor.predict(pc, target) == taken:
+                row[2 + i] += 1
+            predictor.update(pc, target, taken)
+
+    def report(self) -> dict:
+        """Machine-readable accuracy and penalty of every predictor, in total and per branch PC"""
+        result = {"branches": self.branches, "taken": self.taken, "penalty": self.penalty, "predictors": {}}
+        for i, predictor in enumerate(self.predictors):
+            correct = sum(row[2 + i] for row in self.by_pc.values())
+            result["predictors"][predictor.name] = {
+                "correct": correct,
+                "accuracy": correct / self.branches if self.branches else None,
+                "penalty_cycles": (self.branches - correct) * self.penalty,
+                "pcs": {str(pc): row[2 + i] / row[0] for pc, row in sorted(self.by_pc.items())},
+            }
+        result["pcs"] = {str(pc): {"executions": row[0], "taken": row[1]} for pc, row in sorted(self.by_pc.items())}
+        return result
+
+
+def branch_monitor(cpu, stats: BranchStats):
+    """Records every conditional jump retired by a CPU() or SEQ() instance into the stats.
+
+    The MyHDL block is built on the call, so evaluating predictors on the
+    interpreter does not import MyHDL.
+    """
+    from myhdl import always, block
+
+    @block
+    def monitor():
+        icode, ifun, valC, valP, Cnd, retire = (cpu.symdict[name] for name in (
+            "icode", "ifun", "valC", "valP", "Cnd", "retire"))
+
+        # retire changes together with the PC update, while icode and friends still describe the jump
+        @always(retire)
+        def record():
+            if icode.val == IJXX and ifun.val != 0:
+                # jXX is 9 bytes long
+                stats.record(int(valP.val) - 9, int(valC.val), bool(Cnd.val))
+        return record
+    return monitor()
+
+
+def branch_run(machine, stats: BranchStats, max_instructions: int | None = None) -> int:
+    """Run an Interpreter (or Translator, one instruction at a time) recording every conditional jump"""
+    count = 0
+    while machine.stat == SAOK and (max_instructions is None or count < max_instructions):
+        pc = machine.pc
+        icode, ifun, _, _, valC, _, _ = machine.code.lookup(pc)
+        if icode == IJXX and ifun != 0:
+            taken = COND_TABLE[machine.cc][ifun]
+        before = machine.instructions
+        machine.step()
+        if machine.instructions == before:
+            break
+        count += 1
+        if icode == IJXX and ifun != 0:
+            stats.record(pc, valC, taken)
+    return machine.stat
+
+
+def make_predictors(names: list[str], history_bits: int = DEFAULT_HISTORY,
+                    entries: int = DEFAULT_ENTRIES) -> list[Predictor]:
+    predictors = []
+    for name in names:
+        if name not in PREDICTORS:
+            raise ValueError(f"Unknown predictor {name!r}, expected one of {', '.join(PREDICTORS)}")
+        if name == GShare.name:
+            predictors.append(GShare(history_bits, entries))
+        elif name == TwoBit.name:
+            predictors.append(TwoBit(entries))
+        else:
+            predictors.append(PREDICTORS[name]())
+    return predictors
+
+
+def main(argv: list[str] | None = None):
+    import argparse
+    import json
+    import yasm
+    from ram import MEM_SIZE
+
+    parser = argparse.ArgumentParser(description="Evaluate branch predictors on a Y86 program")
+    parser.add_argument("path", help=".ys program")
+    parser.add_argument("--backend", choices=("multi", "seq", "interp"), default="interp",
+                        help="HDL processor or the interpreter, which is much faster and gives the same branches")
+    parser.add_argument("--predictors", nargs="+", choices=list(PREDICTORS), default=list(PREDICTORS))
+    parser.add_argument("--history", type=int, default=DEFAULT_HISTORY, help="gshare global history bits")
+    parser.add_argument("--entries", type=int, default=DEFAULT_ENTRIES, help="counters per table, a power of two")
+    parser.add_argument("--penalty", type=int, default=MISPREDICT_PENALTY, help="cycles per misprediction")
+    parser.add_argument("--mem-size", type=int, default=MEM_SIZE)
+    parser.add_argument("--max-instructions", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    image, labels = yasm.assemble_file(args.path)
+    main = labels.get('main', -1)
+    stats = BranchStats(make_predictors(args.predictors, args.history, args.entries), args.penalty)
+    if args.backend == "interp":
+        from interpreter import Interpreter
+        branch_run(Interpreter(image, main, args.mem_size), stats, args.max_instructions)
+    else:
+        from simulate import run
+        run(image, main, max_instructions=args.max_instructions, mem_size=args.mem_size, verbose=False,
+            mode=args.backend, branches=stats)
+    print(json.dumps(stats.report(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
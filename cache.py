@@ -0,0 +1,180 @@
+from bisect import bisect_right
+
+
+WRITE_BACK = "write-back"
+WRITE_THROUGH = "write-through"
+POLICIES = (WRITE_BACK, WRITE_THROUGH)
+
+
+class Cache:
+    """Timing model of a set-associative data cache in front of the RAM.
+
+    Only tags are kept: the RAM still holds the data, the cache decides how
+    many cycles each access costs. Lines are replaced least recently used.
+    A write-back cache allocates lines on write misses and pays miss_latency
+    again when it evicts a dirty line; a write-through cache sends every
+    write to memory at miss_latency and does not allocate on write misses.
+    The memory stage calls access() and the controller calls wait() on every
+    clock edge, stalling while the access has cycles left beyond the one the
+    stage takes anyway. Hits and misses are counted per region and per PC.
+    """
+
+    def __init__(self, size: int = 1024, assoc: int = 2, line_size: int = 32, policy: str = WRITE_BACK,
+                 hit_latency: int = 1, miss_latency: int = 10, regions: dict[str, tuple[int, int]] | None = None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown write policy {policy!r}, expected one of {', '.join(POLICIES)}")
+        if line_size <= 0 or line_size & (line_size - 1):
+            raise ValueError(f"Line size must be a power of two, got {line_size}")
+        if size % (assoc * line_size):
+            raise ValueError(f"Size {size} is not a multiple of associativity times line size")
+        self.size = size
+        self.assoc = assoc
+        self.line_size = line_size
+        self.policy = policy
+        self.hit_latency = hit_latency
+        self.miss_latency = miss_latency
+        self.n_sets = size // (assoc * line_size)
+        self.shift = line_size.bit_length() - 1
+        # Per set: tag -> dirty, least recently used first
+        self.sets = [{} for _ in range(self.n_sets)]
+        # (start, end, name) sorted by start; addresses outside all regions count as "other"
+        self.regions = sorted((start, end, name) for name, (start, end) in (regions or {}).items())
+        self._starts = [start for start, _, _ in self.regions]
+        self.stall = 0
+        self.reads = 0
+        self.writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.writebacks = 0
+        self.stall_cycles = 0
+        self.by_region = {}
+        self.by_pc = {}
+
+    def region(self, addr: int) -> str:
+        i = bisect_right(self._starts, addr)
+        if i and addr < self.regions[i - 1][1]:
+            return self.regions[i - 1][2]
+        return "other"
+
+    def _line(self, line: int, write: bool) -> tuple[bool, int]:
+        """Look up one line and return whether it hit and the cycles it costs beyond a hit"""
+        ways = self.sets[line % self.n_sets]
+        tag = line // self.n_sets
+        if tag in ways:
+            dirty = ways.pop(tag)
+            if write and self.policy == WRITE_THROUGH:
+                ways[tag] = False
+                return True, self.miss_latency
+            ways[tag] = dirty or write
+            return True, 0
+        if write and self.policy == WRITE_THROUGH:
+            return False, self.miss_latency
+        latency = self.miss_latency
+        if len(ways) >= self.assoc:
+            victim = next(iter(ways))
+            if ways.pop(victim):
+                self.writebacks += 1
+                latency += self.miss_latency
+        ways[tag] = write
+        return False, latency
+
+    def access(self, addr: int, pc: int, write: bool) -> int:
+        """Account for an 8-byte access by the instruction at pc and return its latency in cycles"""
+        first = addr >> self.shift
+        last = (addr + 7) >> self.shift
+        latency = 0
+        hit = True
+        for line in range(first, last + 1):
+            line_hit, cost = self._line(line, write)
+            latency += cost
+            hit = hit and line_hit
+        latency = max(latency, self.hit_latency)
+        if write:
+            self.writes += 1
+        else:
+            self.reads += 1
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        for table, key in ((self.by_region, self.region(addr)), (self.by_pc, pc)):
+            counts = table.get(key)
+            if counts is None:
+                counts = table[key] = [0, 0]
+            counts[0 if hit else 1] += 1
+        self.stall = latency - 1
+        self.stall_cycles += latency - 1
+        return latency
+
+    def wait(self) -> bool:
+        """Use up one stall cycle of the last access, False once there are none left"""
+        if self.stall > 0:
+            self.stall -= 1
+            return True
+        return False
+
+    def report(self) -> dict:
+        """Machine-readable configuration, totals and hit/miss counts per region and per PC"""
+        accesses = self.hits + self.misses
+
+        def rows(table: dict) -> dict:
+            return {str(key): {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses)}
+                    for key, (hits, misses) in sorted(table.items(), key=lambda item: -item[1][1])}
+
+        return {
+            "size": self.size,
+            "assoc": self.assoc,
+            "line_size": self.line_size,
+            "policy": self.policy,
+            "hit_latency": self.hit_latency,
+            "miss_latency": self.miss_latency,
+            "reads": self.reads,
+            "writes": self.writes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / accesses if accesses else None,
+            "writebacks": self.writebacks,
+            "stall_cycles": self.stall_cycles,
+            "regions": rows(self.by_region),
+            "pcs": rows(self.by_pc),
+        }
+
+
+def main(argv: list[str] | None = None):
+    import argparse
+    import json
+    import yasm
+    from ram import MEM_SIZE
+    from simulate import run
+
+    parser = argparse.ArgumentParser(description="Simulate a Y86 program with a data cache timing model")
+    parser.add_argument("path", help=".ys program")
+    parser.add_argument("--mode", choices=("multi", "seq"), default="multi")
+    parser.add_argument("--mem-size", type=int, default=MEM_SIZE)
+    parser.add_argument("--max-cycles", type=int, default=None)
+    parser.add_argument("--size", type=int, default=1024, help="cache size in bytes")
+    parser.add_argument("--assoc", type=int, default=2)
+    parser.add_argument("--line-size", type=int, default=32)
+    parser.add_argument("--policy", choices=POLICIES, default=WRITE_BACK)
+    parser.add_argument("--hit-latency", type=int, default=1)
+    parser.add_argument("--miss-latency", type=int, default=10)
+    parser.add_argument("--region", action="append", default=[], metavar="NAME:START:END",
+                        help="named address range for the statistics (default: code and data)")
+    args = parser.parse_args(argv)
+
+    image, labels = yasm.assemble_file(args.path)
+    regions = {"code": (0, len(image)), "data": (len(image), args.mem_size)}
+    if args.region:
+        regions = {}
+        for spec in args.region:
+            name, start, end = spec.split(':')
+            regions[name] = (int(start, 0), int(end, 0))
+    cache = Cache(args.size, args.assoc, args.line_size, args.policy, args.hit_latency, args.miss_latency, regions)
+    result = run(image, labels.get('main', -1), max_cycles=args.max_cycles, mem_size=args.mem_size, verbose=False,
+                 mode=args.mode, cache=cache)
+    report = {"cycles": result.cycles, "instructions": result.instructions, "cache": cache.report()}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
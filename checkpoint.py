@@ -0,0 +1,148 @@
+import mmap
+import struct
+from dataclasses import dataclass, field
+
+from isa import wrap64
+from utils import *
+from CPU import CYCLES_PER_INSTRUCTION
+
+
+MAGIC = b'Y86C'
+VERSION = 1
+PAGE_SIZE = 256
+# magic, version, page size, memory size, code end, pc, 15 registers, CC, Stat,
+# instructions, cycles, number of stored pages
+HEADER = struct.Struct('<4sHIQQQ15qBBQQI')
+PAGE_INDEX = struct.Struct('<Q')
+
+
+@dataclass
+class Checkpoint:
+    """Architectural state of a Y86 machine: PC, registers, CC, Stat and memory.
+
+    Memory is kept as a dict from page number to the contents of every page
+    that is not all zeros. code_end is the size of the loaded program, which
+    is the region the predecode table covers.
+    """
+    pc: int
+    registers: list[int]
+    cc: int
+    stat: int
+    mem_size: int
+    code_end: int
+    pages: dict[int, bytes | memoryview] = field(repr=False)
+    instructions: int = 0
+    cycles: int = 0
+
+    @staticmethod
+    def split_pages(data: bytearray | bytes) -> dict[int, bytes]:
+        zero = bytes(PAGE_SIZE)
+        pages = {}
+        for start in range(0, len(data), PAGE_SIZE):
+            page = data[start:start + PAGE_SIZE]
+            if page != zero[:len(page)]:
+                pages[start // PAGE_SIZE] = bytes(page)
+        return pages
+
+    @classmethod
+    def capture(cls, machine) -> "Checkpoint":
+        """Checkpoint of an Interpreter (or Translator)"""
+        return cls(pc=machine.pc, registers=list(machine.regs), cc=machine.cc, stat=machine.stat,
+                   mem_size=len(machine.mem), code_end=machine.code.code_end,
+                   pages=cls.split_pages(machine.mem), instructions=machine.instructions,
+                   cycles=machine.instructions * CYCLES_PER_INSTRUCTION)
+
+    @classmethod
+    def from_result(cls, result, code_end: int) -> "Checkpoint":
+        """Checkpoint of the final state of a simulate.run() of CPU()"""
+        return cls(pc=result.pc, registers=[wrap64(val) for val in result.registers], cc=result.cc,
+                   stat=result.status, mem_size=len(result.mem), code_end=code_end,
+                   pages=cls.split_pages(result.mem), instructions=result.instructions, cycles=result.cycles)
+
+    def memory(self) -> bytearray:
+        """Full memory contents"""
+        data = bytearray(self.mem_size)
+        for number, page in self.pages.items():
+            start = number * PAGE_SIZE
+            data[start:start + len(page)] = page
+        return data
+
+    def restore(self, cls=None):
+        """New Interpreter (or cls, e.g. Translator) in the checkpointed state"""
+        if cls is None:
+            from interpreter import Interpreter as cls
+        data = self.memory()
+        machine = cls(data[:self.code_end], self.pc, self.mem_size)
+        machine.mem[:] = data
+        machine.regs[:] = self.registers
+        machine.cc = self.cc
+        machine.stat = self.stat
+        machine.instructions = self.instructions
+        return machine
+
+
+def save(path: str, ckpt: Checkpoint):
+    numbers = sorted(ckpt.pages)
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, PAGE_SIZE, ckpt.mem_size, ckpt.code_end, ckpt.pc,
+                               *ckpt.registers, ckpt.cc, ckpt.stat, ckpt.instructions, ckpt.cycles, len(numbers)))
+        for number in numbers:
+            file.write(PAGE_INDEX.pack(number))
+        for number in numbers:
+            file.write(bytes(ckpt.pages[number]).ljust(PAGE_SIZE, b'\0'))
+
+
+def load(path: str) -> Checkpoint:
+    """Load a checkpoint; its pages are views into a read-only memory map of the file"""
+    with open(path, 'rb') as file:
+        data = memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+    fields = HEADER.unpack_from(data)
+    magic, version, page_size, mem_size, code_end, pc = fields[:6]
+    registers = list(fields[6:21])
+    cc, stat, instructions, cycles, n_pages = fields[21:]
+    if magic != MAGIC or version != VERSION or page_size != PAGE_SIZE:
+        raise ValueError(f"Not a version {VERSION} Y86 checkpoint: {path}")
+    offset = HEADER.size + n_pages * PAGE_INDEX.size
+    pages = {}
+    for i in range(n_pages):
+        (number,) = PAGE_INDEX.unpack_from(data, HEADER.size + i * PAGE_INDEX.size)
+        start = offset + i * PAGE_SIZE
+        pages[number] = data[start:start + min(PAGE_SIZE, mem_size - number * PAGE_SIZE)]
+    return Checkpoint(pc=pc, registers=registers, cc=cc, stat=stat, mem_size=mem_size, code_end=code_end,
+                      pages=pages, instructions=instructions, cycles=cycles)
+
+
+class Timeline:
+    """Runs a functional machine while taking a checkpoint every interval instructions.
+
+    seek() goes back (or forward) to any instruction count by restoring the
+    nearest earlier checkpoint and replaying from there.
+    """
+
+    def __init__(self, machine, interval: int = 10_000):
+        self.machine = machine
+        self.interval = interval
+        self.checkpoints = [Checkpoint.capture(machine)]
+
+    def run(self, max_instructions: int | None = None) -> int:
+        machine = self.machine
+        limit = None if max_instructions is None else machine.instructions + max_instructions
+        while machine.stat == SAOK and (limit is None or machine.instructions < limit):
+            next_checkpoint = (machine.instructions // self.interval + 1) * self.interval
+            if limit is not None:
+                next_checkpoint = min(next_checkpoint, limit)
+            machine.run(next_checkpoint - machine.instructions)
+            if machine.instructions % self.interval == 0 and machine.instructions > self.checkpoints[-1].instructions:
+                self.checkpoints.append(Checkpoint.capture(machine))
+        return machine.stat
+
+    def seek(self, instructions: int):
+        """Machine in the state after the given number of instructions"""
+        ckpt = max((c for c in self.checkpoints if c.instructions <= instructions), key=lambda c: c.instructions)
+        self.machine = ckpt.restore(type(self.machine))
+        self.machine.run(instructions - ckpt.instructions)
+        return self.machine
+
+    def seek_cycle(self, cycle: int):
+        """Machine in the state after the instruction running at the given cycle"""
+        return self.seek(cycle // CYCLES_PER_INSTRUCTION)
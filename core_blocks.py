@@ -1,69 +1,40 @@
 from myhdl import block, always_seq, intbv
 from myhdl._Signal import _Signal
 from utils import *
+from ram import RAM, MASK64
 
 
 @block
-def fetching(program: list[intbv], clk: _Signal, reset: _Signal, pc: _Signal, 
+def fetching(mem: RAM, clk: _Signal, reset: _Signal, pc: _Signal, 
                             icode: _Signal, ifun: _Signal, rA: _Signal, rB: _Signal, 
                             valC: _Signal, valP: _Signal, instr_valid: _Signal, \
-                            imem_error: _Signal, enable: _Signal):
+                            imem_error: _Signal, enable: _Signal, profiler: "Profiler | None" = None):
+    start = profiler.start if profiler is not None else None
+
     @always_seq(clk.posedge, reset=reset)
     def fetch():
         if not enable.val:
             return
+        if start is not None:
+            start()
         
-        # Read current PC value
-        pc_val = int(pc)
-        if pc_val < 0 or pc_val >= len(program):
-            instr_valid.next = 0
-            imem_error.next = 1
-            return
-        
-        # Get instruction data
-        instr = intbv(program[pc_val])[8:]
-    
-        # Calculate all values first
-        icode_val = instr[8:4]
-        ifun_val = instr[4:]
-
-        if icode_val < 0 or icode_val > 0xB:
+        # Instructions are predecoded when the program is loaded
+        icode_val, ifun_val, rA_val, rB_val, valC_val, valP_val, stat = mem.fetch(int(pc))
+        if stat in (SADR, SINS):
             instr_valid.next = 0
-            imem_error.next = 0
+            imem_error.next = stat == SADR
+            # A bubble instead of the previous instruction, which the later stages would execute again
+            icode.next = INOP
+            ifun.next = 0
+            valP.next = pc.val
             return
 
         icode.next = icode_val
         ifun.next = ifun_val
-        
-        # Determine instruction type using named constants
-        is_simple = icode_val in [IHALT, INOP, IJXX, ICALL, IRET]
-        
-        if is_simple:
-            rA.next = RNONE
-            rB.next = RNONE
-            
-            if icode_val in [IHALT, INOP, IRET]:
-                valC.next = intbv(0)[64:]
-                valP.next = pc_val + 1
-            else:
-                # Calculate immediate value for JXX and CALL
-                immediate_val = read_8byte_number(program, pc_val + 1)
-                valC.next = intbv(immediate_val)[64:]
-                valP.next = pc_val + 9
-        else:
-            # Handle register instructions
-            regs = intbv(program[pc_val + 1])[8:]
-            rA.next = regs[8:4]
-            rB.next = regs[4:]
-            
-            # Use named constants for instruction types
-            if icode_val in [IIRMOVQ, IRMMOVQ, IMRMOVQ]:
-                immediate_val = read_8byte_number(program, pc_val + 2)
-                valC.next = immediate_val
-                valP.next = pc_val + 10
-            else:
-                valC.next = intbv(0)[64:]
-                valP.next = pc_val + 2
+        rA.next = rA_val
+        rB.next = rB_val
+        valC.next = valC_val
+        valP.next = valP_val
 
     return fetch
 
@@ -129,9 +100,9 @@ def execution(clk: _Signal, reset: _Signal,  icode: _Signal, ifun: _Signal, \
         #CC = intvbv(0)[3:] and CC[0] -> ZF, CC[1] -> SF, CC[2] -> OF
         if icode.val == IOPQ:
             if ifun.val == 0:
-                valE.next = valA + valB
+                valE.next = wrap64(valA + valB)
             elif ifun.val == 1:
-                valE.next = valA - valB
+                valE.next = wrap64(valA - valB)
             elif ifun.val == 2:
                 valE.next = valA & valB
             elif ifun.val == 3:
@@ -141,21 +112,21 @@ def execution(clk: _Signal, reset: _Signal,  icode: _Signal, ifun: _Signal, \
                 CC.next[0] = 1
             if valE.next < 0:
                 CC.next[1] = 1
-            if is_overflow(valA.val, valB.val, valE.val, ifun.val):
+            if is_overflow(valA.val, valB.val, valE.next, ifun.val):
                 CC.next[2] = 1
         else:
-            valE.next = aluA + aluB
+            valE.next = wrap64(aluA + aluB)
             
         if icode.val == IJXX or icode.val == ICMOVXX:
             Cnd.next = Cond(CC.val, ifun.val)
 
         #dstE
         if icode.val == ICMOVXX and ifun.val != 0:
-            if Cnd.val:
+            if Cnd.next:
                 dstE.next = rB.val
             else:
                 dstE.next = RNONE
-        elif icode.val in [IOPQ, IRRMOVQ, IIRMOVQ, IMRMOVQ]:
+        elif icode.val in [IOPQ, IRRMOVQ, IIRMOVQ]:
             dstE.next = rB.val
         elif icode.val in [IPUSHQ, ICALL, IPOPQ, IRET]:
             dstE.next = RRSP
@@ -175,7 +146,10 @@ def execution(clk: _Signal, reset: _Signal,  icode: _Signal, ifun: _Signal, \
 def memory_access(clk: _Signal, reset: _Signal, icode: _Signal,
                   valE: _Signal, valA: _Signal, valP: _Signal, valM: _Signal,
                   imem_error: _Signal, dmem_error: _Signal,
-                  instr_valid: _Signal, Stat: _Signal, mem: list[intbv], enable: _Signal):
+                  instr_valid: _Signal, Stat: _Signal, mem: RAM, enable: _Signal,
+                  journal: Journal | None = None, pc: _Signal | None = None, cache: "Cache | None" = None):
+    cache_access = cache.access if cache is not None else None
+
     @always_seq(clk.posedge, reset=reset)
     def access():
         if not enable.val:
@@ -200,18 +174,20 @@ def memory_access(clk: _Signal, reset: _Signal, icode: _Signal,
             mem_data = valA.val
 
         if mem_read or mem_write:
-            dmem_error.next = mem_addr >= len(mem)
+            dmem_error.next = not mem.valid(int(mem_addr))
 
         if mem_read and not dmem_error.next:
-            valM.next = read_8byte_number_sig(mem, mem_addr)
+            valM.next = mem.read(int(mem_addr))
         if mem_write and not dmem_error.next:
-            write_8byte_number_sig(mem, mem_addr, mem_data)
+            mem.write(int(mem_addr), mem_data, journal)
+        if cache_access is not None and (mem_read or mem_write) and not dmem_error.next:
+            cache_access(int(mem_addr), int(pc.val), mem_write)
 
         if imem_error.val:
             Stat.next = SADR  # Address error
         elif not instr_valid.val:
             Stat.next = SINS  # Invalid instruction
-        elif dmem_error.val:
+        elif dmem_error.next:
             Stat.next = SADR  # Data memory error
         elif icode.val == IHALT:
             Stat.next = SHLT  # Halt
@@ -222,7 +198,9 @@ def memory_access(clk: _Signal, reset: _Signal, icode: _Signal,
 
 @block
 def writing_back(clk: _Signal, reset: _Signal, valM: _Signal, valE: _Signal, \
-    dstE: _Signal, dstM: _Signal, Regs: list[_Signal], enable: _Signal, icode: _Signal):
+    dstE: _Signal, dstM: _Signal, Regs: list[_Signal], enable: _Signal, icode: _Signal,
+    journal: Journal | None = None):
+    record_reg = journal.record_reg if journal is not None else None
 
     @always_seq(clk.posedge, reset=reset)
     def write_back():   
@@ -230,8 +208,12 @@ def writing_back(clk: _Signal, reset: _Signal, valM: _Signal, valE: _Signal, \
             return
         
         if dstE.val != RNONE:
+            if record_reg is not None:
+                record_reg(int(dstE.val), int(Regs[int(dstE.val)].val), int(valE.val))
             Regs[int(dstE.val)].next = valE.val
         if dstM.val != RNONE:
+            if record_reg is not None:
+                record_reg(int(dstM.val), int(Regs[int(dstM.val)].val), int(valM.val))
             Regs[int(dstM.val)].next = valM.val
     
     return write_back
@@ -239,19 +221,24 @@ def writing_back(clk: _Signal, reset: _Signal, valM: _Signal, valE: _Signal, \
 @block
 def PC_update(clk: _Signal, reset: _Signal, valP: _Signal, valM: _Signal, \
     Cnd: _Signal, Stat: _Signal, pc: _Signal, icode: _Signal,\
-         valC: _Signal, enable: _Signal):
+         valC: _Signal, enable: _Signal, profiler: "Profiler | None" = None):
+    retire = profiler.retire if profiler is not None else None
+
     @always_seq(clk.posedge, reset=reset)
     def update():
         if not enable.val:
             return
         
         if icode.val == ICALL:
-            pc.next = valC.val
+            new_pc = int(valC.val) & MASK64
         elif icode.val == IRET:
-            pc.next = valM.val
+            new_pc = int(valM.val) & MASK64
         elif icode.val == IJXX and Cnd.val:
-            pc.next = valC.val
+            new_pc = int(valC.val) & MASK64
         else:
-            pc.next = valP.val
+            new_pc = int(valP.val)
+        pc.next = new_pc
+        if retire is not None and Stat.val in (SAOK, SHLT):
+            retire(int(pc.val), int(icode.val), int(new_pc))
        
-    return update
\ No newline at end of file
+    return update
@@ -0,0 +1,324 @@
+import select
+import socket
+
+from isa import *
+from ram import MASK64
+
+
+# Watchpoints are indexed by the WATCH_GRANULE-byte blocks they cover
+WATCH_GRANULE = 64
+# Instructions run between checks for an interrupt from the debugger
+POLL_INSTRUCTIONS = 10_000
+DEFAULT_PORT = 1234
+# Y86 registers in the x86-64 order of the GDB 'g' packet; %r15 does not exist and reads as 0
+GDB_REGS = (RRAX, RRBX, RRCX, RRDX, RRSI, RRDI, RRBP, RRSP, RR8, RR9, RR10, RR11, RR12, RR13, RR14, None)
+GDB_PC = 16
+GDB_EFLAGS = 17
+# SIGTRAP and SIGSEGV
+SIGTRAP = 5
+SIGSEGV = 11
+
+
+class WatchIndex:
+    """Address intervals bucketed by the WATCH_GRANULE-byte blocks they overlap.
+
+    find() looks at the one or two blocks an 8-byte access touches, so its
+    cost does not depend on how many intervals are set elsewhere.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _blocks(self, start: int, length: int) -> range:
+        return range(start // WATCH_GRANULE, (start + length - 1) // WATCH_GRANULE + 1)
+
+    def add(self, start: int, length: int):
+        for block in self._blocks(start, length):
+            self.buckets.setdefault(block, []).append((start, length))
+        self.count += 1
+
+    def remove(self, start: int, length: int) -> bool:
+        found = False
+        for block in self._blocks(start, length):
+            intervals = self.buckets.get(block)
+            if intervals and (start, length) in intervals:
+                intervals.remove((start, length))
+                found = True
+                if not intervals:
+                    del self.buckets[block]
+        if found:
+            self.count -= 1
+        return found
+
+    def find(self, addr: int, n: int = 8) -> tuple[int, int] | None:
+        """An interval overlapping bytes [addr, addr + n), or None"""
+        for block in self._blocks(addr, n):
+            for start, length in self.buckets.get(block, ()):
+                if start < addr + n and addr < start + length:
+                    return start, length
+        return None
+
+
+class Debugger:
+    """PC breakpoints and memory write watchpoints on an Interpreter (or PagedInterpreter).
+
+    Breakpoints are a set of PCs checked before every instruction is
+    fetched. Watchpoints live in a WatchIndex that is only consulted on the
+    memory write path: while any are set, the machine's write_mem is
+    wrapped, and the wrapper is removed again with the last one. With
+    neither set, cont() is a plain machine.run().
+    """
+
+    def __init__(self, machine):
+        self.machine = machine
+        self.breakpoints = set()
+        self.watchpoints = WatchIndex()
+        # (address, value) of the store that hit a watchpoint during the last instruction
+        self.hit = None
+
+    def add_breakpoint(self, pc: int):
+        self.breakpoints.add(pc)
+
+    def remove_breakpoint(self, pc: int) -> bool:
+        if pc in self.breakpoints:
+            self.breakpoints.remove(pc)
+            return True
+        return False
+
+    def add_watchpoint(self, addr: int, length: int = 8):
+        self.watchpoints.add(addr, length)
+        self.machine.write_mem = self._write_mem
+
+    def remove_watchpoint(self, addr: int, length: int = 8) -> bool:
+        found = self.watchpoints.remove(addr, length)
+        if not self.watchpoints:
+            self.machine.__dict__.pop('write_mem', None)
+        return found
+
+    def _write_mem(self, addr: int, val: int) -> bool:
+        ok = type(self.machine).write_mem(self.machine, addr, val)
+        if ok and self.watchpoints.find(addr & MASK64):
+            self.hit = (addr & MASK64, val)
+        return ok
+
+    def step(self) -> str:
+        """Execute one instruction and return why the machine stopped: "step", "watchpoint" or "halt" """
+        self.hit = None
+        if self.machine.step() != SAOK:
+            return "halt"
+        return "watchpoint" if self.hit is not None else "step"
+
+    def cont(self, max_instructions: int | None = None, resume: bool = True) -> str:
+        """Run until a breakpoint, a watchpoint, Stat leaving SAOK or max_instructions.
+
+        Returns "breakpoint", "watchpoint", "halt" or "limit". When resuming,
+        a breakpoint at the current PC does not stop the machine before its
+        first instruction; pass resume=False to continue a run cut off by the
+        limit.
+        """
+        machine = self.machine
+        self.hit = None
+        if not self.breakpoints and not self.watchpoints:
+            return "halt" if machine.run(max_instructions) != SAOK else "limit"
+        breakpoints = self.breakpoints
+        step = machine.step
+        count = 0
+        while max_instructions is None or count < max_instructions:
+            if (count or not resume) and machine.pc in breakpoints:
+                return "breakpoint"
+            if step() != SAOK:
+                return "halt"
+            count += 1
+            if self.hit is not None:
+                return "watchpoint"
+        return "limit"
+
+
+class GdbServer:
+    """GDB remote serial protocol stub for a Debugger, on a local TCP socket.
+
+    Registers are reported in the x86-64 layout (%rip is the PC, eflags
+    holds ZF, SF and OF), so `gdb -ex 'set architecture i386:x86-64'
+    -ex 'target remote :1234'` can step, read registers and memory, and set
+    breakpoints (break *ADDR) and write watchpoints. Continuing can be
+    interrupted with Ctrl-C.
+    """
+
+    def __init__(self, debugger: Debugger, host: str = "127.0.0.1", port: int = DEFAULT_PORT):
+        self.debugger = debugger
+        self.host = host
+        self.port = port
+        self.conn = None
+        self.buf = b''
+
+    def serve(self):
+        """Accept one connection and answer packets until the client detaches or kills the target"""
+        with socket.create_server((self.host, self.port)) as server:
+            self.conn, _ = server.accept()
+        with self.conn:
+            while True:
+                packet = self.read_packet()
+                if packet is None:
+                    return
+                reply = self.handle(packet)
+                if reply is None:
+                    return
+                self.send(reply)
+
+    def read_packet(self) -> str | None:
+        while True:
+            start = self.buf.find(b'$')
+            end = self.buf.find(b'#', start)
+            if start != -1 and end != -1 and len(self.buf) >= end + 3:
+                data = self.buf[start + 1:end]
+                checksum = int(self.buf[end + 1:end + 3], 16)
+                self.buf = self.buf[end + 3:]
+                if sum(data) & 0xFF != checksum:
+                    self.conn.sendall(b'-')
+                    continue
+                self.conn.sendall(b'+')
+                return data.decode()
+            chunk = self.conn.recv(4096)
+            if not chunk:
+                return None
+            self.buf += chunk
+
+    def send(self, data: str):
+        encoded = data.encode()
+        self.conn.sendall(b'$' + encoded + b'#%02x' % (sum(encoded) & 0xFF))
+        # Wait for the acknowledgement, keeping anything that follows it
+        while not self.buf:
+            chunk = self.conn.recv(4096)
+            if not chunk:
+                return
+            self.buf += chunk
+        if self.buf[:1] == b'+':
+            self.buf = self.buf[1:]
+
+    def interrupted(self) -> bool:
+        """Check without blocking whether the client sent Ctrl-C"""
+        readable, _, _ = select.select([self.conn], [], [], 0)
+        if readable:
+            chunk = self.conn.recv(4096)
+            self.buf += chunk
+            if b'\x03' in self.buf:
+                self.buf = self.buf.replace(b'\x03', b'')
+                return True
+        return False
+
+    def stop_reply(self, reason: str) -> str:
+        machine = self.debugger.machine
+        if reason == "halt":
+            return "W00" if machine.stat == SHLT else f"X{SIGSEGV:02x}"
+        if reason == "watchpoint":
+            return f"T{SIGTRAP:02x}watch:{self.debugger.hit[0]:x};"
+        return f"S{SIGTRAP:02x}"
+
+    def register(self, number: int) -> str:
+        machine = self.debugger.machine
+        if number == GDB_PC:
+            return (machine.pc & MASK64).to_bytes(8, 'little').hex()
+        if number == GDB_EFLAGS:
+            # CC[0] -> ZF, CC[1] -> SF, CC[2] -> OF
+            cc = machine.cc
+            eflags = (cc & 1) << 6 | (cc >> 1 & 1) << 7 | (cc >> 2 & 1) << 11
+            return eflags.to_bytes(4, 'little').hex()
+        if number < len(GDB_REGS):
+            reg = GDB_REGS[number]
+            val = machine.regs[reg] if reg is not None else 0
+            return (val & MASK64).to_bytes(8, 'little').hex()
+        return ""
+
+    def read_memory(self, addr: int, length: int) -> str:
+        machine = self.debugger.machine
+        if hasattr(machine.mem, "read_bytes"):
+            if not machine.mem.valid(addr, length):
+                return "E14"
+            return machine.mem.read_bytes(addr, length).hex()
+        if addr < 0 or addr + length > len(machine.mem):
+            return "E14"
+        return bytes(machine.mem[addr:addr + length]).hex()
+
+    def handle(self, packet: str) -> str | None:
+        """Reply to one packet; None ends the session"""
+        debugger = self.debugger
+        kind = packet[:1]
+        if kind == '?':
+            return f"S{SIGTRAP:02x}"
+        if kind == 'g':
+            return "".join(self.register(i) for i in range(GDB_EFLAGS + 1))
+        if kind == 'p':
+            return self.register(int(packet[1:], 16)) or "E00"
+        if kind == 'm':
+            addr, length = (int(x, 16) for x in packet[1:].split(','))
+            return self.read_memory(addr, length)
+        if kind == 's':
+            return self.stop_reply(debugger.step())
+        if kind == 'c':
+            resume = True
+            while True:
+                reason = debugger.cont(POLL_INSTRUCTIONS, resume)
+                resume = False
+                if reason != "limit":
+                    return self.stop_reply(reason)
+                if self.interrupted():
+                    return f"S{SIGTRAP:02x}"
+        if kind in ('Z', 'z'):
+            point, addr, length = packet[1:].split(',')
+            addr, length = int(addr, 16), int(length, 16)
+            if point == '0':
+                if kind == 'Z':
+                    debugger.add_breakpoint(addr)
+                else:
+                    debugger.remove_breakpoint(addr)
+                return "OK"
+            if point == '2':
+                if kind == 'Z':
+                    debugger.add_watchpoint(addr, length)
+                else:
+                    debugger.remove_watchpoint(addr, length)
+                return "OK"
+            return ""
+        if kind == 'H':
+            return "OK"
+        if packet.startswith("qSupported"):
+            return "PacketSize=4000"
+        if packet == "qAttached":
+            return "1"
+        if kind in ('k', 'D'):
+            if kind == 'D':
+                self.send("OK")
+            return None
+        return ""
+
+
+def main(argv: list[str] | None = None):
+    import argparse
+    import yasm
+    from ram import MEM_SIZE
+
+    parser = argparse.ArgumentParser(description="Debug a Y86 program on the interpreter through a GDB remote stub")
+    parser.add_argument("path", help=".ys program")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--mem-size", type=int, default=MEM_SIZE)
+    parser.add_argument("--paged", action="store_true", help="use the sparse 64-bit memory of PagedInterpreter")
+    args = parser.parse_args(argv)
+
+    image, labels = yasm.assemble_file(args.path)
+    main = labels.get('main', -1)
+    if args.paged:
+        from paged import PagedInterpreter
+        machine = PagedInterpreter(image, main)
+    else:
+        from interpreter import Interpreter
+        machine = Interpreter(image, main, args.mem_size)
+    print(f"Listening on 127.0.0.1:{args.port}")
+    GdbServer(Debugger(machine), port=args.port).serve()
+
+
+if __name__ == "__main__":
+    main()
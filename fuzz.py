@@ -0,0 +1,300 @@
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import yasm
+from isa import *
+from interpreter import to_signed
+from predecode import decode
+
+
+# HDL processor modes run through simulate.run(), functional models directly
+HDL_BACKENDS = ("multi", "seq", "pipe")
+BACKENDS = HDL_BACKENDS + ("interp", "translate")
+DEFAULT_LENGTH = 24
+# Small memory keeps building the MyHDL RAM cheap; programs stay far below it
+DEFAULT_MEM_SIZE = 1024
+DEFAULT_MAX_INSTRUCTIONS = 200
+# Immediates are mostly data addresses, so loads and stores usually succeed
+INTERESTING = (0, 1, -1, 8, 63, 64, (1 << 63) - 1, -(1 << 63))
+GENERAL = [name for name in yasm.registers if name != "%rsp"]
+
+
+def generate(rng: random.Random, length: int = DEFAULT_LENGTH, mem_size: int = DEFAULT_MEM_SIZE) -> list[str]:
+    """Random valid Y86 program built from the yasm command and register tables.
+
+    Every register but %rsp starts with an irmovq of an interesting value or
+    a data address in the upper half of memory. Instructions get labels
+    l0, l1, ... and jumps and calls only go forward, so most programs reach
+    the final halt; ret and stores into the program can still send them
+    anywhere.
+    """
+    lines = ["$main:"]
+
+    def value() -> int:
+        if rng.random() < 0.6:
+            return rng.randrange(mem_size // 2, mem_size - 64)
+        return rng.choice(INTERESTING) if rng.random() < 0.5 else rng.randrange(-(1 << 63), 1 << 63)
+
+    for reg in GENERAL:
+        lines.append(f"irmovq {value()}, {reg}")
+    ops = list(yasm.commands)
+    for i in range(length):
+        lines.append(f"$l{i}:")
+        op = rng.choice(ops)
+        reg = rng.choice(list(yasm.registers))
+        other = rng.choice(list(yasm.registers))
+        if op in yasm.NO_ARGS:
+            # halt everywhere would end most programs after a few instructions
+            lines.append("nop" if op == "halt" and rng.random() < 0.8 else op)
+        elif op in yasm.JUMPS:
+            target = rng.randrange(i + 1, length + 1)
+            lines.append(f"{op} l{target}")
+        elif op in ("pushq", "popq"):
+            lines.append(f"{op} {reg}")
+        elif op in yasm.REG_REG:
+            lines.append(f"{op} {reg}, {other}")
+        elif op == "irmovq":
+            lines.append(f"irmovq {value()}, {reg}")
+        elif op == "mrmovq":
+            lines.append(f"mrmovq {8 * rng.randrange(8)}({other}), {reg}")
+        elif op == "rmmovq":
+            lines.append(f"rmmovq {reg}, {8 * rng.randrange(8)}({other})")
+    lines.append(f"$l{length}:")
+    lines.append("halt")
+    return lines
+
+
+def run_backend(backend: str, image: bytes, main: int, mem_size: int, max_instructions: int) -> dict:
+    """Final state of one backend after the program stops or max_instructions retire"""
+    if backend in HDL_BACKENDS:
+        from simulate import run
+
+        result = run(image, main, max_instructions=max_instructions, mem_size=mem_size, verbose=False, mode=backend)
+        return {
+            "stopped": result.stopped,
+            "stat": result.status,
+            "instructions": result.instructions,
+            "pc": result.pc,
+            "registers": [to_signed(r) for r in result.registers],
+            "cc": result.cc,
+            "mem": bytes(result.mem),
+        }
+    if backend == "translate":
+        from translator import Translator as Machine
+    else:
+        from interpreter import Interpreter as Machine
+    machine = Machine(image, main, mem_size)
+    machine.run(max_instructions)
+    return {
+        "stopped": "halt" if machine.stat != SAOK else "max_instructions",
+        "stat": machine.stat,
+        "instructions": machine.instructions,
+        "pc": machine.pc,
+        "registers": list(machine.regs),
+        "cc": machine.cc,
+        "mem": bytes(machine.mem),
+    }
+
+
+def fault_destinations(state: dict) -> set[int]:
+    """Registers the data access that stopped a run with SADR would have written.
+
+    CPU() still writes back the destinations of a load or stack access whose
+    address is invalid; SEQ(), PIPE() and the functional models stop before
+    any write. All of them leave the PC at the faulting instruction. A fault
+    on the instruction fetch writes nothing in any model: CPU() replaces the
+    instruction it could not fetch with a bubble.
+    """
+    if not 0 <= state["pc"] < len(state["mem"]):
+        return set()
+    icode, _, rA, _, _, _, _ = decode(state["mem"], state["pc"])
+    if icode in (IMRMOVQ, IPOPQ):
+        return {rA, RRSP} if icode == IPOPQ else {rA}
+    if icode in (IRET, IPUSHQ, ICALL):
+        return {RRSP}
+    return set()
+
+
+def compare(a: dict, b: dict, ignore: set[int] = frozenset()) -> list[str]:
+    """Describe every difference between two final states, except in the registers in ignore.
+
+    The processors never update the PC of the instruction that stopped them,
+    so like lockstep() the PC is only compared for programs cut off by the
+    instruction budget.
+    """
+    diffs = []
+    for key in ("stopped", "stat", "instructions", "cc"):
+        if a[key] != b[key]:
+            diffs.append(f"{key}: {a[key]} != {b[key]}")
+    if a["stopped"] == b["stopped"] == "max_instructions" and a["pc"] != b["pc"]:
+        diffs.append(f"pc: {a['pc']} != {b['pc']}")
+    for i in range(15):
+        if i not in ignore and a["registers"][i] != b["registers"][i]:
+            diffs.append(f"{regs[i]}: {a['registers'][i]} != {b['registers'][i]}")
+    if a["mem"] != b["mem"]:
+        changed = [addr for addr in range(len(a["mem"])) if a["mem"][addr] != b["mem"][addr]]
+        diffs.append(f"memory differs at {len(changed)} bytes from address {changed[0]}")
+    return diffs
+
+
+def check(lines: list[str], backend: str = "multi", reference: str = "interp",
+          mem_size: int = DEFAULT_MEM_SIZE, max_instructions: int = DEFAULT_MAX_INSTRUCTIONS,
+          strict: bool = False) -> list[str] | None:
+    """Differences between the backend and the reference on a program, or None if it does not assemble.
+
+    PIPE() stores before older instructions write back, so with it programs
+    cut off by the budget are not compared. Unless strict, the registers
+    CPU() writes back after a SADR data access (see fault_destinations())
+    are not compared either, so that known difference
+    does not hide other divergences.
+    """
+    try:
+        image, labels = yasm.assemble(lines)
+    except ValueError:
+        return None
+    main = labels.get('main', 0)
+    states = []
+    for name in (backend, reference):
+        try:
+            states.append(run_backend(name, image, main, mem_size, max_instructions))
+        except Exception as e:
+            # A model crashing where the other one does not is a divergence too
+            states.append({"error": f"{type(e).__name__}: {e}"})
+    got, expected = states
+    if "error" in got or "error" in expected:
+        errors = [f"{name} raised {state['error']}" for name, state in zip((backend, reference), states)
+                  if "error" in state]
+        return [] if len(errors) == 2 and got == expected else errors
+    if "pipe" in (backend, reference) and "max_instructions" in (got["stopped"], expected["stopped"]):
+        return []
+    ignore = set()
+    if not strict and got["stat"] == expected["stat"] == SADR and (backend == "multi") != (reference == "multi"):
+        ignore = fault_destinations(expected if reference != "multi" else got)
+    return compare(got, expected, ignore)
+
+
+def minimize(lines: list[str], fails) -> list[str]:
+    """Delta debugging: drop chunks of instruction lines while fails(lines) still holds.
+
+    Chunks start at half of the instructions and shrink to single lines.
+    Candidates that no longer assemble (a jump lost its label) count as
+    passing. Labels that end up unused are removed at the end.
+    """
+    chunk = max(len(lines) // 2, 1)
+    while True:
+        i = 1
+        removed = False
+        while i < len(lines):
+            candidate = lines[:i] + lines[i + chunk:]
+            if fails(candidate):
+                lines = candidate
+                removed = True
+            else:
+                i += chunk
+        if chunk == 1 and not removed:
+            break
+        chunk = max(chunk // 2, 1)
+    used = {word for line in lines if not line.startswith('$') for word in line.split()}
+    return [line for line in lines if not line.startswith('$') or line == "$main:" or line[1:-1] in used]
+
+
+def fuzz_one(seed: int, backend: str = "multi", reference: str = "interp", length: int = DEFAULT_LENGTH,
+             mem_size: int = DEFAULT_MEM_SIZE, max_instructions: int = DEFAULT_MAX_INSTRUCTIONS,
+             shrink: bool = True, strict: bool = False) -> dict:
+    """Generate and check the program of one seed; a diverging one is minimized in the same worker"""
+    lines = generate(random.Random(seed), length, mem_size)
+    diffs = check(lines, backend, reference, mem_size, max_instructions, strict)
+    result = {"seed": seed, "diffs": diffs}
+    if diffs and shrink:
+        def fails(candidate: list[str]) -> bool:
+            return bool(check(candidate, backend, reference, mem_size, max_instructions, strict))
+
+        lines = minimize(lines, fails)
+        result["diffs"] = check(lines, backend, reference, mem_size, max_instructions, strict)
+    result["lines"] = lines
+    return result
+
+
+def write_reproducer(directory: str, result: dict, backend: str, reference: str) -> str:
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"diverge_{result['seed']}.ys")
+    with open(path, 'w') as file:
+        file.write(f"# {backend} vs {reference}, seed {result['seed']}\n")
+        for diff in result["diffs"]:
+            file.write(f"# {diff}\n")
+        file.write("\n".join(result["lines"]) + "\n")
+    return path
+
+
+def run_fuzz(programs: int | None = None, seconds: float | None = None, seed: int = 0, jobs: int | None = None,
+             backend: str = "multi", reference: str = "interp", length: int = DEFAULT_LENGTH,
+             mem_size: int = DEFAULT_MEM_SIZE, max_instructions: int = DEFAULT_MAX_INSTRUCTIONS,
+             out: str = "fuzz_failures", shrink: bool = True, strict: bool = False) -> list[dict]:
+    """Check consecutive seeds in a process pool until programs are checked or seconds pass.
+
+    Every diverging program is minimized and written to out as a .ys file
+    with the differences in its header. Returns the diverging results.
+    """
+    jobs = jobs or os.cpu_count()
+    start = time.monotonic()
+    failures = []
+    checked = 0
+    next_seed = seed
+
+    def more() -> bool:
+        if programs is not None and next_seed - seed >= programs:
+            return False
+        return seconds is None or time.monotonic() - start < seconds
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = set()
+        while pending or more():
+            # Keep a few programs queued per worker so none of them waits for the parent
+            while more() and len(pending) < 4 * jobs:
+                pending.add(pool.submit(fuzz_one, next_seed, backend, reference, length, mem_size,
+                                        max_instructions, shrink, strict))
+                next_seed += 1
+            done = next(as_completed(pending))
+            pending.remove(done)
+            result = done.result()
+            checked += 1
+            if result["diffs"]:
+                path = write_reproducer(out, result, backend, reference)
+                failures.append(result)
+                print(f"seed {result['seed']}: {len(result['lines'])} lines -> {path}", file=sys.stderr)
+    elapsed = time.monotonic() - start
+    print(f"{checked} programs in {elapsed:.1f} s ({60 * checked / elapsed:.0f} per minute), "
+          f"{len(failures)} diverged", file=sys.stderr)
+    return failures
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Differential fuzzing of a Y86 processor against a reference model")
+    parser.add_argument("--backend", choices=BACKENDS, default="multi")
+    parser.add_argument("--reference", choices=BACKENDS, default="interp")
+    parser.add_argument("--programs", type=int, default=None, help="number of programs (default: until --seconds)")
+    parser.add_argument("--seconds", type=float, default=None)
+    parser.add_argument("--seed", type=int, default=0, help="first seed, programs use consecutive seeds")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--length", type=int, default=DEFAULT_LENGTH, help="random instructions per program")
+    parser.add_argument("--mem-size", type=int, default=DEFAULT_MEM_SIZE)
+    parser.add_argument("--max-instructions", type=int, default=DEFAULT_MAX_INSTRUCTIONS)
+    parser.add_argument("--out", default="fuzz_failures", help="directory for minimized reproducers")
+    parser.add_argument("--no-shrink", action="store_true", help="keep diverging programs as generated")
+    parser.add_argument("--strict", action="store_true",
+                        help="also report the registers CPU() (multi) writes back after a SADR data access")
+    args = parser.parse_args(argv)
+    if args.programs is None and args.seconds is None:
+        parser.error("give --programs or --seconds")
+    failures = run_fuzz(args.programs, args.seconds, args.seed, args.jobs, args.backend, args.reference, args.length,
+                        args.mem_size, args.max_instructions, args.out, not args.no_shrink, args.strict)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
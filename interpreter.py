@@ -0,0 +1,223 @@
+from isa import *
+from ram import RAM, MEM_SIZE, MASK64
+from predecode import DecodeTable
+
+
+SIGN64 = 1 << 63
+
+# Precompute Cond() for every CC/ifun pair
+COND_TABLE = [[Cond(cc, ifun) for ifun in range(16)] for cc in range(8)]
+
+
+def to_signed(val: int) -> int:
+    """Wrap an arbitrary int to a signed 64-bit value"""
+    val &= MASK64
+    return val - (1 << 64) if val & SIGN64 else val
+
+
+class LockstepError(Exception):
+    """Raised when the interpreter and the MyHDL model disagree"""
+
+
+class Interpreter:
+    """ISA-level Y86-64 interpreter with plain int registers and bytearray memory.
+
+    Executes the same programs as CPU() (the output of yasm.yassembling()) one
+    instruction per step() without any Signal or clock overhead. Like CPU(),
+    the program is loaded at address 0 of the memory. Register 0xF (RNONE)
+    reads as 0 and writes to it are dropped.
+    """
+
+    def __init__(self, program: "list[intbv] | bytes | memoryview", main: int, mem_size: int = MEM_SIZE):
+        if len(program) > mem_size:
+            raise ValueError(f"Program of {len(program)} bytes does not fit into {mem_size} bytes of memory")
+        self.mem = bytearray(mem_size)
+        self.mem[:len(program)] = program if isinstance(program, (bytes, bytearray, memoryview)) else bytes(int(b) for b in program)
+        self.code = DecodeTable(self.mem, len(program))
+        self.regs = [0] * 15
+        self.regs[RRSP] = mem_size - 1
+        self.pc = main
+        self.cc = 0
+        self.stat = SAOK
+        self.instructions = 0
+
+    def read_mem(self, addr: int) -> int | None:
+        if addr < 0 or addr + 8 > len(self.mem):
+            return None
+        return int.from_bytes(self.mem[addr:addr + 8], 'little', signed=True)
+
+    def write_mem(self, addr: int, val: int) -> bool:
+        if addr < 0 or addr + 8 > len(self.mem):
+            return False
+        self.mem[addr:addr + 8] = (val & MASK64).to_bytes(8, 'little')
+        if addr < self.code.code_end:
+            self.code.invalidate(addr, 8)
+        return True
+
+    def step(self) -> int:
+        """Execute one instruction and return the new Stat"""
+        if self.stat != SAOK:
+            return self.stat
+        regs = self.regs
+        icode, ifun, rA, rB, valC, valP, stat = self.code.lookup(self.pc)
+        if stat != SAOK:
+            self.stat = stat
+            return stat
+
+        if icode == IHALT:
+            self.stat = SHLT
+            self.instructions += 1
+            return SHLT
+        elif icode == IRRMOVQ:
+            if (ifun == 0 or COND_TABLE[self.cc][ifun]) and rB != RNONE:
+                regs[rB] = regs[rA] if rA != RNONE else 0
+        elif icode == IIRMOVQ:
+            if rB != RNONE:
+                regs[rB] = valC
+        elif icode == IRMMOVQ:
+            valA = regs[rA] if rA != RNONE else 0
+            valB = regs[rB] if rB != RNONE else 0
+            if not self.write_mem(to_signed(valC + valB), valA):
+                self.stat = SADR
+                return SADR
+        elif icode == IMRMOVQ:
+            valM = self.read_mem(to_signed(valC + (regs[rB] if rB != RNONE else 0)))
+            if valM is None:
+                self.stat = SADR
+                return SADR
+            if rA != RNONE:
+                regs[rA] = valM
+        elif icode == IOPQ:
+            valA = regs[rA] if rA != RNONE else 0
+            valB = regs[rB] if rB != RNONE else 0
+            if ifun == 0:
+                valE = to_signed(valA + valB)
+            elif ifun == 1:
+                valE = to_signed(valA - valB)
+            elif ifun == 2:
+                valE = valA & valB
+            elif ifun == 3:
+                valE = valA ^ valB
+            else:
+                self.stat = SINS
+                return SINS
+            if rB != RNONE:
+                regs[rB] = valE
+            # CC[0] -> ZF, CC[1] -> SF, CC[2] -> OF
+            self.cc = (valE == 0) | (valE < 0) << 1 | is_overflow(valA, valB, valE, ifun) << 2
+        elif icode == IJXX:
+            if COND_TABLE[self.cc][ifun]:
+                valP = valC
+        elif icode == ICALL:
+            valE = to_signed(regs[RRSP] - 8)
+            if not self.write_mem(valE, valP):
+                self.stat = SADR
+                return SADR
+            regs[RRSP] = valE
+            valP = valC
+        elif icode == IRET:
+            valM = self.read_mem(regs[RRSP])
+            if valM is None:
+                self.stat = SADR
+                return SADR
+            regs[RRSP] = to_signed(regs[RRSP] + 8)
+            valP = valM
+        elif icode == IPUSHQ:
+            valE = to_signed(regs[RRSP] - 8)
+            if not self.write_mem(valE, regs[rA] if rA != RNONE else 0):
+                self.stat = SADR
+                return SADR
+            regs[RRSP] = valE
+        elif icode == IPOPQ:
+            valM = self.read_mem(regs[RRSP])
+            if valM is None:
+                self.stat = SADR
+                return SADR
+            regs[RRSP] = to_signed(regs[RRSP] + 8)
+            if rA != RNONE:
+                regs[rA] = valM
+
+        self.pc = valP
+        self.instructions += 1
+        return SAOK
+
+    def run(self, max_instructions: int | None = None) -> int:
+        """Run until Stat leaves SAOK or max_instructions have been executed"""
+        step = self.step
+        if max_instructions is None:
+            while step() == SAOK:
+                pass
+        else:
+            for _ in range(max_instructions):
+                if step() != SAOK:
+                    break
+        return self.stat
+
+
+def compare_state(interp: Interpreter, pc: int, Regs: list, CC, Stat, mem: RAM, check_pc: bool = True) -> list[str]:
+    """Return a description of every difference between the interpreter and the CPU() signals"""
+    diffs = []
+    if check_pc and interp.pc != int(pc.val):
+        diffs.append(f"pc: {int(pc.val)} != {interp.pc}")
+    for i in range(15):
+        if to_signed(int(Regs[i].val)) != interp.regs[i]:
+            diffs.append(f"{regs[i]}: {int(Regs[i].val)} != {interp.regs[i]}")
+    if int(CC.val) != interp.cc:
+        diffs.append(f"CC: {bin(CC.val)} != {bin(interp.cc)}")
+    if int(Stat.val) != interp.stat:
+        diffs.append(f"Stat: {int(Stat.val)} != {interp.stat}")
+    if mem.data != interp.mem:
+        for i in range(len(mem)):
+            if mem.data[i] != interp.mem[i]:
+                diffs.append(f"Mem addr {i}: {mem.data[i]} != {interp.mem[i]}")
+    return diffs
+
+
+def lockstep(program: "list[intbv]", main: int, mem_size: int = MEM_SIZE, mode: str = "multi") -> Interpreter:
+    """Run the program on CPU() (or SEQ() with mode "seq") and on the interpreter,
+    comparing state after every instruction.
+
+    Raises LockstepError on the first instruction where they disagree and
+    returns the interpreter in its final state otherwise. PIPE() stores in
+    the memory stage before the previous instruction is written back, so it
+    can only be compared by final state, with pipe.compare().
+    """
+    if mode == "pipe":
+        raise ValueError("PIPE() can not be run in lockstep, use pipe.compare()")
+    from myhdl import Signal, ResetSignal, Simulation, always, block
+    from CPU import clock_generator, reset_generator, t_state
+    from simulate import MODES
+
+    clk = Signal(bool(0))
+    reset = ResetSignal(val=0, active=1, isasync=False)
+    cpu = MODES[mode](program, clk, reset, main, mem_size, verbose=False)
+    pc, CC, Stat, state, retire, Regs, mem = (cpu.symdict[name] for name in (
+        "pc", "CC", "Stat", "state", "retire", "Regs", "mem"))
+    interp = Interpreter(program, main, mem_size)
+
+    def check(check_pc: bool = True):
+        diffs = compare_state(interp, pc, Regs, CC, Stat, mem, check_pc)
+        if diffs:
+            raise LockstepError(f"Mismatch after instruction {interp.instructions} "
+                                f"(pc {interp.pc}): " + "; ".join(diffs))
+
+    @block
+    def monitor():
+        # retire changes in the same update as the PC of an instruction, and state
+        # becomes HALT in the same update as its write back, so both see it fully retired
+        @always(retire)
+        def watch_retire():
+            interp.step()
+            check()
+
+        @always(state)
+        def watch_halt():
+            if state.val == t_state.HALT:
+                interp.step()
+                # The halting instruction never reaches PC update
+                check(check_pc=False)
+        return watch_retire, watch_halt
+
+    sim = Simulation(cpu, monitor(), clock_generator(clk, period=10), reset_generator(reset, clk, reset_cycles=3))
+    sim.run(quiet=1)
+    return interp
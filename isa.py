@@ -0,0 +1,97 @@
+"""Y86-64 instruction set constants and helpers shared by every model, without MyHDL"""
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from myhdl import intbv
+
+IHALT = 0x0
+INOP = 0x1
+IRRMOVQ = 0x2
+IIRMOVQ = 0x3
+IRMMOVQ = 0x4
+IMRMOVQ = 0x5
+IOPQ = 0x6
+IJXX = 0x7
+ICMOVXX = 0x2
+ICALL = 0x8
+IRET = 0X9
+IPUSHQ = 0XA
+IPOPQ = 0XB
+
+FNONE = 0X0
+RRSP = 4
+RNONE = 0XF
+ALUADD = 0X0
+SAOK = 0X1
+SADR = 0X2
+SINS = 0X3
+SHLT = 0X4
+
+RRAX = 0X0
+RRCX = 0X1
+RRDX = 0X2
+RRBX = 0X3
+RRBP = 0X5
+RRSI = 0X6
+RRDI = 0X7
+RR8 = 0X8
+RR9 = 0X9
+RR10 = 0XA
+RR11 = 0XB
+RR12 = 0XC
+RR13 = 0XD
+RR14 = 0XE
+
+def wrap64(val: int) -> int:
+    """Wrap an ALU result to a signed 64-bit number"""
+    return ((val + (1 << 63)) & ((1 << 64) - 1)) - (1 << 63)
+
+def is_overflow(valA: int, valB: int, result: int, ifun: int) -> bool:
+    if ifun == 0:
+        return (valA > 0 and valB > 0 and result < 0) or (valA < 0 and valB < 0 and result > 0)
+    elif ifun == 1:
+        return (valA > 0 and valB < 0 and result < 0) or (valA < 0 and valB > 0 and result > 0)
+    else:
+        return False
+
+def Cond(CC: "intbv | int", ifun: int) -> bool:
+    # Extract flag variables from condition codes
+    zf = bool(CC & 1)
+    sf = bool(CC & 2)
+    of = bool(CC & 4)
+    
+    # Unconditional jump
+    if ifun == 0:
+        return True
+    # less or equal - (SF^OF) | ZF
+    if ifun == 1:
+        return (sf != of) or zf
+    #less - SF^OF
+    if ifun == 2:
+        return sf != of
+    # equal - ZF
+    if ifun == 3:
+        return zf
+    #not equal  - ~ZF
+    if ifun == 4:
+        return not zf
+    # greater or equal  - ~(SF^OF)
+    if ifun == 5:
+        return not (sf != of)
+    #greater - ~(SF^OF) & ~ZF
+    if ifun == 6:
+        return not (sf != of) and not zf
+    
+    # Invalid jump function - return False
+    return False
+
+
+regs = {0: "rax", 1: "rcx", 2: "rdx", 3: "rbx", 4: "rsp", 5: "rbp", 6: "rsi", 7: \
+"rdi", 8: "r8", 9: "r9", 10: "r10", 11: "r11", 12: "r12", 13: "r13", 14: "r14"}
+
+stat_names = {SAOK: "AOK", SADR: "ADR", SINS: "INS", SHLT: "HLT"}
+
+icode_names = {IHALT: "halt", INOP: "nop", IRRMOVQ: "rrmovq/cmovXX", IIRMOVQ: "irmovq", IRMMOVQ: "rmmovq", \
+IMRMOVQ: "mrmovq", IOPQ: "OPq", IJXX: "jXX", ICALL: "call", IRET: "ret", IPUSHQ: "pushq", IPOPQ: "popq"}
+
+cond_names = {0: "jmp", 1: "jle", 2: "jl", 3: "je", 4: "jne", 5: "jge", 6: "jg"}
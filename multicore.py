@@ -0,0 +1,384 @@
+"""Several Y86 cores sharing one data memory.
+
+Every core has its own PC, registers and CC and starts with %rdi set to its
+core number and %rsp at the top of its own stack_size-byte stack, the
+stacks being stacked down from the top of memory. Cores that share a
+program tell themselves apart by %rdi, or start at different entries.
+
+Atomicity: in run_multicore() and MultiInterpreter every 8-byte data
+access (rmmovq, mrmovq, pushq, popq, call, ret) reads or writes its 8
+bytes as one indivisible step, so a load never sees half of a store. There
+is no read-modify-write instruction, so two cores adding to one counter
+can lose updates; synchronisation has to use algorithms built from plain
+loads and stores (flags, Peterson's lock). These two models are
+sequentially consistent: every core does one access at a time in program
+order and all cores see the same order. run_processes() promises neither:
+a core copies the 8 bytes of an access out of or into the shared block as
+a byte slice, which the host may split into several loads or stores even
+at an aligned address, so a load can see part of a concurrent store; only
+single bytes are safe, so flags there should differ in one byte only. The
+order other cores see stores in is the host's (TSO on x86-64). Instruction
+fetch is not arbitrated and, across processes, code written by another
+core is not seen by a core that already decoded it.
+"""
+import time
+from dataclasses import dataclass, field
+
+from isa import *
+from interpreter import Interpreter, to_signed
+from predecode import DecodeTable
+
+
+DEFAULT_MEM_SIZE = 4096
+DEFAULT_STACK_SIZE = 256
+ROUND_ROBIN = "round-robin"
+FIXED = "fixed"
+POLICIES = (ROUND_ROBIN, FIXED)
+# Instructions a functional core runs before the next one gets its turn
+DEFAULT_QUANTUM = 1
+
+
+def initial_registers(core: int, mem_size: int, stack_size: int) -> list[int]:
+    """Registers of a core at start: %rdi is the core number, %rsp the top of its own stack"""
+    registers = [0] * 15
+    registers[RRDI] = core
+    registers[RRSP] = mem_size - 1 - core * stack_size
+    return registers
+
+
+def core_entries(labels: dict[str, int], n: int) -> list[int]:
+    """Entry of every core: label core<i> if the program has it, main otherwise"""
+    main = labels.get('main', -1)
+    return [labels.get(f"core{i}", main) for i in range(n)]
+
+
+class Bus:
+    """Arbiter of the data memory port shared by several CPU() cores.
+
+    The port serves one access at a time for latency cycles. Accesses issued
+    in the same cycle are served in the order of the policy: "fixed" always
+    prefers lower core numbers, "round-robin" starts after the core served
+    last. A core whose access has to wait for the port is stalled like on a
+    cache miss, through the cache interface of CPU(): the memory stage calls
+    access() of the core's port and the controller calls wait() every
+    cycle. Requests are resolved lazily, once the cycle they were issued in
+    is over, so the order in which MyHDL runs the cores does not matter.
+    """
+
+    def __init__(self, n_cores: int, clock, policy: str = ROUND_ROBIN, latency: int = 1):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown arbitration policy {policy!r}, expected one of {', '.join(POLICIES)}")
+        self.n_cores = n_cores
+        # Returns the current clock cycle
+        self.clock = clock
+        self.policy = policy
+        self.latency = latency
+        self.requests = []
+        # First cycle the port is free again
+        self.free = 0
+        self.last = n_cores - 1
+        self.stall = [0] * n_cores
+        self.accesses = [0] * n_cores
+        self.stall_cycles = [0] * n_cores
+
+    def port(self, core: int) -> "BusPort":
+        return BusPort(self, core)
+
+    def resolve(self, now: int):
+        """Grant the port to every request issued before cycle now"""
+        if not self.requests or self.requests[0][0] >= now:
+            return
+        ready = [request for request in self.requests if request[0] < now]
+        self.requests = [request for request in self.requests if request[0] >= now]
+        if self.policy == FIXED:
+            ready.sort()
+        else:
+            ready.sort(key=lambda request: (request[0], (request[1] - self.last - 1) % self.n_cores))
+        for cycle, core in ready:
+            grant = max(self.free, cycle)
+            self.free = grant + self.latency
+            self.last = core
+            self.stall[core] += self.free - cycle - 1
+
+    def report(self) -> list[dict]:
+        return [{"accesses": self.accesses[core], "stall_cycles": self.stall_cycles[core]}
+                for core in range(self.n_cores)]
+
+
+class BusPort:
+    """The view of a Bus one core has, with the access()/wait() interface of Cache"""
+
+    def __init__(self, bus: Bus, core: int):
+        self.bus = bus
+        self.core = core
+
+    def access(self, addr: int, pc: int, write: bool) -> int:
+        bus = self.bus
+        bus.requests.append((bus.clock(), self.core))
+        bus.accesses[self.core] += 1
+        return bus.latency
+
+    def wait(self) -> bool:
+        bus = self.bus
+        bus.resolve(bus.clock())
+        if bus.stall[self.core] > 0:
+            bus.stall[self.core] -= 1
+            bus.stall_cycles[self.core] += 1
+            return True
+        return False
+
+
+@dataclass
+class MultiResult:
+    """Final state of every core of a multi-core run and why it stopped"""
+    stopped: str  # "halt", "max_cycles" or "max_instructions"
+    cores: list[dict]
+    mem: bytearray = field(repr=False)
+    cycles: int | None = None
+    seconds: float = 0.0
+
+
+def run_multicore(program: "list[intbv] | bytes", entries: list[int], mem_size: int = DEFAULT_MEM_SIZE,
+                  stack_size: int = DEFAULT_STACK_SIZE, max_cycles: int | None = None, policy: str = ROUND_ROBIN,
+                  latency: int = 1) -> MultiResult:
+    """Simulate one CPU() per entry on a shared RAM until every core halts or max_cycles pass.
+
+    Data accesses go through a Bus with the given arbitration policy and
+    port latency. Every core has its own Counters; its cycles are counted
+    up to its halt.
+    """
+    import myhdl
+    from myhdl import Signal, ResetSignal, Simulation, StopSimulation, always, block
+    from ram import RAM
+    from CPU import CPU, Counters, t_state, clock_generator, reset_generator
+    from simulate import PERIOD, RESET_CYCLES
+
+    n = len(entries)
+    if n * stack_size > mem_size - len(program):
+        raise ValueError(f"{n} stacks of {stack_size} bytes do not fit into memory beside the program")
+    clk = Signal(bool(0))
+    reset = ResetSignal(val=0, active=1, isasync=False)
+    mem = RAM(mem_size, program)
+    bus = Bus(n, lambda: int(myhdl.now()) // PERIOD, policy, latency)
+    cores = []
+    counters = []
+    for core, entry in enumerate(entries):
+        counters.append(Counters())
+        cores.append(CPU(None, clk, reset, entry, mem_size, None, False, counters[core], None, bus.port(core),
+                         mem=mem, halt_stops=False, registers=initial_registers(core, mem_size, stack_size)))
+    final = [None] * n
+    halt_cycles = [None] * n
+
+    def snapshot(core: int, stopped: str):
+        names = cores[core].symdict
+        final[core] = {
+            "core": core,
+            "stopped": stopped,
+            "stat": int(names["Stat"].val),
+            "pc": int(names["pc"].val),
+            "registers": [int(r.val) for r in names["Regs"]],
+            "cc": int(names["CC"].val),
+        }
+        # Counters go on counting the cycles of a halted core
+        halt_cycles[core] = counters[core].cycles
+
+    @block
+    def monitor():
+        states = [cpu.symdict["state"] for cpu in cores]
+
+        @always(*states)
+        def watch_halt():
+            for core, state in enumerate(states):
+                if state.val == t_state.HALT and final[core] is None:
+                    snapshot(core, "halt")
+
+        # Stopping at the next edge rather than in watch_halt lets the counters of the
+        # core that halts last count its halt, which happens on the same state change
+        @always(clk.posedge)
+        def stop():
+            if all(entry is not None for entry in final):
+                raise StopSimulation()
+        return watch_halt, stop
+
+    sim = Simulation(*cores, monitor(), clock_generator(clk, period=PERIOD),
+                     reset_generator(reset, clk, reset_cycles=RESET_CYCLES))
+    start = time.monotonic()
+    sim.run(max_cycles * PERIOD if max_cycles is not None else None, quiet=1)
+    cycles = int(myhdl.now()) // PERIOD
+    stopped = "halt"
+    if any(entry is None for entry in final):
+        stopped = "max_cycles"
+        for core in range(n):
+            if final[core] is None:
+                snapshot(core, stopped)
+        sim.quit()
+    for core, bus_stats in enumerate(bus.report()):
+        counters[core].cycles = halt_cycles[core]
+        final[core]["counters"] = counters[core].report()
+        final[core]["bus"] = bus_stats
+    return MultiResult(stopped=stopped, cores=final, mem=mem.data, cycles=cycles, seconds=time.monotonic() - start)
+
+
+class MultiInterpreter:
+    """Functional cores on one shared bytearray, interleaved in a single process.
+
+    Cores take turns of quantum instructions in round-robin order, which is
+    the only arbitration this model needs: with the default quantum of one
+    instruction every access of one core is immediately seen by the next.
+    The cores share one DecodeTable, so code written by any core is seen by
+    all of them.
+    """
+
+    def __init__(self, program: "list[intbv] | bytes | memoryview", entries: list[int],
+                 mem_size: int = DEFAULT_MEM_SIZE, stack_size: int = DEFAULT_STACK_SIZE):
+        if len(entries) * stack_size > mem_size - len(program):
+            raise ValueError(f"{len(entries)} stacks of {stack_size} bytes do not fit into memory beside the program")
+        self.cores = []
+        for core, entry in enumerate(entries):
+            machine = Interpreter(program, entry, mem_size) if core == 0 else Interpreter(b'', entry, 0)
+            if core:
+                machine.mem = self.cores[0].mem
+                machine.code = self.cores[0].code
+            machine.regs[:] = initial_registers(core, mem_size, stack_size)
+            self.cores.append(machine)
+        self.mem = self.cores[0].mem
+
+    def run(self, max_instructions: int | None = None, quantum: int = DEFAULT_QUANTUM) -> list[int]:
+        """Run until every core leaves SAOK or has executed max_instructions; returns every Stat"""
+        running = list(self.cores)
+        while running:
+            for machine in running:
+                budget = quantum
+                if max_instructions is not None:
+                    budget = min(budget, max_instructions - machine.instructions)
+                if budget == 1:
+                    machine.step()
+                else:
+                    machine.run(budget)
+            running = [machine for machine in running if machine.stat == SAOK
+                       and (max_instructions is None or machine.instructions < max_instructions)]
+        return [machine.stat for machine in self.cores]
+
+    def result(self, seconds: float = 0.0) -> MultiResult:
+        stopped = "halt" if all(machine.stat != SAOK for machine in self.cores) else "max_instructions"
+        cores = [{
+            "core": core,
+            "stopped": "halt" if machine.stat != SAOK else "max_instructions",
+            "stat": machine.stat,
+            "pc": machine.pc,
+            "registers": list(machine.regs),
+            "cc": machine.cc,
+            "instructions": machine.instructions,
+        } for core, machine in enumerate(self.cores)]
+        return MultiResult(stopped=stopped, cores=cores, mem=self.mem, seconds=seconds)
+
+
+def _run_core(name: str, code_end: int, core: int, entry: int, mem_size: int, stack_size: int,
+              max_instructions: int | None, barrier, results):
+    """Body of one core process: an Interpreter over the shared memory block"""
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(name)
+    machine = Interpreter(b'', entry, 0)
+    machine.mem = shm.buf[:mem_size]
+    machine.code = DecodeTable(machine.mem, code_end)
+    machine.regs[:] = initial_registers(core, mem_size, stack_size)
+    barrier.wait()
+    start = time.monotonic()
+    machine.run(max_instructions)
+    seconds = time.monotonic() - start
+    results.put({
+        "core": core,
+        "stopped": "halt" if machine.stat != SAOK else "max_instructions",
+        "stat": machine.stat,
+        "pc": machine.pc,
+        "registers": list(machine.regs),
+        "cc": machine.cc,
+        "instructions": machine.instructions,
+        "seconds": seconds,
+    })
+    # The memory block can only be closed once no view of it is left
+    del machine
+    shm.close()
+
+
+def run_processes(program: "list[intbv] | bytes | memoryview", entries: list[int],
+                  mem_size: int = DEFAULT_MEM_SIZE, stack_size: int = DEFAULT_STACK_SIZE,
+                  max_instructions: int | None = None) -> MultiResult:
+    """Run one Interpreter per entry, each in its own OS process, on a shared memory block.
+
+    The cores really run at the same time, so N cores use N host cores. A
+    barrier starts them together; max_instructions bounds every core, which
+    keeps cores spinning on a flag nobody sets from running forever.
+    """
+    import multiprocessing
+    from multiprocessing import shared_memory
+
+    if len(entries) * stack_size > mem_size - len(program):
+        raise ValueError(f"{len(entries)} stacks of {stack_size} bytes do not fit into memory beside the program")
+    image = program if isinstance(program, (bytes, bytearray, memoryview)) else bytes(int(b) for b in program)
+    shm = shared_memory.SharedMemory(create=True, size=mem_size)
+    try:
+        shm.buf[:mem_size] = bytes(mem_size)
+        shm.buf[:len(image)] = image
+        barrier = multiprocessing.Barrier(len(entries) + 1)
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=_run_core, args=(
+            shm.name, len(image), core, entry, mem_size, stack_size, max_instructions, barrier, results))
+            for core, entry in enumerate(entries)]
+        for process in processes:
+            process.start()
+        barrier.wait()
+        start = time.monotonic()
+        cores = sorted((results.get() for _ in processes), key=lambda entry: entry["core"])
+        seconds = time.monotonic() - start
+        for process in processes:
+            process.join()
+        mem = bytearray(shm.buf[:mem_size])
+    finally:
+        shm.close()
+        shm.unlink()
+    stopped = "halt" if all(entry["stopped"] == "halt" for entry in cores) else "max_instructions"
+    return MultiResult(stopped=stopped, cores=cores, mem=mem, seconds=seconds)
+
+
+def main(argv: list[str] | None = None):
+    import argparse
+    import json
+    import yasm
+
+    parser = argparse.ArgumentParser(description="Run several Y86 cores on one shared memory")
+    parser.add_argument("path", help=".ys program; core i starts at label core<i> if present, at main otherwise")
+    parser.add_argument("-n", "--cores", type=int, default=2)
+    parser.add_argument("--model", choices=("hdl", "interp", "processes"), default="interp",
+                        help="CPU() cores, functional cores interleaved in one process or one process per core")
+    parser.add_argument("--mem-size", type=int, default=DEFAULT_MEM_SIZE)
+    parser.add_argument("--stack-size", type=int, default=DEFAULT_STACK_SIZE)
+    parser.add_argument("--policy", choices=POLICIES, default=ROUND_ROBIN, help="hdl bus arbitration")
+    parser.add_argument("--latency", type=int, default=1, help="hdl bus cycles per data access")
+    parser.add_argument("--quantum", type=int, default=DEFAULT_QUANTUM, help="interp instructions per turn")
+    parser.add_argument("--max-cycles", type=int, default=None, help="hdl clock cycles")
+    parser.add_argument("--max-instructions", type=int, default=None, help="functional instructions per core")
+    args = parser.parse_args(argv)
+
+    image, labels = yasm.assemble_file(args.path)
+    entries = core_entries(labels, args.cores)
+    if args.model == "hdl":
+        result = run_multicore(image, entries, args.mem_size, args.stack_size, args.max_cycles, args.policy,
+                               args.latency)
+    elif args.model == "processes":
+        result = run_processes(image, entries, args.mem_size, args.stack_size, args.max_instructions)
+    else:
+        machine = MultiInterpreter(image, entries, args.mem_size, args.stack_size)
+        start = time.monotonic()
+        machine.run(args.max_instructions, args.quantum)
+        result = machine.result(time.monotonic() - start)
+    for core in result.cores:
+        core["stat"] = stat_names.get(core["stat"], str(core["stat"]))
+        core["registers"] = {regs[i]: to_signed(val) for i, val in enumerate(core["registers"])}
+    report = {"stopped": result.stopped, "cycles": result.cycles, "seconds": result.seconds, "cores": result.cores}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+
+import yasm
+
+
+MAGIC = b'Y86O'
+FORMAT_VERSION = 1
+# magic, format version, main (-1 if there is none), code size, number of labels
+HEADER = struct.Struct('<4sHqII')
+# address, length of the UTF-8 name that follows
+LABEL = struct.Struct('<QH')
+SUFFIX = '.y86o'
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def save_object(path: str, image: bytes, labels: dict[str, int]):
+    """Write an object file: the machine code, the labels and the main entry"""
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, labels.get('main', -1), len(image), len(labels)))
+        file.write(image)
+        for name, addr in labels.items():
+            encoded = name.encode()
+            file.write(LABEL.pack(addr, len(encoded)))
+            file.write(encoded)
+
+
+def load_object(path: str) -> tuple[memoryview, dict[str, int], int]:
+    """Load an object file as (image, labels, main); the image is a view into a memory map of the file"""
+    with open(path, 'rb') as file:
+        data = memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+    magic, version, main, size, n_labels = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f"Not a version {FORMAT_VERSION} Y86 object: {path}")
+    offset = HEADER.size + size
+    image = data[HEADER.size:offset]
+    labels = {}
+    for _ in range(n_labels):
+        addr, length = LABEL.unpack_from(data, offset)
+        offset += LABEL.size
+        labels[bytes(data[offset:offset + length]).decode()] = addr
+        offset += length
+    return image, labels, main
+
+
+class ObjectCache:
+    """Assembled programs in a directory, keyed by a hash of the source and the assembler version.
+
+    A hit maps the object file instead of parsing the source. Files are
+    touched on every hit and the least recently used ones are removed once
+    the directory grows over max_bytes. Objects are written to a temporary
+    file and renamed, so several processes may share one cache.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(source: bytes) -> str:
+        return hashlib.sha256(b'%d\n' % yasm.VERSION + source).hexdigest()
+
+    def assemble_file(self, file_path: str) -> tuple[bytes | memoryview, dict[str, int]]:
+        """The same as yasm.assemble_file(), served from the cache when possible"""
+        with open(file_path, 'rb') as file:
+            source = file.read()
+        return self.assemble_source(source)
+
+    def assemble_source(self, source: bytes) -> tuple[bytes | memoryview, dict[str, int]]:
+        path = os.path.join(self.directory, self.key(source) + SUFFIX)
+        try:
+            image, labels, _ = load_object(path)
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            # Missing, being evicted by another process or written by another version
+            pass
+        else:
+            self.hits += 1
+            return image, labels
+
+        self.misses += 1
+        image, labels = yasm.assemble(source.decode().splitlines())
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        os.close(fd)
+        try:
+            save_object(tmp, image, labels)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.evict(keep=path)
+        return image, labels
+
+    def evict(self, keep: str | None = None):
+        """Remove least recently used objects until the cache fits into max_bytes"""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(SUFFIX):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,199 @@
+from bisect import bisect_right
+
+from isa import *
+from ram import MASK64
+from predecode import decode, instr_length
+from interpreter import Interpreter
+
+
+PAGE_BITS = 12
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+ADDRESS_SPACE = 1 << 64
+# Initial %rsp when the whole address space is usable
+DEFAULT_STACK_TOP = 1 << 47
+
+
+class PagedMemory:
+    """Sparse byte-addressable memory over the whole 64-bit address space.
+
+    Pages of PAGE_SIZE bytes are allocated on the first write to them and
+    untouched pages read as zeros, so memory use follows the pages a program
+    actually writes. The last page written or read is kept aside, so runs of
+    accesses to one page skip the dict lookup. Addresses are taken modulo
+    2**64; accesses that overlap one of the error regions, given as
+    [start, end) ranges, are invalid, which is how the flat memory's SADR
+    at and above its size is reproduced. Decoded instructions are cached per
+    PC, and writes to pages holding cached code drop the affected entries.
+    The interface follows RAM.
+    """
+
+    def __init__(self, image: "list[intbv] | bytes | memoryview" = b'', errors: list[tuple[int, int]] | None = None):
+        self.pages = {}
+        self._last_number = -1
+        self._last_page = None
+        self.errors = sorted(errors or [])
+        self._error_starts = [start for start, _ in self.errors]
+        self.decoded = {}
+        self.code_pages = set()
+        data = image if isinstance(image, (bytes, bytearray, memoryview)) else bytes(int(b) for b in image)
+        self.write_bytes(0, data)
+
+    def _page(self, number: int) -> bytearray:
+        """Page to write into, allocated on first touch"""
+        if number == self._last_number:
+            return self._last_page
+        page = self.pages.get(number)
+        if page is None:
+            page = self.pages[number] = bytearray(PAGE_SIZE)
+        self._last_number = number
+        self._last_page = page
+        return page
+
+    def valid(self, addr: int, n: int = 8) -> bool:
+        """Check that n bytes starting at addr are inside the address space and outside every error region"""
+        addr &= MASK64
+        if addr + n > ADDRESS_SPACE:
+            return False
+        if self.errors:
+            i = bisect_right(self._error_starts, addr + n - 1)
+            if i and self.errors[i - 1][1] > addr:
+                return False
+        return True
+
+    def read_bytes(self, addr: int, n: int) -> bytes:
+        addr &= MASK64
+        out = bytearray()
+        while n:
+            number = addr >> PAGE_BITS
+            offset = addr & PAGE_MASK
+            count = min(n, PAGE_SIZE - offset)
+            if number == self._last_number:
+                page = self._last_page
+            else:
+                page = self.pages.get(number)
+                if page is not None:
+                    self._last_number = number
+                    self._last_page = page
+            out += page[offset:offset + count] if page is not None else bytes(count)
+            addr += count
+            n -= count
+        return bytes(out)
+
+    def write_bytes(self, addr: int, data: bytes | bytearray | memoryview):
+        addr &= MASK64
+        start = 0
+        while start < len(data):
+            number = addr >> PAGE_BITS
+            offset = addr & PAGE_MASK
+            count = min(len(data) - start, PAGE_SIZE - offset)
+            self._page(number)[offset:offset + count] = data[start:start + count]
+            if number in self.code_pages:
+                self.invalidate(addr, count)
+            addr += count
+            start += count
+
+    def read_byte(self, addr: int) -> int:
+        return self.read_bytes(addr, 1)[0]
+
+    def read(self, addr: int) -> int:
+        """Read a signed little-endian 8-byte number"""
+        addr &= MASK64
+        offset = addr & PAGE_MASK
+        if offset <= PAGE_SIZE - 8:
+            number = addr >> PAGE_BITS
+            if number == self._last_number:
+                page = self._last_page
+            else:
+                page = self.pages.get(number)
+                if page is None:
+                    return 0
+                self._last_number = number
+                self._last_page = page
+            return int.from_bytes(page[offset:offset + 8], 'little', signed=True)
+        return int.from_bytes(self.read_bytes(addr, 8), 'little', signed=True)
+
+    def write(self, addr: int, val: "int | intbv", journal=None):
+        """Write an 8-byte number little-endian, recording the touched bytes in the journal"""
+        new = (int(val) & MASK64).to_bytes(8, 'little')
+        if journal is not None:
+            old = self.read_bytes(addr, 8)
+            for j in range(8):
+                journal.record_mem((addr + j) & MASK64, old[j], new[j])
+        addr &= MASK64
+        offset = addr & PAGE_MASK
+        number = addr >> PAGE_BITS
+        if offset <= PAGE_SIZE - 8 and number not in self.code_pages:
+            self._page(number)[offset:offset + 8] = new
+        else:
+            self.write_bytes(addr, new)
+
+    def fetch(self, pc: int) -> tuple[int, int, int, int, int, int, int]:
+        """Decoded instruction at pc as (icode, ifun, rA, rB, valC, valP, stat)"""
+        entry = self.decoded.get(pc)
+        if entry is not None:
+            return entry
+        if not self.valid(pc, 1):
+            return (INOP, FNONE, RNONE, RNONE, 0, pc, SADR)
+        icode, ifun, rA, rB, valC, valP, stat = decode(self.read_bytes(pc, 10), 0)
+        if stat == SINS:
+            return (icode, ifun, rA, rB, valC, pc, stat)
+        if not self.valid(pc, instr_length(icode)):
+            return (icode, ifun, RNONE, RNONE, 0, pc, SADR)
+        entry = self.decoded[pc] = (icode, ifun, rA, rB, valC, pc + valP, SAOK)
+        self.code_pages.add((pc & MASK64) >> PAGE_BITS)
+        self.code_pages.add(((pc & MASK64) + valP - 1) >> PAGE_BITS)
+        return entry
+
+    # The interpreter looks instructions up through machine.code.lookup()
+    lookup = fetch
+
+    def invalidate(self, addr: int, n: int = 8):
+        """Forget every decoded instruction whose encoding overlaps bytes [addr, addr + n)"""
+        # The longest instruction is 10 bytes, so it can start up to 9 bytes earlier
+        for pc in range(addr - 9, addr + n):
+            self.decoded.pop(pc, None)
+            self.decoded.pop(pc - ADDRESS_SPACE, None)
+
+    @property
+    def allocated(self) -> int:
+        """Bytes of memory held by allocated pages"""
+        return len(self.pages) * PAGE_SIZE
+
+
+class PagedInterpreter(Interpreter):
+    """Interpreter over a PagedMemory instead of a flat bytearray.
+
+    Given mem_size, addresses at and above it are an error region and %rsp
+    starts at mem_size - 1, so programs behave exactly as on Interpreter;
+    without it the whole 64-bit address space is usable and the stack starts
+    at stack_top. More error regions can be given as [start, end) ranges.
+    """
+
+    def __init__(self, program: "list[intbv] | bytes | memoryview", main: int, mem_size: int | None = None,
+                 errors: list[tuple[int, int]] | None = None, stack_top: int = DEFAULT_STACK_TOP):
+        errors = list(errors or [])
+        if mem_size is not None:
+            if len(program) > mem_size:
+                raise ValueError(f"Program of {len(program)} bytes does not fit into {mem_size} bytes of memory")
+            errors.append((mem_size, ADDRESS_SPACE))
+            stack_top = mem_size - 1
+        self.mem = PagedMemory(program, errors)
+        self.code = self.mem
+        self.regs = [0] * 15
+        self.regs[RRSP] = stack_top
+        self.pc = main
+        self.cc = 0
+        self.stat = SAOK
+        self.instructions = 0
+
+    def read_mem(self, addr: int) -> int | None:
+        if not self.mem.valid(addr):
+            return None
+        return self.mem.read(addr)
+
+    def write_mem(self, addr: int, val: int) -> bool:
+        if not self.mem.valid(addr):
+            return False
+        self.mem.write(addr, val)
+        return True
@@ -0,0 +1,400 @@
+import json
+import sys
+
+from myhdl import block, always, always_comb, always_seq, intbv, StopSimulation
+from myhdl._Signal import _Signal, Signal
+import myhdl
+from utils import *
+from ram import RAM, MEM_SIZE, MASK64
+from CPU import t_state, Counters, counters_block
+from seq import alu
+
+
+# Stat of a bubble, i.e. of a pipeline register without an instruction
+SBUB = 0
+ERRORS = (SADR, SINS, SHLT)
+
+# Fields of each pipeline register as (bits, signed, bubble value)
+D_FIELDS = {"stat": (3, False, SBUB), "icode": (4, False, INOP), "ifun": (4, False, FNONE),
+            "rA": (4, False, RNONE), "rB": (4, False, RNONE), "valC": (64, True, 0),
+            "valP": (64, False, 0), "pc": (64, False, 0)}
+E_FIELDS = {"stat": (3, False, SBUB), "icode": (4, False, INOP), "ifun": (4, False, FNONE),
+            "valC": (64, True, 0), "valA": (64, True, 0), "valB": (64, True, 0),
+            "dstE": (4, False, RNONE), "dstM": (4, False, RNONE), "srcA": (4, False, RNONE),
+            "srcB": (4, False, RNONE), "pc": (64, False, 0), "npc": (64, False, 0)}
+M_FIELDS = {"stat": (3, False, SBUB), "icode": (4, False, INOP), "ifun": (4, False, FNONE),
+            "Cnd": (1, False, 0), "valE": (64, True, 0), "valA": (64, True, 0),
+            "dstE": (4, False, RNONE), "dstM": (4, False, RNONE), "pc": (64, False, 0),
+            "npc": (64, False, 0), "cc": (3, False, 0)}
+W_FIELDS = {"stat": (3, False, SBUB), "icode": (4, False, INOP), "ifun": (4, False, FNONE),
+            "Cnd": (1, False, 0), "valE": (64, True, 0), "valM": (64, True, 0),
+            "dstE": (4, False, RNONE), "dstM": (4, False, RNONE), "pc": (64, False, 0),
+            "npc": (64, False, 0), "cc": (3, False, 0)}
+
+
+class Stage:
+    """Signals of a pipeline register, or of the stage logic that feeds one.
+
+    Every field becomes a Signal attribute initialised to its bubble value.
+    pc and npc are the address of the instruction and of the one after it
+    in program order, used to report the architectural PC at write back.
+    """
+
+    def __init__(self, fields: dict[str, tuple[int, bool, int]]):
+        self.fields = fields
+        for name, (bits, signed, bubble) in fields.items():
+            val = intbv(bubble, min=-(1 << (bits - 1)), max=1 << (bits - 1)) if signed else intbv(bubble)[bits:]
+            setattr(self, name, Signal(val))
+
+
+@block
+def pipe_register(clk: _Signal, reset: _Signal, stall: _Signal, bubble: _Signal, src: Stage, dst: Stage):
+    """Latch src into dst on the clock edge, keep dst on stall, load bubble values on bubble or reset"""
+    pairs = [(getattr(src, name), getattr(dst, name), val) for name, (_, _, val) in dst.fields.items()]
+
+    @always(clk.posedge)
+    def latch():
+        if reset.val or bubble.val:
+            for _, out, val in pairs:
+                out.next = val
+        elif not stall.val:
+            for inp, out, _ in pairs:
+                out.next = inp.val
+
+    return latch
+
+
+@block
+def pipe_fetch(mem: RAM, F: Stage, M: Stage, W: Stage, f: Stage, f_predPC: _Signal):
+    @always_comb
+    def fetch():
+        # Mispredicted branches come back from memory, return addresses from write back
+        if M.icode == IJXX and not M.Cnd:
+            pc = int(M.valA)
+        elif W.icode == IRET:
+            pc = int(W.valM) & MASK64
+        else:
+            pc = int(F.predPC)
+        icode, ifun, rA, rB, valC, valP, stat = mem.fetch(pc)
+        if stat == SAOK and icode == IOPQ and ifun > 3:
+            stat = SINS
+        if stat != SAOK:
+            icode = INOP
+        elif icode == IHALT:
+            stat = SHLT
+        f.stat.next = stat
+        f.icode.next = icode
+        f.ifun.next = ifun
+        f.rA.next = rA
+        f.rB.next = rB
+        f.valC.next = valC
+        f.valP.next = valP
+        f.pc.next = pc
+        # Branches are predicted taken
+        f_predPC.next = (valC & MASK64) if icode in [IJXX, ICALL] else valP
+
+    return fetch
+
+
+@block
+def pipe_decode(D: Stage, e: Stage, M: Stage, m: Stage, W: Stage, d: Stage, Regs: list[_Signal]):
+    @always_comb
+    def decode():
+        if D.icode in [IRRMOVQ, IRMMOVQ, IOPQ, IPUSHQ]:
+            srcA = int(D.rA)
+        elif D.icode in [IPOPQ, IRET]:
+            srcA = RRSP
+        else:
+            srcA = RNONE
+        if D.icode in [IMRMOVQ, IRMMOVQ, IOPQ]:
+            srcB = int(D.rB)
+        elif D.icode in [IPUSHQ, ICALL, IRET, IPOPQ]:
+            srcB = RRSP
+        else:
+            srcB = RNONE
+
+        # Forward from the youngest instruction that writes the source register
+        vals = []
+        for src in (srcA, srcB):
+            if src == RNONE:
+                vals.append(0)
+            elif src == e.dstE:
+                vals.append(int(e.valE))
+            elif src == M.dstM:
+                vals.append(int(m.valM))
+            elif src == M.dstE:
+                vals.append(int(M.valE))
+            elif src == W.dstM:
+                vals.append(int(W.valM))
+            elif src == W.dstE:
+                vals.append(int(W.valE))
+            else:
+                vals.append(int(Regs[src].val))
+        # jXX and call carry valP to memory for misprediction and the return address
+        if D.icode in [ICALL, IJXX]:
+            vals[0] = int(D.valP)
+
+        d.stat.next = D.stat
+        d.icode.next = D.icode
+        d.ifun.next = D.ifun
+        d.valC.next = D.valC
+        d.valA.next = vals[0]
+        d.valB.next = vals[1]
+        d.srcA.next = srcA
+        d.srcB.next = srcB
+        if D.icode in [IOPQ, IRRMOVQ, IIRMOVQ]:
+            d.dstE.next = int(D.rB)
+        elif D.icode in [IPUSHQ, ICALL, IPOPQ, IRET]:
+            d.dstE.next = RRSP
+        else:
+            d.dstE.next = RNONE
+        d.dstM.next = int(D.rA) if D.icode in [IPOPQ, IMRMOVQ] else RNONE
+        d.pc.next = D.pc
+        d.npc.next = (int(D.valC) & MASK64) if D.icode == ICALL else D.valP
+
+    return decode
+
+
+@block
+def pipe_execute(E: Stage, exec_CC: _Signal, m: Stage, W: Stage, e: Stage):
+    @always_comb
+    def execute():
+        e_valE, cc = alu(int(E.icode), int(E.ifun), int(E.valA), int(E.valB), int(E.valC), int(exec_CC))
+        # Instructions behind an exception must not change the condition codes
+        if m.stat in ERRORS or W.stat in ERRORS:
+            cc = int(exec_CC)
+        cnd = E.icode in [IJXX, ICMOVXX] and Cond(exec_CC.val, int(E.ifun))
+        e.stat.next = E.stat
+        e.icode.next = E.icode
+        e.ifun.next = E.ifun
+        e.Cnd.next = cnd
+        e.valE.next = e_valE
+        e.valA.next = E.valA
+        e.dstE.next = RNONE if E.icode == ICMOVXX and not cnd else E.dstE
+        e.dstM.next = E.dstM
+        e.pc.next = E.pc
+        e.npc.next = (int(E.valC) & MASK64) if E.icode == IJXX and cnd else E.npc
+        e.cc.next = cc
+
+    return execute
+
+
+@block
+def pipe_memory(mem: RAM, M: Stage, m: Stage):
+    # Reads are combinational, writes happen on the clock edge in pipe_update.
+    # A load always follows a store with a different icode, so this block is
+    # evaluated again after every store that it could observe.
+    @always_comb
+    def access():
+        addr = int(M.valA) if M.icode in [IPOPQ, IRET] else int(M.valE)
+        valM = 0
+        stat = int(M.stat)
+        if M.icode in [IMRMOVQ, IPOPQ, IRET, IRMMOVQ, IPUSHQ, ICALL]:
+            if not mem.valid(addr):
+                stat = SADR
+            elif M.icode in [IMRMOVQ, IPOPQ, IRET]:
+                valM = mem.read(addr)
+        m.stat.next = stat
+        m.icode.next = M.icode
+        m.ifun.next = M.ifun
+        m.Cnd.next = M.Cnd
+        m.valE.next = M.valE
+        m.valM.next = valM
+        m.dstE.next = M.dstE
+        m.dstM.next = M.dstM
+        m.pc.next = M.pc
+        m.npc.next = (valM & MASK64) if M.icode == IRET else M.npc
+        m.cc.next = M.cc
+
+    return access
+
+
+@block
+def pipe_control(D: Stage, E: Stage, M: Stage, W: Stage, d: Stage, e: Stage, m: Stage,
+                 F_stall: _Signal, D_stall: _Signal, D_bubble: _Signal, E_bubble: _Signal,
+                 M_bubble: _Signal, W_stall: _Signal):
+    @always_comb
+    def control():
+        load_use = E.icode in [IMRMOVQ, IPOPQ] and E.dstM != RNONE and (E.dstM == d.srcA or E.dstM == d.srcB)
+        ret = IRET in (int(D.icode), int(E.icode), int(M.icode))
+        mispredict = E.icode == IJXX and not e.Cnd
+        F_stall.next = load_use or ret
+        D_stall.next = load_use
+        D_bubble.next = mispredict or (ret and not load_use)
+        E_bubble.next = mispredict or load_use
+        M_bubble.next = m.stat in ERRORS or W.stat in ERRORS
+        W_stall.next = W.stat in ERRORS
+
+    return control
+
+
+@block
+def pipe_update(clk: _Signal, reset: _Signal, state: _Signal, retire: _Signal, M: Stage, W: Stage,
+                e: Stage, m: Stage, Stat: _Signal, pc: _Signal, Regs: list[_Signal], CC: _Signal,
+                exec_CC: _Signal, old_CC: _Signal, icode: _Signal, ifun: _Signal, Cnd: _Signal,
+                dstE: _Signal, dstM: _Signal, valE: _Signal, valM: _Signal, mem: RAM,
+                journal: Journal | None = None):
+    """Write back the instruction in W and the store in M, keep the architectural state"""
+    record_reg = journal.record_reg if journal is not None else None
+
+    @always_seq(clk.posedge, reset=reset)
+    def update():
+        if journal is not None:
+            check_diff(journal, old_CC, CC)
+        if state.val == t_state.HALT:
+            raise StopSimulation(f"Executions was stopped at time {myhdl.now()}. State:{bin(Stat.val)}")
+        old_CC.next = CC.val
+        exec_CC.next = e.cc.val
+        if M.icode.val in [IRMMOVQ, IPUSHQ, ICALL] and m.stat.val == SAOK:
+            mem.write(int(M.valE.val), M.valA.val, journal)
+
+        if W.stat.val == SBUB:
+            return
+        # icode and the others describe the last instruction that reached write back
+        icode.next = W.icode.val
+        ifun.next = W.ifun.val
+        Cnd.next = W.Cnd.val
+        dstE.next = W.dstE.val
+        dstM.next = W.dstM.val
+        valE.next = W.valE.val
+        valM.next = W.valM.val
+        Stat.next = W.stat.val
+        if W.stat.val != SAOK:
+            state.next = t_state.HALT
+            return
+
+        if W.dstE.val != RNONE:
+            if record_reg is not None:
+                record_reg(int(W.dstE.val), int(Regs[int(W.dstE.val)].val), int(W.valE.val))
+            Regs[int(W.dstE.val)].next = W.valE.val
+        if W.dstM.val != RNONE:
+            if record_reg is not None:
+                record_reg(int(W.dstM.val), int(Regs[int(W.dstM.val)].val), int(W.valM.val))
+            Regs[int(W.dstM.val)].next = W.valM.val
+        CC.next = W.cc.val
+        pc.next = W.npc.val
+        retire.next = (retire.val + 1) % retire.max
+
+    return update
+
+
+@block
+def PIPE(program: list[intbv], clk: _Signal, reset: _Signal, main: int, mem_size: int = MEM_SIZE,
+         checkpoint: "Checkpoint | None" = None, verbose: bool = True, counters: Counters | None = None,
+         profiler: "Profiler | None" = None, cache: "Cache | None" = None):
+    """Five-stage pipelined Y86 processor with the same interface as CPU().
+
+    Pipeline registers F, D, E, M and W separate combinational fetch, decode,
+    execute and memory logic, as in the textbook PIPE design. Operands are
+    forwarded from E, M and W, a load followed by a use of its result stalls
+    for one cycle, branches are predicted taken and a misprediction turns the
+    two wrongly fetched instructions into bubbles, and ret stalls fetch until
+    the return address is read. pc, CC, Regs and Stat are the architectural
+    state after the last instruction that reached write back. Self-modifying
+    code is not supported: instructions already in the pipeline are not
+    fetched again after a store into them. The Profiler is not supported,
+    as cycles can not be given to a single instruction in a pipeline.
+    """
+    if profiler is not None:
+        raise ValueError("PIPE() does not support the profiler")
+    if cache is not None:
+        raise ValueError("PIPE() does not support the cache model")
+    if checkpoint is not None:
+        main = checkpoint.pc
+        mem_size = checkpoint.mem_size
+    F = Stage({"predPC": (64, False, main)})
+    D, E, M, W = Stage(D_FIELDS), Stage(E_FIELDS), Stage(M_FIELDS), Stage(W_FIELDS)
+    f_predPC = Stage({"predPC": (64, False, main)})
+    f, d, e, m = Stage(D_FIELDS), Stage(E_FIELDS), Stage(M_FIELDS), Stage(W_FIELDS)
+    F_stall, D_stall, D_bubble, E_bubble, M_bubble, W_stall = (Signal(bool(0)) for _ in range(6))
+    never = Signal(bool(0))
+
+    pc = Signal(intbv(main)[64:])
+    Regs = [Signal(intbv(0)[64:].signed()) for _ in range(15)]
+    #rsp
+    Regs[4] = Signal(intbv(mem_size - 1, min=-2**63, max=2**63))
+    if checkpoint is not None:
+        Regs = [Signal(intbv(val)[64:].signed()) for val in checkpoint.registers]
+    Stat = Signal(intbv(0 if checkpoint is None else checkpoint.stat)[3:])
+    CC = Signal(intbv(0 if checkpoint is None else checkpoint.cc)[3:])
+    exec_CC = Signal(CC.val)
+    old_CC = Signal(CC.val)
+    # The last instruction that reached write back
+    icode = Signal(intbv(0)[4:])
+    ifun = Signal(intbv(0)[4:])
+    Cnd = Signal(intbv(0)[1:])
+    dstE = Signal(intbv(RNONE)[4:])
+    dstM = Signal(intbv(RNONE)[4:])
+    valE = Signal(intbv(0)[64:].signed())
+    valM = Signal(intbv(0)[64:].signed())
+    if checkpoint is None:
+        mem = RAM(mem_size, program)
+    else:
+        mem = RAM(mem_size, checkpoint.memory(), checkpoint.code_end)
+    journal = Journal() if verbose else None
+    state = Signal(t_state.D)
+    retire = Signal(intbv(0)[32:])
+
+    instances = [
+        pipe_register(clk, reset, F_stall, never, f_predPC, F),
+        pipe_register(clk, reset, D_stall, D_bubble, f, D),
+        pipe_register(clk, reset, never, E_bubble, d, E),
+        pipe_register(clk, reset, never, M_bubble, e, M),
+        pipe_register(clk, reset, W_stall, never, m, W),
+        pipe_fetch(mem, F, M, W, f, f_predPC.predPC),
+        pipe_decode(D, e, M, m, W, d, Regs),
+        pipe_execute(E, exec_CC, m, W, e),
+        pipe_memory(mem, M, m),
+        pipe_control(D, E, M, W, d, e, m, F_stall, D_stall, D_bubble, E_bubble, M_bubble, W_stall),
+        pipe_update(clk, reset, state, retire, M, W, e, m, Stat, pc, Regs, CC, exec_CC, old_CC,
+                    icode, ifun, Cnd, dstE, dstM, valE, valM, mem, journal),
+    ]
+    if counters is not None:
+        instances.append(counters_block(clk, reset, retire, state, icode, ifun, Cnd, Stat, counters))
+    return instances
+
+
+def compare(program: list[intbv], main: int, modes: tuple[str, ...] = ("multi", "pipe"),
+            max_cycles: int | None = None, mem_size: int = MEM_SIZE) -> dict:
+    """Run the program on several processor modes and compare their cycles and final state.
+
+    Returns the cycles, instructions and CPI of every mode, the speedup of
+    each mode over the first one, and every difference in final PC,
+    registers, CC, Stat and memory from the first one.
+    """
+    from simulate import run
+
+    results = {mode: run(program, main, max_cycles=max_cycles, mem_size=mem_size, verbose=False, mode=mode)
+               for mode in modes}
+    base = results[modes[0]]
+    report = {"modes": {}, "diffs": {}}
+    for mode, result in results.items():
+        report["modes"][mode] = {
+            "stat": result.stat_name,
+            "stopped": result.stopped,
+            "cycles": result.cycles,
+            "instructions": result.instructions,
+            "cpi": result.cycles / result.instructions if result.instructions else None,
+            "speedup": base.cycles / result.cycles if result.cycles else None,
+        }
+        diffs = []
+        for name in ("status", "pc", "cc", "instructions"):
+            if getattr(result, name) != getattr(base, name):
+                diffs.append(f"{name}: {getattr(result, name)} != {getattr(base, name)}")
+        for i in range(15):
+            if result.registers[i] != base.registers[i]:
+                diffs.append(f"{regs[i]}: {result.registers[i]} != {base.registers[i]}")
+        for i in range(min(len(result.mem), len(base.mem))):
+            if result.mem[i] != base.mem[i]:
+                diffs.append(f"Mem addr {i}: {result.mem[i]} != {base.mem[i]}")
+        if mode != modes[0]:
+            report["diffs"][mode] = diffs
+    report["identical"] = not any(report["diffs"].values())
+    return report
+
+
+if __name__ == "__main__":
+    import yasm
+
+    program, main = yasm.yassembling(sys.argv[1])
+    print(json.dumps(compare(program, main, tuple(sys.argv[2:]) or ("multi", "pipe")), indent=2))
@@ -0,0 +1,68 @@
+from isa import *
+
+
+def instr_length(icode: int) -> int:
+    """Encoded length in bytes of an instruction with the given icode"""
+    if icode in (IHALT, INOP, IRET):
+        return 1
+    if icode in (IJXX, ICALL):
+        return 9
+    if icode in (IIRMOVQ, IRMMOVQ, IMRMOVQ):
+        return 10
+    return 2
+
+
+def decode(data: bytearray | bytes, pc: int) -> tuple[int, int, int, int, int, int, int]:
+    """Decode the instruction at pc into (icode, ifun, rA, rB, valC, valP, stat).
+
+    stat is SAOK for a valid instruction, SINS for an invalid icode and SADR
+    when the instruction does not fit into memory.
+    """
+    if pc < 0 or pc >= len(data):
+        return (INOP, FNONE, RNONE, RNONE, 0, pc, SADR)
+    icode = data[pc] >> 4
+    ifun = data[pc] & 0xF
+    if icode > 0xB:
+        return (icode, ifun, RNONE, RNONE, 0, pc, SINS)
+    valP = pc + instr_length(icode)
+    if valP > len(data):
+        return (icode, ifun, RNONE, RNONE, 0, pc, SADR)
+
+    if icode in (IHALT, INOP, IRET):
+        return (icode, ifun, RNONE, RNONE, 0, valP, SAOK)
+    if icode in (IJXX, ICALL):
+        valC = int.from_bytes(data[pc + 1:valP], 'little', signed=True)
+        return (icode, ifun, RNONE, RNONE, valC, valP, SAOK)
+    rA = data[pc + 1] >> 4
+    rB = data[pc + 1] & 0xF
+    valC = int.from_bytes(data[pc + 2:valP], 'little', signed=True) if valP - pc == 10 else 0
+    return (icode, ifun, rA, rB, valC, valP, SAOK)
+
+
+class DecodeTable:
+    """Predecoded instructions for every PC of the code region [0, code_end).
+
+    Built once when the program is loaded, so fetch becomes a single list
+    lookup. Writes into the code region must go through invalidate(); the
+    affected entries are decoded again on their next lookup. PCs outside the
+    code region are decoded on every fetch.
+    """
+
+    def __init__(self, data: bytearray, code_end: int):
+        self.data = data
+        self.code_end = code_end
+        self.entries = [decode(data, pc) for pc in range(code_end)]
+
+    def lookup(self, pc: int) -> tuple[int, int, int, int, int, int, int]:
+        if 0 <= pc < self.code_end:
+            entry = self.entries[pc]
+            if entry is None:
+                entry = self.entries[pc] = decode(self.data, pc)
+            return entry
+        return decode(self.data, pc)
+
+    def invalidate(self, addr: int, n: int = 8):
+        """Forget every entry whose encoding overlaps bytes [addr, addr + n)"""
+        # The longest instruction is 10 bytes, so it can start up to 9 bytes earlier
+        for pc in range(max(addr - 9, 0), min(addr + n, self.code_end)):
+            self.entries[pc] = None
@@ -0,0 +1,123 @@
+from array import array
+from bisect import bisect_right
+
+import myhdl
+from utils import *
+
+
+class Profiler:
+    """Execution count and clock cycles of every PC, with call stacks rebuilt from call/ret.
+
+    Counts live in two arrays preallocated for the whole memory and indexed
+    by PC, so recording an instruction costs a few array updates. The CPU
+    calls start() when it fetches an instruction and retire() when its PC is
+    updated; cycles are taken from the simulation time between the two.
+    Cycles spent under every distinct call stack are added up only when the
+    stack changes, for the collapsed-stack output read by flame graph tools.
+    """
+
+    def __init__(self, size: int, labels: dict[str, int] | None = None, period: int = 10):
+        self.executions = array('Q', bytes(8 * size))
+        self.cycles = array('Q', bytes(8 * size))
+        self.period = period
+        self.labels = sorted((addr, name) for name, addr in (labels or {}).items())
+        self._addrs = [addr for addr, _ in self.labels]
+        self.outside = 0
+        self.fetched_at = 0
+        self.stack = []
+        self.stacks = {}
+        self._pending = 0
+
+    def name(self, pc: int) -> str:
+        """Label at or before pc, or the PC itself if no label precedes it"""
+        i = bisect_right(self._addrs, pc)
+        return self.labels[i - 1][1] if i else hex(pc)
+
+    def start(self):
+        self.fetched_at = myhdl.now()
+
+    def retire(self, pc: int, icode: int, next_pc: int):
+        cycles = (myhdl.now() - self.fetched_at) // self.period + 1
+        if 0 <= pc < len(self.executions):
+            self.executions[pc] += 1
+            self.cycles[pc] += cycles
+        else:
+            self.outside += 1
+        if not self.stack:
+            self.stack.append(self.name(pc))
+        self._pending += cycles
+        if icode == ICALL:
+            self._flush()
+            self.stack.append(self.name(next_pc))
+        elif icode == IRET and len(self.stack) > 1:
+            self._flush()
+            self.stack.pop()
+
+    def _flush(self):
+        if self._pending:
+            key = ";".join(self.stack)
+            self.stacks[key] = self.stacks.get(key, 0) + self._pending
+            self._pending = 0
+
+    def flat(self) -> list[dict]:
+        """Rows of label, pc, executions and cycles for every executed PC, hottest first"""
+        rows = [{"label": self.name(pc), "pc": pc, "executions": self.executions[pc], "cycles": self.cycles[pc]}
+                for pc in range(len(self.executions)) if self.executions[pc]]
+        return sorted(rows, key=lambda row: (-row["cycles"], row["pc"]))
+
+    def by_label(self) -> list[dict]:
+        """Executions and cycles summed over the PCs of every label, hottest first"""
+        totals = {}
+        for row in self.flat():
+            entry = totals.setdefault(row["label"], {"label": row["label"], "executions": 0, "cycles": 0})
+            entry["executions"] += row["executions"]
+            entry["cycles"] += row["cycles"]
+        return sorted(totals.values(), key=lambda row: (-row["cycles"], row["label"]))
+
+    def collapsed(self) -> dict[str, int]:
+        """Cycles per call stack as 'outer;inner' strings"""
+        self._flush()
+        return dict(self.stacks)
+
+    def write_flat(self, path: str):
+        total = sum(self.cycles) or 1
+        with open(path, 'w') as file:
+            file.write(f"{'cycles':>10} {'%':>6} {'executions':>10}  label\n")
+            for row in self.by_label():
+                file.write(f"{row['cycles']:>10} {100 * row['cycles'] / total:>6.2f} {row['executions']:>10}  {row['label']}\n")
+            file.write(f"\n{'cycles':>10} {'%':>6} {'executions':>10}  pc (label)\n")
+            for row in self.flat():
+                file.write(f"{row['cycles']:>10} {100 * row['cycles'] / total:>6.2f} {row['executions']:>10}"
+                           f"  {row['pc']} ({row['label']})\n")
+
+    def write_collapsed(self, path: str):
+        with open(path, 'w') as file:
+            for stack, cycles in sorted(self.collapsed().items()):
+                file.write(f"{stack} {cycles}\n")
+
+
+def main(argv: list[str] | None = None):
+    import argparse
+    import yasm
+    from ram import MEM_SIZE
+    from simulate import run, PERIOD
+
+    parser = argparse.ArgumentParser(description="Profile a Y86 program on CPU() or SEQ()")
+    parser.add_argument("path", help=".ys program")
+    parser.add_argument("--mode", choices=("multi", "seq"), default="multi")
+    parser.add_argument("--mem-size", type=int, default=MEM_SIZE)
+    parser.add_argument("--max-cycles", type=int, default=None)
+    parser.add_argument("--flat", default="profile.txt", help="flat profile output")
+    parser.add_argument("--collapsed", default="profile.folded", help="collapsed stacks output")
+    args = parser.parse_args(argv)
+
+    image, labels = yasm.assemble_file(args.path)
+    profiler = Profiler(args.mem_size, labels, PERIOD)
+    run(image, labels.get('main', -1), max_cycles=args.max_cycles, mem_size=args.mem_size, verbose=False,
+        mode=args.mode, profiler=profiler)
+    profiler.write_flat(args.flat)
+    profiler.write_collapsed(args.collapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+from typing import TYPE_CHECKING
+
+from predecode import DecodeTable
+
+if TYPE_CHECKING:
+    from myhdl import intbv
+
+
+MEM_SIZE = 1024
+MASK64 = (1 << 64) - 1
+
+
+class RAM:
+    """Byte-addressable memory shared by the fetch and memory access stages.
+
+    The program image is loaded at address 0 and the rest is zero. Contents live
+    in a single bytearray instead of one Signal per byte, so construction time
+    and per-cycle cost do not depend on the size. Stages use the read/write
+    port below; writes take effect immediately, which is safe because only one
+    stage touches memory per clock edge. The program is predecoded once into
+    code, and writes into the program region invalidate the affected entries.
+    """
+
+    def __init__(self, size: int = MEM_SIZE, image: "list[intbv] | bytes | memoryview" = b'', code_end: int | None = None):
+        if len(image) > size:
+            raise ValueError(f"Program of {len(image)} bytes does not fit into {size} bytes of memory")
+        self.data = bytearray(size)
+        self.data[:len(image)] = image if isinstance(image, (bytes, bytearray, memoryview)) else bytes(int(b) for b in image)
+        # Only the program is predecoded, not e.g. a restored memory image
+        self.code = DecodeTable(self.data, len(image) if code_end is None else code_end)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def valid(self, addr: int, n: int = 8) -> bool:
+        """Check that n bytes starting at addr are inside the memory"""
+        return 0 <= addr and addr + n <= len(self.data)
+
+    def fetch(self, pc: int) -> tuple[int, int, int, int, int, int, int]:
+        """Decoded instruction at pc as (icode, ifun, rA, rB, valC, valP, stat)"""
+        return self.code.lookup(pc)
+
+    def read_byte(self, addr: int) -> int:
+        return self.data[addr]
+
+    def read(self, addr: int) -> int:
+        """Read a signed little-endian 8-byte number"""
+        return int.from_bytes(self.data[addr:addr + 8], 'little', signed=True)
+
+    def write(self, addr: int, val: "int | intbv", journal=None):
+        """Write an 8-byte number little-endian, recording the touched bytes in the journal"""
+        new = (int(val) & MASK64).to_bytes(8, 'little')
+        if journal is not None:
+            for j in range(8):
+                journal.record_mem(addr + j, self.data[addr + j], new[j])
+        self.data[addr:addr + 8] = new
+        if addr < self.code.code_end:
+            self.code.invalidate(addr, 8)
@@ -0,0 +1,280 @@
+from myhdl import block, always_comb, always_seq, intbv, StopSimulation
+from myhdl._Signal import _Signal, Signal
+import myhdl
+from utils import *
+from ram import RAM, MEM_SIZE, MASK64
+from CPU import t_state, Counters, counters_block
+
+
+# Every instruction retires on a single clock edge
+SEQ_CYCLES_PER_INSTRUCTION = 1
+
+
+def alu(icode: int, ifun: int, valA: int, valB: int, valC: int, cc: int) -> tuple[int, int]:
+    """valE of an instruction and the condition codes after it"""
+    if icode == IOPQ:
+        if ifun == 0:
+            e = wrap64(valA + valB)
+        elif ifun == 1:
+            e = wrap64(valA - valB)
+        elif ifun == 2:
+            e = valA & valB
+        else:
+            e = valA ^ valB
+        # CC[0] -> ZF, CC[1] -> SF, CC[2] -> OF
+        return e, (e == 0) | (e < 0) << 1 | is_overflow(valA, valB, e, ifun) << 2
+    if icode == IRRMOVQ:
+        return valA, cc
+    if icode == IIRMOVQ:
+        return valC, cc
+    if icode in (IRMMOVQ, IMRMOVQ):
+        return wrap64(valC + valB), cc
+    if icode in (ICALL, IPUSHQ):
+        return wrap64(valB - 8), cc
+    if icode in (IRET, IPOPQ):
+        return wrap64(valB + 8), cc
+    return 0, cc
+
+
+@block
+def seq_fetch(mem: RAM, pc: _Signal, icode: _Signal, ifun: _Signal, rA: _Signal, rB: _Signal,
+              valC: _Signal, valP: _Signal, instr_valid: _Signal, imem_error: _Signal):
+    @always_comb
+    def fetch():
+        icode_val, ifun_val, rA_val, rB_val, valC_val, valP_val, stat = mem.fetch(int(pc))
+        icode.next = icode_val
+        ifun.next = ifun_val
+        rA.next = rA_val
+        rB.next = rB_val
+        valC.next = valC_val
+        valP.next = valP_val
+        imem_error.next = stat == SADR
+        instr_valid.next = stat == SAOK and not (icode_val == IOPQ and ifun_val > 3)
+
+    return fetch
+
+
+@block
+def seq_decode(icode: _Signal, rA: _Signal, rB: _Signal, valA: _Signal, valB: _Signal, Regs: list[_Signal]):
+    @always_comb
+    def decode():
+        if icode in [IRRMOVQ, IRMMOVQ, IOPQ, IPUSHQ]:
+            srcA = int(rA)
+        elif icode in [IPOPQ, IRET]:
+            srcA = RRSP
+        else:
+            srcA = RNONE
+
+        if icode in [IMRMOVQ, IRMMOVQ, IOPQ]:
+            srcB = int(rB)
+        elif icode in [IPUSHQ, ICALL, IRET, IPOPQ]:
+            srcB = RRSP
+        else:
+            srcB = RNONE
+
+        valA.next = Regs[srcA].val if srcA != RNONE else 0
+        valB.next = Regs[srcB].val if srcB != RNONE else 0
+
+    return decode
+
+
+@block
+def seq_execute(icode: _Signal, ifun: _Signal, valA: _Signal, valB: _Signal, valC: _Signal,
+                valE: _Signal, Cnd: _Signal, CC: _Signal, new_CC: _Signal,
+                dstE: _Signal, dstM: _Signal, rA: _Signal, rB: _Signal):
+    @always_comb
+    def execute():
+        cnd = False
+        e, cc = alu(int(icode), int(ifun), int(valA), int(valB), int(valC), int(CC))
+        if icode == IJXX or icode == ICMOVXX:
+            cnd = Cond(CC.val, int(ifun))
+        valE.next = e
+        new_CC.next = cc
+        Cnd.next = cnd
+
+        if icode == ICMOVXX and ifun != 0:
+            dstE.next = int(rB) if cnd else RNONE
+        elif icode in [IOPQ, IRRMOVQ, IIRMOVQ]:
+            dstE.next = int(rB)
+        elif icode in [IPUSHQ, ICALL, IPOPQ, IRET]:
+            dstE.next = RRSP
+        else:
+            dstE.next = RNONE
+
+        if icode in [IPOPQ, IMRMOVQ]:
+            dstM.next = int(rA)
+        else:
+            dstM.next = RNONE
+
+    return execute
+
+
+@block
+def seq_memory(mem: RAM, icode: _Signal, valE: _Signal, valA: _Signal, valM: _Signal, dmem_error: _Signal):
+    # Reads are combinational, writes happen on the clock edge in seq_update.
+    # A load always follows a store with a different icode, so this block is
+    # evaluated again after every store that it could observe.
+    @always_comb
+    def access():
+        if icode in [IPOPQ, IRET]:
+            addr = int(valA)
+        else:
+            addr = int(valE)
+        if icode in [IMRMOVQ, IPOPQ, IRET]:
+            ok = mem.valid(addr)
+            valM.next = mem.read(addr) if ok else 0
+            dmem_error.next = not ok
+        elif icode in [IRMMOVQ, IPUSHQ, ICALL]:
+            valM.next = 0
+            dmem_error.next = not mem.valid(addr)
+        else:
+            valM.next = 0
+            dmem_error.next = 0
+
+    return access
+
+
+@block
+def seq_update(clk: _Signal, reset: _Signal, state: _Signal, retire: _Signal, icode: _Signal,
+               instr_valid: _Signal, imem_error: _Signal, dmem_error: _Signal, Stat: _Signal,
+               pc: _Signal, valP: _Signal, valC: _Signal, valA: _Signal, valE: _Signal, valM: _Signal,
+               Cnd: _Signal, dstE: _Signal, dstM: _Signal, Regs: list[_Signal], CC: _Signal,
+               new_CC: _Signal, old_CC: _Signal, mem: RAM, journal: Journal | None = None,
+               profiler: "Profiler | None" = None, cache: "Cache | None" = None):
+    """Commit the instruction computed by the combinational stages on each clock edge"""
+    record_reg = journal.record_reg if journal is not None else None
+    cache_access = cache.access if cache is not None else None
+    cache_wait = cache.wait if cache is not None else None
+    profile_start = profiler.start if profiler is not None else None
+    profile_retire = profiler.retire if profiler is not None else None
+
+    @always_seq(clk.posedge, reset=reset)
+    def update():
+        if journal is not None:
+            check_diff(journal, old_CC, CC)
+        if state.val == t_state.HALT:
+            raise StopSimulation(f"Executions was stopped at time {myhdl.now()}. State:{bin(Stat.val)}")
+        old_CC.next = CC.val
+        # The latency of a slow data access is paid before the next instruction commits
+        if cache_wait is not None and cache_wait():
+            return
+        # The first edge out of reset only lets the stages settle on the first instruction
+        if state.val == t_state.F:
+            state.next = t_state.D
+            return
+
+        if imem_error.val:
+            stat = SADR
+        elif not instr_valid.val:
+            stat = SINS
+        elif dmem_error.val:
+            stat = SADR
+        elif icode.val == IHALT:
+            stat = SHLT
+        else:
+            stat = SAOK
+        Stat.next = stat
+        if stat != SAOK:
+            if profile_retire is not None and stat == SHLT:
+                profile_start()
+                profile_retire(int(pc.val), IHALT, int(pc.val))
+            state.next = t_state.HALT
+            return
+
+        code = int(icode.val)
+        if code in [IRMMOVQ, IPUSHQ]:
+            mem.write(int(valE.val), valA.val, journal)
+        elif code == ICALL:
+            mem.write(int(valE.val), valP.val, journal)
+        if cache_access is not None and code in [IMRMOVQ, IRMMOVQ, IPUSHQ, IPOPQ, ICALL, IRET]:
+            addr = int(valA.val) if code in [IPOPQ, IRET] else int(valE.val)
+            cache_access(addr, int(pc.val), code in [IRMMOVQ, IPUSHQ, ICALL])
+        if dstE.val != RNONE:
+            if record_reg is not None:
+                record_reg(int(dstE.val), int(Regs[int(dstE.val)].val), int(valE.val))
+            Regs[int(dstE.val)].next = valE.val
+        if dstM.val != RNONE:
+            if record_reg is not None:
+                record_reg(int(dstM.val), int(Regs[int(dstM.val)].val), int(valM.val))
+            Regs[int(dstM.val)].next = valM.val
+        if code == IOPQ:
+            CC.next = new_CC.val
+
+        if code == ICALL:
+            new_pc = int(valC.val) & MASK64
+        elif code == IRET:
+            new_pc = int(valM.val) & MASK64
+        elif code == IJXX and Cnd.val:
+            new_pc = int(valC.val) & MASK64
+        else:
+            new_pc = int(valP.val)
+        pc.next = new_pc
+        if profile_retire is not None:
+            profile_start()
+            profile_retire(int(pc.val), code, new_pc)
+        retire.next = (retire.val + 1) % retire.max
+
+    return update
+
+
+@block
+def SEQ(program: list[intbv], clk: _Signal, reset: _Signal, main: int, mem_size: int = MEM_SIZE,
+        checkpoint: "Checkpoint | None" = None, verbose: bool = True, counters: Counters | None = None,
+        profiler: "Profiler | None" = None, cache: "Cache | None" = None):
+    """Single-cycle Y86 processor: the same interface as CPU(), one instruction per clock.
+
+    Fetch, decode, execute and memory read are combinational, and seq_update
+    writes registers, CC, memory and PC on the clock edge, as in the textbook
+    SEQ design. state is F until the first edge out of reset, D while running
+    and HALT once Stat leaves SAOK.
+    """
+    if checkpoint is not None:
+        main = checkpoint.pc
+        mem_size = checkpoint.mem_size
+    pc = Signal(intbv(main)[64:])
+    icode = Signal(intbv(0)[4:])
+    ifun = Signal(intbv(0)[4:])
+    rA = Signal(intbv(0)[4:])
+    rB = Signal(intbv(0)[4:])
+    valA = Signal(intbv(0)[64:].signed())
+    valB = Signal(intbv(0)[64:].signed())
+    valC = Signal(intbv(0)[64:].signed())
+    valE = Signal(intbv(0)[64:].signed())
+    valM = Signal(intbv(0)[64:].signed())
+    valP = Signal(intbv(0)[64:])
+    Regs = [Signal(intbv(0)[64:].signed()) for _ in range(15)]
+    #rsp
+    Regs[4] = Signal(intbv(mem_size - 1, min=-2**63, max=2**63))
+    if checkpoint is not None:
+        Regs = [Signal(intbv(val)[64:].signed()) for val in checkpoint.registers]
+
+    dstE = Signal(intbv(0)[4:])
+    dstM = Signal(intbv(0)[4:])
+    Cnd = Signal(intbv(0)[1:])
+    Stat = Signal(intbv(0 if checkpoint is None else checkpoint.stat)[3:])
+    CC = Signal(intbv(0 if checkpoint is None else checkpoint.cc)[3:])
+    new_CC = Signal(intbv(0)[3:])
+    old_CC = Signal(CC.val)
+    imem_error = Signal(bool(0))
+    dmem_error = Signal(bool(0))
+    instr_valid = Signal(bool(1))
+    if checkpoint is None:
+        mem = RAM(mem_size, program)
+    else:
+        mem = RAM(mem_size, checkpoint.memory(), checkpoint.code_end)
+    journal = Journal() if verbose else None
+    state = Signal(t_state.F)
+    retire = Signal(intbv(0)[32:])
+
+    instances = [
+        seq_fetch(mem, pc, icode, ifun, rA, rB, valC, valP, instr_valid, imem_error),
+        seq_decode(icode, rA, rB, valA, valB, Regs),
+        seq_execute(icode, ifun, valA, valB, valC, valE, Cnd, CC, new_CC, dstE, dstM, rA, rB),
+        seq_memory(mem, icode, valE, valA, valM, dmem_error),
+        seq_update(clk, reset, state, retire, icode, instr_valid, imem_error, dmem_error, Stat,
+                   pc, valP, valC, valA, valE, valM, Cnd, dstE, dstM, Regs, CC, new_CC, old_CC, mem, journal, profiler,
+                   cache),
+    ]
+    if counters is not None:
+        instances.append(counters_block(clk, reset, retire, state, icode, ifun, Cnd, Stat, counters))
+    return instances
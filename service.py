@@ -0,0 +1,316 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import yasm
+from ram import MEM_SIZE
+from batch import BACKENDS, DEFAULT_MAX_CYCLES, DEFAULT_TIMEOUT, run_image
+
+
+DEFAULT_SOCKET = "y86.sock"
+DEFAULT_QUEUE_SIZE = 64
+# Largest memory a job may ask for; every job allocates it in a worker
+DEFAULT_MAX_MEM_SIZE = 64 * 1024
+# Latencies kept for the percentiles in the metrics
+LATENCY_WINDOW = 1000
+# Longest request line accepted, programs included
+MAX_LINE = 16 * 1024 * 1024
+WARMUP_PROGRAM = ["$main:", "halt"]
+
+
+def warm_worker():
+    """Process pool initializer: import MyHDL and the processors and elaborate each one once,
+    so the first real job of the worker does not pay for it"""
+    image, labels = yasm.assemble(WARMUP_PROGRAM)
+    for mode in ("multi", "seq", "pipe"):
+        run_image(image, labels['main'], "hdl", mem_size=64, mode=mode)
+    for backend in ("interp", "translate"):
+        run_image(image, labels['main'], backend, mem_size=64)
+
+
+def serve_job(request: dict, max_cycles: int, timeout: float, max_mem_size: int = DEFAULT_MAX_MEM_SIZE) -> dict:
+    """Assemble (if given source) and simulate one request in a worker process.
+
+    The request has either "source", the text of a .ys program, or "image",
+    the machine code as hex with "main"; the cycle limit, timeout and memory
+    size of the request are capped at the server's.
+    """
+    start = time.monotonic()
+    try:
+        if "source" in request:
+            image, labels = yasm.assemble(request["source"].splitlines())
+            main = labels.get('main', -1)
+        else:
+            image = bytes.fromhex(request["image"])
+            main = request.get("main", 0)
+        backend = request.get("backend", "hdl")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+        result = run_image(image, main, backend, min(request.get("max_cycles", max_cycles), max_cycles),
+                           min(request.get("timeout", timeout), timeout), min(request.get("mem_size", MEM_SIZE), max_mem_size),
+                           request.get("mode", "multi"))
+    except Exception as e:
+        result = {"error": f"{type(e).__name__}: {e}"}
+    result["run_time"] = time.monotonic() - start
+    return result
+
+
+class Metrics:
+    """Queue depth, job counts and queue wait and total latency of the last LATENCY_WINDOW jobs"""
+
+    def __init__(self, queue: asyncio.Queue):
+        self.queue = queue
+        self.max_depth = 0
+        self.accepted = 0
+        self.completed = 0
+        self.failed = 0
+        self.waits = deque(maxlen=LATENCY_WINDOW)
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def enqueued(self):
+        self.accepted += 1
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def finished(self, wait: float, latency: float, failed: bool):
+        self.completed += 1
+        self.failed += failed
+        self.waits.append(wait)
+        self.latencies.append(latency)
+
+    @staticmethod
+    def summary(values: deque) -> dict:
+        if not values:
+            return {"count": 0}
+        ordered = sorted(values)
+        return {
+            "count": len(ordered),
+            "mean": sum(ordered) / len(ordered),
+            "p50": ordered[len(ordered) // 2],
+            "p95": ordered[min(len(ordered) * 95 // 100, len(ordered) - 1)],
+            "max": ordered[-1],
+        }
+
+    def report(self) -> dict:
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_capacity": self.queue.maxsize,
+            "max_queue_depth": self.max_depth,
+            "accepted": self.accepted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "in_flight": self.accepted - self.completed,
+            "queue_wait": self.summary(self.waits),
+            "latency": self.summary(self.latencies),
+        }
+
+
+class Service:
+    """Line-delimited JSON simulation server in front of a pool of warm worker processes.
+
+    Every request line is a job ({"id", "source" or "image"/"main",
+    "backend", "mode", "max_cycles", "timeout", "mem_size"}) or
+    {"op": "metrics"}. Jobs go into a bounded queue; while it is full the
+    connection is not read any further, so clients are slowed down by the
+    socket instead of the server buffering without limit. Each job gets an
+    "accepted" line once queued and a "result" line when it finishes, in
+    completion order, so one connection can keep many jobs in flight.
+    """
+
+    def __init__(self, workers: int | None = None, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 max_cycles: int = DEFAULT_MAX_CYCLES, timeout: float = DEFAULT_TIMEOUT,
+                 max_mem_size: int = DEFAULT_MAX_MEM_SIZE):
+        self.workers = workers or os.cpu_count()
+        self.max_cycles = max_cycles
+        self.timeout = timeout
+        self.max_mem_size = max_mem_size
+        self.queue = asyncio.Queue(queue_size)
+        self.metrics = Metrics(self.queue)
+        self.pool = None
+        self.dispatchers = []
+
+    async def start(self):
+        """Start the worker processes and wait until every one of them is warm"""
+        loop = asyncio.get_running_loop()
+        self.pool = self.new_pool()
+        # The pool starts its processes lazily; one no-op per worker brings them all up
+        await asyncio.gather(*(loop.run_in_executor(self.pool, time.sleep, 0.1) for _ in range(self.workers)))
+        self.dispatchers = [asyncio.create_task(self.dispatch()) for _ in range(self.workers)]
+
+    def new_pool(self) -> ProcessPoolExecutor:
+        # Workers come from a fork server started with the first pool: a worker forked from the
+        # server itself would inherit the client sockets open at the time and keep them from closing
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("forkserver"),
+                                   initializer=warm_worker)
+
+    async def close(self):
+        for task in self.dispatchers:
+            task.cancel()
+        await asyncio.gather(*self.dispatchers, return_exceptions=True)
+        self.pool.shutdown(cancel_futures=True)
+
+    async def dispatch(self):
+        """Feed queued jobs to the pool, one at a time, so at most `workers` jobs are out of the queue"""
+        loop = asyncio.get_running_loop()
+        while True:
+            request, queued, reply = await self.queue.get()
+            started = time.monotonic()
+            pool = self.pool
+            try:
+                result = await loop.run_in_executor(pool, serve_job, request, self.max_cycles, self.timeout,
+                                                    self.max_mem_size)
+            except BrokenProcessPool as e:
+                # A worker died (killed, out of memory): every job in the pool fails with this, and
+                # the first dispatcher to see it replaces the pool so the next jobs run again
+                if self.pool is pool:
+                    pool.shutdown(wait=False)
+                    self.pool = self.new_pool()
+                result = {"error": f"{type(e).__name__}: {e}"}
+            except Exception as e:
+                result = {"error": f"{type(e).__name__}: {e}"}
+            finished = time.monotonic()
+            self.metrics.finished(started - queued, finished - queued, "error" in result)
+            try:
+                await reply({"id": request.get("id"), "event": "result", **result,
+                             "queue_wait": started - queued, "latency": finished - queued})
+            except ConnectionError:
+                # The client went away; the dispatcher serves the next job
+                pass
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        lock = asyncio.Lock()
+        pending = set()
+
+        async def reply(message: dict):
+            async with lock:
+                writer.write(json.dumps(message).encode() + b"\n")
+                await writer.drain()
+
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # The line is longer than MAX_LINE and the reader has dropped what it buffered;
+                    # the rest of it cannot be told apart from the next request, so stop reading
+                    await reply({"event": "error", "error": f"Bad request: line longer than {MAX_LINE} bytes"})
+                    break
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("request must be a JSON object")
+                except ValueError as e:
+                    await reply({"event": "error", "error": f"Bad request: {e}"})
+                    continue
+                if request.get("op") == "metrics":
+                    await reply({"id": request.get("id"), "event": "metrics", **self.metrics.report()})
+                    continue
+                if "source" not in request and "image" not in request:
+                    await reply({"id": request.get("id"), "event": "error", "error": "Need source or image"})
+                    continue
+                done = asyncio.get_running_loop().create_future()
+                pending.add(done)
+
+                async def finish(result: dict, done=done):
+                    try:
+                        await reply(result)
+                    finally:
+                        done.set_result(None)
+                        pending.discard(done)
+
+                # Blocks while the queue is full, which stops reading from this client
+                await self.queue.put((request, time.monotonic(), finish))
+                self.metrics.enqueued()
+                await reply({"id": request.get("id"), "event": "accepted", "queue_depth": self.queue.qsize()})
+            # The client closed its side (or sent too long a line): answer the jobs still in flight before closing ours
+            if pending:
+                await asyncio.gather(*pending)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, path: str | None = None, host: str | None = None, port: int | None = None):
+        """Serve forever on a Unix socket at path, or on TCP host:port"""
+        await self.start()
+        try:
+            if path is not None:
+                if os.path.exists(path):
+                    os.unlink(path)
+                server = await asyncio.start_unix_server(self.handle, path, limit=MAX_LINE)
+            else:
+                server = await asyncio.start_server(self.handle, host, port, limit=MAX_LINE)
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.close()
+
+
+async def submit(requests: list[dict], path: str | None = None, host: str | None = None, port: int | None = None):
+    """Send requests to a server on a Unix socket at path, or on TCP host:port, and yield every
+    response line as it arrives"""
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path, limit=MAX_LINE)
+    else:
+        reader, writer = await asyncio.open_connection(host, port, limit=MAX_LINE)
+    for request in requests:
+        writer.write(json.dumps(request).encode() + b"\n")
+    await writer.drain()
+    writer.write_eof()
+    while line := await reader.readline():
+        yield json.loads(line)
+    writer.close()
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Y86 assembly and simulation service with a warm worker pool")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix socket path")
+    parser.add_argument("--port", type=int, default=None, help="listen on (or with --submit, connect to) TCP 127.0.0.1:PORT instead of a socket")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE, help="queued jobs before backpressure")
+    parser.add_argument("--max-cycles", type=int, default=DEFAULT_MAX_CYCLES, help="upper limit for every job")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="upper limit in seconds for every job")
+    parser.add_argument("--max-mem-size", type=int, default=DEFAULT_MAX_MEM_SIZE,
+                        help="upper limit in bytes for the memory of every job")
+    parser.add_argument("--submit", nargs="+", metavar="FILE",
+                        help="act as a client: send these .ys programs to the server and print the responses")
+    parser.add_argument("--backend", choices=BACKENDS, default="hdl", help="backend of the submitted programs")
+    args = parser.parse_args(argv)
+
+    if args.submit:
+        async def client():
+            requests = []
+            for i, name in enumerate(args.submit):
+                with open(name, 'r') as file:
+                    requests.append({"id": i, "source": file.read(), "backend": args.backend})
+            requests.append({"op": "metrics"})
+            if args.port is not None:
+                responses = submit(requests, host="127.0.0.1", port=args.port)
+            else:
+                responses = submit(requests, args.socket)
+            async for response in responses:
+                print(json.dumps(response))
+        asyncio.run(client())
+        return
+    service = Service(args.workers, args.queue_size, args.max_cycles, args.timeout, args.max_mem_size)
+    where = f"127.0.0.1:{args.port}" if args.port is not None else args.socket
+    print(f"Serving on {where} with {service.workers} workers", file=sys.stderr)
+    try:
+        if args.port is not None:
+            asyncio.run(service.serve(host="127.0.0.1", port=args.port))
+        else:
+            asyncio.run(service.serve(args.socket))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import time
+from dataclasses import dataclass, field
+
+import myhdl
+from myhdl import Signal, ResetSignal, Simulation, StopSimulation, always, block, intbv
+from utils import *
+from ram import MEM_SIZE
+from CPU import CPU, Counters, t_state, clock_generator, reset_generator
+from seq import SEQ
+from pipe import PIPE
+
+
+PERIOD = 10
+RESET_CYCLES = 3
+# Clock cycles simulated between timeout checks
+CHUNK = 10_000
+# Processor blocks by mode: the multi-phase teaching controller, single-cycle SEQ or pipelined PIPE
+MODES = {"multi": CPU, "seq": SEQ, "pipe": PIPE}
+
+
+@dataclass
+class RunResult:
+    """Final state of a CPU() run and why it stopped"""
+    status: int
+    stopped: str  # "halt", "max_cycles", "max_instructions" or "timeout"
+    cycles: int
+    instructions: int
+    pc: int
+    registers: list[int]
+    cc: int
+    mem: bytearray = field(repr=False)
+    counters: Counters | None = field(default=None, repr=False)
+
+    @property
+    def stat_name(self) -> str:
+        return stat_names.get(self.status, str(self.status))
+
+
+def run(program: list[intbv], main: int, max_cycles: int | None = None, max_instructions: int | None = None,
+        timeout: float | None = None, mem_size: int = MEM_SIZE, verbose: bool = True,
+        checkpoint: "Checkpoint | None" = None, trace: "TraceWriter | None" = None,
+        counters: Counters | None = None, mode: str = "multi", profiler: "Profiler | None" = None,
+        cache: "Cache | None" = None, branches: "BranchStats | None" = None) -> RunResult:
+    """Simulate CPU() until Stat leaves SAOK or one of the budgets is used up.
+
+    Cycles are clock cycles including reset. Instructions count every
+    instruction that retired without an error, including halt. With verbose
+    off the controller does not collect or print its per-cycle change report.
+    Given a trace writer, every retired instruction is recorded in it. Given a
+    checkpoint, the CPU starts from its state instead of program and main and
+    the counts continue from the ones stored in it; budgets apply to this run.
+    Performance counters are always collected, into the given Counters if
+    the caller wants to read them while the simulation runs. mode selects
+    CPU() ("multi"), the single-cycle SEQ() ("seq") or the pipelined PIPE() ("pipe").
+    Given a Profiler, every instruction is recorded in it (not with PIPE()).
+    Given a Cache, data accesses take its latency and are counted in it (not with PIPE()).
+    Given BranchStats, every conditional jump is recorded in it (not with PIPE()).
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode {mode!r}, expected one of {', '.join(MODES)}")
+    if branches is not None and mode == "pipe":
+        raise ValueError("Branches can not be recorded from PIPE()")
+    if counters is None:
+        counters = Counters()
+    clk = Signal(bool(0))
+    reset = ResetSignal(val=0, active=1, isasync=False)
+    cpu = MODES[mode](program, clk, reset, main, mem_size, checkpoint, verbose, counters, profiler, cache)
+    pc, CC, Stat, state, retire, Regs, mem = (cpu.symdict[name] for name in (
+        "pc", "CC", "Stat", "state", "retire", "Regs", "mem"))
+    retired = [0]
+    final = {}
+
+    def snapshot(stopped: str):
+        final.update(stopped=stopped, pc=int(pc.val), registers=[int(r.val) for r in Regs],
+                     cc=int(CC.val), status=int(Stat.val))
+
+    @block
+    def monitor():
+        # retire changes in the same update as the PC of an instruction, and state
+        # becomes HALT in the same update as the write back of the last one.
+        # Signals are cleared once the simulation stops, so the final state is kept here.
+        @always(retire)
+        def watch_retire():
+            retired[0] += 1
+            if max_instructions is not None and retired[0] >= max_instructions:
+                snapshot("max_instructions")
+                raise StopSimulation()
+
+        @always(state)
+        def watch_halt():
+            if state.val == t_state.HALT:
+                if Stat.val == SHLT:
+                    retired[0] += 1
+                snapshot("halt")
+        return watch_retire, watch_halt
+
+    instances = [cpu, monitor(), clock_generator(clk, period=PERIOD), reset_generator(reset, clk, reset_cycles=RESET_CYCLES)]
+    if trace is not None:
+        from tracer import trace_monitor
+        instances.append(trace_monitor(cpu, trace))
+    if branches is not None:
+        from branch import branch_monitor
+        instances.append(branch_monitor(cpu, branches))
+    sim = Simulation(*instances)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        cycles = int(myhdl.now()) // PERIOD
+        if max_cycles is not None and cycles >= max_cycles:
+            snapshot("max_cycles")
+            sim.quit()
+            break
+        if deadline is not None and time.monotonic() > deadline:
+            snapshot("timeout")
+            sim.quit()
+            break
+        chunk = CHUNK if deadline is not None else None
+        if max_cycles is not None:
+            chunk = min(chunk or max_cycles, max_cycles - cycles)
+        if sim.run(chunk * PERIOD if chunk else None, quiet=1) == 0:
+            break
+    cycles = int(myhdl.now()) // PERIOD
+    instructions = retired[0]
+    if checkpoint is not None:
+        cycles += checkpoint.cycles
+        instructions += checkpoint.instructions
+    return RunResult(cycles=cycles, instructions=instructions, mem=mem.data, counters=counters, **final)
@@ -1,28 +1,21 @@
 import yasm
-from CPU import *
-from myhdl import ResetSignal
-from myhdl import Simulation, StopSimulation
+from myhdl import intbv
+from simulate import run
+from utils import print_registers
+
+# Stop runaway programs instead of simulating forever
+MAX_CYCLES = 1_000_000
+
 
 def test_cpu(program: list[intbv], main: int):
-    # Create signals
     if main == -1:
         print("No main function found")
         return
-    clk = Signal(bool(0))
-    reset = ResetSignal(val=0, active=1, isasync=False)
-    
-    # Instantiate CPU and generators
-    cpu = CPU(program, clk, reset, main)
-    clock_gen = clock_generator(clk, period=10)
-    reset_gen = reset_generator(reset, clk, reset_cycles=3)
-    
-    # Run simulation
-    try:
-        sim = Simulation(cpu, clock_gen, reset_gen)
-        sim.run(2000)  # Run for 100 time units
-        sim.quit()
-    except StopSimulation as e:
-        print(e)
+    result = run(program, main, max_cycles=MAX_CYCLES)
+    print(f"Stopped by {result.stopped} after {result.cycles} cycles and {result.instructions} instructions. "
+          f"State: {result.stat_name}, pc: {result.pc}")
+    print_registers(result.registers)
+    return result
 
     
 if __name__ == "__main__":
@@ -30,4 +23,4 @@ if __name__ == "__main__":
     program, main = yasm.yassembling(file_path)
     test_cpu(program, main)
 
-    #добавить метки и уметь их парсить в машинный код
\ No newline at end of file
+    #добавить метки и уметь их парсить в машинный код
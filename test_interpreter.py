@@ -0,0 +1,25 @@
+from isa import *
+from interpreter import Interpreter
+
+
+def irmovq(val: int, rB: int) -> bytes:
+    return bytes([0x30, RNONE << 4 | rB]) + (val & ((1 << 64) - 1)).to_bytes(8, 'little')
+
+
+def test_rnone_operands():
+    program = (irmovq(5, RRAX) + irmovq(3, RRBX)
+               + irmovq(7, RNONE)                # irmovq into 0xF is dropped
+               + bytes([0x20, RRAX << 4 | RNONE])  # rrmovq %rax, 0xF is dropped
+               + bytes([0x20, RNONE << 4 | RRCX])  # rrmovq 0xF, %rcx reads 0
+               + bytes([0x60, RNONE << 4 | RRBX])  # addq 0xF, %rbx: %rbx = 0 + 3
+               + bytes([0x61, RRAX << 4 | RNONE])  # subq %rax, 0xF: only CC
+               + bytes([0x00]))
+    machine = Interpreter(program, 0)
+    machine.regs[RRCX] = 9
+    assert machine.run() == SHLT
+    assert machine.instructions == 8
+    assert machine.regs[RRAX] == 5
+    assert machine.regs[RRBX] == 3
+    assert machine.regs[RRCX] == 0
+    # %rax - 0 = 5: not zero, not negative
+    assert machine.cc == 0
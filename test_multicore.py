@@ -0,0 +1,20 @@
+import yasm
+from multicore import run_multicore
+from simulate import run
+
+
+PROGRAM = ["$main:", "irmovq 2048, %rbx", "irmovq 3, %rcx", "irmovq -1, %r10",
+           "$loop:", "rmmovq %rcx, 0(%rbx)", "mrmovq 0(%rbx), %r8", "pushq %r8", "popq %r9",
+           "addq %r10, %rcx", "jne loop", "halt"]
+
+
+def test_single_core_counters_match_simulate():
+    image, labels = yasm.assemble(PROGRAM)
+    multi = run_multicore(image, [labels['main']])
+    single = run(image, labels['main'], verbose=False, mem_size=4096)
+    core = multi.cores[0]
+    assert core["stopped"] == "halt"
+    assert multi.cycles == single.cycles
+    assert core["counters"] == single.counters.report()
+    assert core["counters"]["mix"]["halt"] == 1
+    assert core["registers"][:4] == single.registers[:4]
@@ -0,0 +1,37 @@
+import yasm
+from isa import *
+from interpreter import Interpreter
+from ram import MASK64
+from simulate import MODES, run
+
+
+def check_against_interpreter(image: bytes, main: int = 0):
+    machine = Interpreter(image, main)
+    machine.run()
+    expected = (machine.stat, machine.pc & MASK64, machine.instructions, [r & MASK64 for r in machine.regs])
+    for mode in MODES:
+        result = run(image, main, verbose=False, mode=mode, max_cycles=1000)
+        assert (result.status, result.pc, result.instructions, [r & MASK64 for r in result.registers]) == expected, mode
+
+
+def assemble(source: list[str]) -> bytes:
+    image, _ = yasm.assemble(["$main:"] + source)
+    return image
+
+
+def test_ret_to_negative_address():
+    # ret pops a signed valM; the PC takes it as an unsigned address and faults on the fetch
+    check_against_interpreter(assemble(["irmovq -1, %rax", "pushq %rax", "ret"]))
+
+
+def test_jump_to_top_address():
+    check_against_interpreter(assemble(["jmp 18446744073709551615"]))
+
+
+def test_fetch_fault_does_not_repeat_the_last_instruction():
+    # The fetch at 5000 fails; ret must not pop a second time
+    check_against_interpreter(assemble(["irmovq 5000, %rax", "pushq %rax", "ret"]))
+
+
+def test_invalid_instruction_does_not_repeat_the_last_instruction():
+    check_against_interpreter(assemble(["irmovq 1, %rax", "pushq %rax"]) + bytes([0xF0]))
@@ -0,0 +1,57 @@
+import random
+
+import numpy as np
+
+from isa import *
+from interpreter import Interpreter
+from predecode import instr_length
+from vector import VectorMachine
+
+
+MEM_SIZE = 512
+OPCODES = (0x10, 0x20, 0x21, 0x25, 0x30, 0x40, 0x50, 0x60, 0x61, 0x62, 0x63, 0x70, 0x74, 0x80, 0x90, 0xA0, 0xB0)
+
+
+def random_program(rng: random.Random, count: int = 40) -> bytes:
+    """Random instructions whose register bytes often name 0xF; jumps and calls go to instruction starts"""
+    starts = []
+    out = bytearray()
+    for _ in range(count):
+        starts.append(len(out))
+        op = rng.choice(OPCODES)
+        out.append(op)
+        if instr_length(op >> 4) > 1 and op >> 4 not in (IJXX, ICALL):
+            ra = RNONE if rng.random() < 0.3 else rng.randrange(15)
+            rb = RNONE if rng.random() < 0.3 else rng.randrange(15)
+            out.append(ra << 4 | rb)
+        if op >> 4 in (IIRMOVQ, IRMMOVQ, IMRMOVQ):
+            out += rng.randrange(MEM_SIZE // 2).to_bytes(8, 'little')
+        elif op >> 4 in (IJXX, ICALL):
+            out += bytes(8)
+    out.append(IHALT)
+    # Point jump targets at real instruction starts
+    for start in starts:
+        if out[start] >> 4 in (IJXX, ICALL):
+            target = rng.choice(starts)
+            out[start + 1:start + 9] = target.to_bytes(8, 'little')
+    return bytes(out)
+
+
+def test_vector_matches_interpreter():
+    n = 8
+    for seed in range(200):
+        rng = random.Random(seed)
+        program = random_program(rng)
+        vm = VectorMachine(program, 0, n, MEM_SIZE)
+        starts = [[rng.randrange(MEM_SIZE) for _ in range(15)] for _ in range(n)]
+        vm.regs[:] = np.array(starts, dtype=np.int64)
+        vm.run(300)
+        for i in range(n):
+            machine = Interpreter(program, 0, MEM_SIZE)
+            machine.regs[:] = starts[i]
+            machine.run(300)
+            assert int(vm.stat[i]) == machine.stat, seed
+            assert int(vm.instructions[i]) == machine.instructions, seed
+            assert [int(r) for r in vm.regs[i]] == machine.regs, seed
+            assert int(vm.cc[i]) == machine.cc, seed
+            assert bytes(vm.mem[i]) == bytes(machine.mem), seed
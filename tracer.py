@@ -0,0 +1,204 @@
+import struct
+import sys
+from array import array
+from typing import Iterator, NamedTuple
+
+from isa import *
+from interpreter import COND_TABLE, to_signed
+
+
+MAGIC = b'Y86T'
+VERSION = 1
+FILE_HEADER = struct.Struct('<4sH')
+CHUNK_HEADER = struct.Struct('<I')
+# Words buffered before a chunk is written out
+CHUNK_WORDS = 1 << 16
+
+# Every instruction is two int64 words, pc and a packed header:
+#   bits 0-3 icode, 4-7 ifun, 8-10 Stat, 11-13 CC, 14 CC changed,
+#   15-16 number of register writes, 17 memory write, 20-23 / 24-27 registers,
+# followed by one word per register write value and (address, value) for a
+# memory write.
+
+
+class TraceEvent(NamedTuple):
+    pc: int
+    icode: int
+    ifun: int
+    stat: int
+    cc: int | None  # new CC, None when it did not change
+    reg_writes: tuple[tuple[int, int], ...]
+    mem_write: tuple[int, int] | None
+
+
+class TraceWriter:
+    """Collects retired instructions in an array('q') and writes it to a binary file in chunks"""
+
+    def __init__(self, path: str, chunk_words: int = CHUNK_WORDS):
+        self.file = open(path, 'wb')
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION))
+        self.chunk_words = chunk_words
+        self.buf = array('q')
+        self.events = 0
+
+    def record(self, pc: int, icode: int, ifun: int, stat: int, cc: int | None,
+               reg_writes: tuple[tuple[int, int], ...] = (), mem_write: tuple[int, int] | None = None):
+        header = icode | ifun << 4 | stat << 8 | len(reg_writes) << 15
+        if cc is not None:
+            header |= cc << 11 | 1 << 14
+        buf = self.buf
+        buf.append(to_signed(pc))
+        buf.append(0)
+        at = len(buf) - 1
+        for i, (reg, val) in enumerate(reg_writes):
+            header |= reg << (20 + 4 * i)
+            buf.append(to_signed(val))
+        if mem_write is not None:
+            header |= 1 << 17
+            buf.append(to_signed(mem_write[0]))
+            buf.append(to_signed(mem_write[1]))
+        buf[at] = header
+        self.events += 1
+        if len(buf) >= self.chunk_words:
+            self.flush()
+
+    def flush(self):
+        if not self.buf:
+            return
+        if sys.byteorder == 'big':
+            self.buf.byteswap()
+        self.file.write(CHUNK_HEADER.pack(len(self.buf)))
+        self.file.write(self.buf.tobytes())
+        self.buf = array('q')
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self) -> "TraceWriter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_trace(path: str) -> Iterator[TraceEvent]:
+    """Lazily yield the events of a trace file, one chunk in memory at a time"""
+    with open(path, 'rb') as file:
+        magic, version = FILE_HEADER.unpack(file.read(FILE_HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a version {VERSION} Y86 trace: {path}")
+        while True:
+            size = file.read(CHUNK_HEADER.size)
+            if not size:
+                return
+            (n,) = CHUNK_HEADER.unpack(size)
+            words = array('q')
+            words.frombytes(file.read(8 * n))
+            if sys.byteorder == 'big':
+                words.byteswap()
+            i = 0
+            while i < n:
+                pc, header = words[i], words[i + 1]
+                i += 2
+                n_regs = header >> 15 & 0x3
+                reg_writes = []
+                for j in range(n_regs):
+                    reg_writes.append((header >> (20 + 4 * j) & 0xF, words[i]))
+                    i += 1
+                mem_write = None
+                if header >> 17 & 1:
+                    mem_write = (words[i], words[i + 1])
+                    i += 2
+                cc = header >> 11 & 0x7 if header >> 14 & 1 else None
+                yield TraceEvent(pc, header & 0xF, header >> 4 & 0xF, header >> 8 & 0x7, cc,
+                                 tuple(reg_writes), mem_write)
+
+
+def trace_run(machine, writer: TraceWriter, max_instructions: int | None = None) -> int:
+    """Run an Interpreter (or Translator, one instruction at a time) recording every retired instruction"""
+    regs = machine.regs
+    count = 0
+    while machine.stat == SAOK and (max_instructions is None or count < max_instructions):
+        pc = machine.pc
+        icode, ifun, rA, rB, valC, _, _ = machine.code.lookup(pc)
+        cc = machine.cc
+        rsp = regs[RRSP]
+        addr = None
+        if icode == IRMMOVQ:
+            addr = to_signed(valC + (regs[rB] if rB != RNONE else 0))
+        elif icode in (IPUSHQ, ICALL):
+            addr = to_signed(rsp - 8)
+        before = machine.instructions
+        machine.step()
+        if machine.instructions == before:
+            break
+        count += 1
+
+        # Same destinations as dstE and dstM in the execute stage; writes to 0xF are dropped
+        if icode in (IRRMOVQ, IIRMOVQ, IOPQ) and rB == RNONE or icode == IMRMOVQ and rA == RNONE:
+            writes = ()
+        elif icode == IRRMOVQ:
+            writes = ((rB, regs[rB]),) if ifun == 0 or COND_TABLE[cc][ifun] else ()
+        elif icode in (IIRMOVQ, IOPQ):
+            writes = ((rB, regs[rB]),)
+        elif icode == IMRMOVQ:
+            writes = ((rA, regs[rA]),)
+        elif icode in (ICALL, IPUSHQ):
+            writes = ((RRSP, to_signed(rsp - 8)),)
+        elif icode == IRET:
+            writes = ((RRSP, to_signed(rsp + 8)),)
+        elif icode == IPOPQ:
+            writes = ((RRSP, to_signed(rsp + 8)),)
+            if rA != RNONE:
+                writes += ((rA, regs[rA]),)
+        else:
+            writes = ()
+        mem_write = (addr, machine.read_mem(addr)) if addr is not None else None
+        writer.record(pc, icode, ifun, machine.stat, machine.cc if machine.cc != cc else None, writes, mem_write)
+    return machine.stat
+
+
+def trace_monitor(cpu, writer: TraceWriter):
+    """Records every instruction retired by a CPU() or SEQ() instance into the writer.
+
+    The MyHDL block is built on the call, so reading and writing traces of
+    the functional models does not import MyHDL.
+    """
+    from myhdl import always, block
+    from CPU import t_state
+
+    @block
+    def monitor():
+        pc, icode, ifun, Stat, CC, state, retire, dstE, dstM, valE, valM, mem = (cpu.symdict[name] for name in (
+            "pc", "icode", "ifun", "Stat", "CC", "state", "retire", "dstE", "dstM", "valE", "valM", "mem"))
+        last = {"pc": int(pc.val), "cc": int(CC.val)}
+
+        def record():
+            code = int(icode.val)
+            writes = []
+            if dstE.val != RNONE:
+                writes.append((int(dstE.val), int(valE.val)))
+            if dstM.val != RNONE:
+                writes.append((int(dstM.val), int(valM.val)))
+            mem_write = None
+            if code in (IRMMOVQ, IPUSHQ, ICALL):
+                mem_write = (int(valE.val), mem.read(int(valE.val)))
+            cc = int(CC.val)
+            writer.record(last["pc"], code, int(ifun.val), int(Stat.val), cc if cc != last["cc"] else None,
+                          tuple(writes), mem_write)
+            last["cc"] = cc
+
+        # retire changes together with the PC update of an instruction, state
+        # becomes HALT together with the write back of the halting one
+        @always(retire)
+        def watch_retire():
+            record()
+            last["pc"] = int(pc.val)
+
+        @always(state)
+        def watch_halt():
+            if state.val == t_state.HALT and Stat.val == SHLT:
+                record()
+        return watch_retire, watch_halt
+    return monitor()
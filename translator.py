@@ -0,0 +1,223 @@
+import time
+from isa import *
+from ram import MEM_SIZE, MASK64
+from interpreter import Interpreter, COND_TABLE, SIGN64
+
+
+MAX_BLOCK_LEN = 64
+OPQ_EXPR = {0: "a + b", 1: "a - b", 2: "a & b", 3: "a ^ b"}
+
+
+class Block:
+    """A translated basic block and the blocks it has been chained to"""
+
+    def __init__(self, pc: int, length: int, func):
+        self.pc = pc
+        self.length = length
+        self.func = func
+        self.links = {}
+
+
+class Translator(Interpreter):
+    """Runs programs by translating Y86 basic blocks into cached Python functions.
+
+    A block starts at any PC inside the program and ends after a jXX, call,
+    ret or halt (or MAX_BLOCK_LEN instructions). Its instructions, taken from
+    the predecoded table, are turned into one Python function that works
+    directly on the register list and the memory bytearray. Blocks are cached
+    by entry PC and link to their successors, so hot loops never go back to
+    the cache. Anything that cannot be translated - invalid instructions, code
+    outside the program, the tail of an instruction budget - is executed by
+    the Interpreter step() instead. Stores into the program drop every
+    translation.
+    """
+
+    def __init__(self, program: "list[intbv] | bytes", main: int, mem_size: int = MEM_SIZE):
+        super().__init__(program, main, mem_size)
+        self.blocks = {}
+        self.flushed = False
+        self.hits = 0
+        self.misses = 0
+        self.seconds = 0.0
+
+    def write_mem(self, addr: int, val: int) -> bool:
+        ok = super().write_mem(addr, val)
+        if ok and addr < self.code.code_end:
+            self.flush()
+        return ok
+
+    def code_written(self, addr: int):
+        """Called by translated blocks after a store into the program"""
+        self.code.invalidate(addr, 8)
+        self.flush()
+
+    def flush(self):
+        self.blocks.clear()
+        self.flushed = True
+
+    def block_at(self, pc: int) -> Block | None:
+        blk = self.blocks.get(pc)
+        if blk is not None:
+            self.hits += 1
+            return blk
+        if not 0 <= pc < self.code.code_end:
+            return None
+        blk = self.translate(pc)
+        if blk is not None:
+            self.misses += 1
+            self.blocks[pc] = blk
+        return blk
+
+    def translate(self, pc: int) -> Block | None:
+        """Compile the basic block starting at pc, or return None if its first instruction can't be"""
+        entry_pc = pc
+        body = []
+        n = 0
+        end = False
+        while not end and n < MAX_BLOCK_LEN:
+            entry = self.code.lookup(pc)
+            icode, ifun, rA, rB, valC, valP, stat = entry
+            if stat != SAOK or valP > self.code.code_end or (icode == IOPQ and ifun not in OPQ_EXPR):
+                break
+            n += 1
+            end = self._emit(body, entry, pc, n)
+            pc = valP
+        if n == 0:
+            return None
+        if not end:
+            # Block was cut short, continue at the next instruction
+            body += ["    m.cc = cc", f"    m.instructions += {n}", f"    return {pc}"]
+
+        src = "def block(m, r, mem):\n    cc = m.cc\n" + "\n".join(body) + "\n"
+        namespace = {"COND": COND_TABLE, "is_overflow": is_overflow, "MASK64": MASK64, "SIGN64": SIGN64}
+        exec(compile(src, f"<y86 block {entry_pc}>", "exec"), namespace)
+        return Block(entry_pc, n, namespace["block"])
+
+    def _emit(self, body: list[str], entry: tuple, pc: int, n: int) -> bool:
+        """Append the code of one instruction, return True if it ends the block"""
+        icode, ifun, rA, rB, valC, valP, _ = entry
+        limit = len(self.mem) - 8
+        code_end = self.code.code_end
+
+        def stop(next_pc: int | str, count: int, stat: str = "") -> list[str]:
+            lines = ["m.cc = cc", f"m.instructions += {count}"]
+            if stat:
+                lines.append(f"m.stat = {stat}")
+            return lines + [f"return {next_pc}"]
+
+        lines = [f"# pc {pc}"]
+        # Register 0xF reads as 0 and writes to it are dropped, as in Interpreter
+        a_reg = f"r[{rA}]" if rA != RNONE else "0"
+        b_reg = f"r[{rB}]" if rB != RNONE else "0"
+        if icode == IHALT:
+            lines += stop(pc, n, str(SHLT))
+        elif icode == INOP:
+            pass
+        elif icode == IRRMOVQ:
+            if rB == RNONE:
+                pass
+            elif ifun == 0:
+                lines.append(f"r[{rB}] = {a_reg}")
+            else:
+                lines.append(f"if COND[cc][{ifun}]:")
+                lines.append(f"    r[{rB}] = {a_reg}")
+        elif icode == IIRMOVQ:
+            if rB != RNONE:
+                lines.append(f"r[{rB}] = {valC}")
+        elif icode in (IRMMOVQ, IMRMOVQ):
+            lines.append(f"a = ({valC} + {b_reg}) & MASK64")
+            lines.append(f"if a > {limit}:")
+            lines += ["    " + line for line in stop(pc, n - 1, str(SADR))]
+            if icode == IRMMOVQ:
+                lines.append(f"mem[a:a + 8] = ({a_reg} & MASK64).to_bytes(8, 'little')")
+                lines.append(f"if a < {code_end}:")
+                lines.append("    m.code_written(a)")
+                lines += ["    " + line for line in stop(valP, n)]
+            elif rA != RNONE:
+                lines.append(f"r[{rA}] = int.from_bytes(mem[a:a + 8], 'little', signed=True)")
+        elif icode == IOPQ:
+            lines.append(f"a = {a_reg}")
+            lines.append(f"b = {b_reg}")
+            if ifun in (0, 1):
+                lines.append(f"e = (({OPQ_EXPR[ifun]} + SIGN64) & MASK64) - SIGN64")
+            else:
+                lines.append(f"e = {OPQ_EXPR[ifun]}")
+            if rB != RNONE:
+                lines.append(f"r[{rB}] = e")
+            # CC[0] -> ZF, CC[1] -> SF, CC[2] -> OF
+            lines.append(f"cc = (e == 0) | (e < 0) << 1 | is_overflow(a, b, e, {ifun}) << 2")
+        elif icode == IJXX:
+            if ifun == 0:
+                lines += stop(valC, n)
+            else:
+                lines.append(f"if COND[cc][{ifun}]:")
+                lines += ["    " + line for line in stop(valC, n)]
+                lines += stop(valP, n)
+        elif icode in (ICALL, IPUSHQ):
+            lines.append(f"a = r[{RRSP}] - 8")
+            lines.append(f"if a < 0 or a > {limit}:")
+            lines += ["    " + line for line in stop(pc, n - 1, str(SADR))]
+            value = valP if icode == ICALL else a_reg
+            lines.append(f"mem[a:a + 8] = ({value} & MASK64).to_bytes(8, 'little')")
+            lines.append(f"r[{RRSP}] = a")
+            lines.append(f"if a < {code_end}:")
+            lines.append("    m.code_written(a)")
+            lines += ["    " + line for line in stop(valC if icode == ICALL else valP, n)]
+            if icode == ICALL:
+                lines += stop(valC, n)
+        elif icode in (IRET, IPOPQ):
+            lines.append(f"a = r[{RRSP}]")
+            lines.append(f"if a < 0 or a > {limit}:")
+            lines += ["    " + line for line in stop(pc, n - 1, str(SADR))]
+            lines.append(f"r[{RRSP}] = a + 8")
+            if icode == IRET:
+                lines += stop("int.from_bytes(mem[a:a + 8], 'little', signed=True)", n)
+            elif rA != RNONE:
+                lines.append(f"r[{rA}] = int.from_bytes(mem[a:a + 8], 'little', signed=True)")
+
+        body.extend("    " + line for line in lines)
+        return icode in (IHALT, IJXX, ICALL, IRET)
+
+    def run(self, max_instructions: int | None = None) -> int:
+        """Run until Stat leaves SAOK or max_instructions have been executed"""
+        start = time.perf_counter()
+        limit = None if max_instructions is None else self.instructions + max_instructions
+        regs = self.regs
+        mem = self.mem
+        blk = None
+        while self.stat == SAOK:
+            if limit is not None and self.instructions >= limit:
+                break
+            pc = self.pc
+            nxt = blk.links.get(pc) if blk is not None else None
+            if nxt is not None:
+                self.hits += 1
+            else:
+                nxt = self.block_at(pc)
+                if nxt is not None and blk is not None:
+                    blk.links[pc] = nxt
+            if nxt is None or (limit is not None and self.instructions + nxt.length > limit):
+                self.step()
+                blk = None
+                continue
+            self.pc = nxt.func(self, regs, mem)
+            if self.flushed:
+                self.flushed = False
+                blk = None
+            else:
+                blk = nxt
+        self.seconds += time.perf_counter() - start
+        return self.stat
+
+    def stats(self) -> dict:
+        """Instructions/sec over all run() calls and the translation cache hit rate"""
+        lookups = self.hits + self.misses
+        return {
+            "instructions": self.instructions,
+            "seconds": self.seconds,
+            "instructions_per_sec": self.instructions / self.seconds if self.seconds else 0.0,
+            "blocks_translated": self.misses,
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,192 @@
+import numpy as np
+
+from isa import *
+from ram import MEM_SIZE
+from predecode import instr_length
+
+
+# Cond() for every CC/ifun pair, indexed as COND[cc, ifun]
+COND = np.array([[Cond(cc, ifun) for ifun in range(16)] for cc in range(8)], dtype=bool)
+# Instruction length of every icode; icodes above IPOPQ are rejected before it matters
+LENGTH = np.array([instr_length(icode) for icode in range(16)], dtype=np.int64)
+FETCH = np.arange(10, dtype=np.int64)
+WORD = np.arange(8, dtype=np.int64)
+
+
+class VectorMachine:
+    """N instances of one Y86-64 program stepped together on NumPy arrays.
+
+    Registers are an (N, 15) int64 array, memory an (N, mem_size) uint8 array
+    and PC, CC, Stat and the retired instruction count are vectors of length
+    N, all public so every instance can get its own initial registers and
+    data before run(). step() fetches and decodes the instruction of every
+    running instance at once, then applies the semantics of each icode to
+    the instances that decoded it with a few array operations. Instances
+    follow the interpreter exactly, including self-modifying code, and stop
+    independently when their Stat leaves SAOK.
+    """
+
+    def __init__(self, program: "list[intbv] | bytes | memoryview", main: int, n: int, mem_size: int = MEM_SIZE):
+        if len(program) > mem_size:
+            raise ValueError(f"Program of {len(program)} bytes does not fit into {mem_size} bytes of memory")
+        image = program if isinstance(program, (bytes, bytearray, memoryview)) else bytes(int(b) for b in program)
+        self.n = n
+        self.mem_size = mem_size
+        # Each row has 10 spare bytes so fetching near the end of memory needs no bounds checks
+        self.stride = mem_size + 10
+        self._mem = np.zeros((n, self.stride), dtype=np.uint8)
+        self._flat = self._mem.reshape(-1)
+        self.mem = self._mem[:, :mem_size]
+        self.mem[:, :len(image)] = np.frombuffer(bytes(image), dtype=np.uint8)
+        # Column RNONE reads as 0 and swallows writes, so rA/rB need no special casing
+        self._regs = np.zeros((n, 16), dtype=np.int64)
+        self.regs = self._regs[:, :15]
+        self.regs[:, RRSP] = mem_size - 1
+        self.pc = np.full(n, main, dtype=np.int64)
+        self.cc = np.zeros(n, dtype=np.uint8)
+        self.stat = np.full(n, SAOK, dtype=np.uint8)
+        self.instructions = np.zeros(n, dtype=np.int64)
+
+    def _load(self, rows: np.ndarray, addr: np.ndarray) -> np.ndarray:
+        return self._flat[(rows * self.stride + addr)[:, None] + WORD].view('<i8').ravel()
+
+    def _store(self, rows: np.ndarray, addr: np.ndarray, val: np.ndarray):
+        self._flat[(rows * self.stride + addr)[:, None] + WORD] = val.astype('<i8').view(np.uint8).reshape(-1, 8)
+
+    def _bad(self, addr: np.ndarray) -> np.ndarray:
+        return (addr < 0) | (addr > self.mem_size - 8)
+
+    def step(self) -> int:
+        """Execute one instruction on every running instance and return how many are still running"""
+        idx = np.flatnonzero(self.stat == SAOK)
+        if idx.size == 0:
+            return 0
+        size = self.mem_size
+        pc = self.pc[idx]
+
+        # Fetch from the flat memory; a PC outside of it is clamped and rejected below
+        raw = self._flat[(idx * self.stride + np.clip(pc, 0, size))[:, None] + FETCH]
+        icode = (raw[:, 0] >> 4).astype(np.int64)
+        ifun = (raw[:, 0] & 0xF).astype(np.int64)
+        valP = pc + LENGTH[icode]
+        fault = np.where((pc < 0) | (pc >= size), SADR,
+                         np.where(icode > IPOPQ, SINS, np.where(valP > size, SADR, SAOK)))
+        fault[(fault == SAOK) & (icode == IOPQ) & (ifun > 3)] = SINS
+        bad = fault != SAOK
+        if bad.any():
+            self.stat[idx[bad]] = fault[bad]
+            keep = ~bad
+            idx, pc, raw, icode, ifun, valP = idx[keep], pc[keep], raw[keep], icode[keep], ifun[keep], valP[keep]
+
+        # Decode
+        rA = (raw[:, 1] >> 4).astype(np.int64)
+        rB = (raw[:, 1] & 0xF).astype(np.int64)
+        valC = np.where(LENGTH[icode] == 9, np.ascontiguousarray(raw[:, 1:9]).view('<i8').ravel(),
+                        np.ascontiguousarray(raw[:, 2:10]).view('<i8').ravel())
+        R = self._regs
+        valA = R[idx, rA]
+        valB = R[idx, rB]
+        rsp = R[idx, RRSP]
+        cc = self.cc[idx]
+        new_pc = valP
+        done = np.ones(idx.size, dtype=bool)
+        present = np.bincount(icode, minlength=16)
+
+        if present[IHALT]:
+            m = icode == IHALT
+            self.stat[idx[m]] = SHLT
+            new_pc = np.where(m, pc, new_pc)
+        if present[IRRMOVQ]:
+            m = (icode == IRRMOVQ) & ((ifun == 0) | COND[cc, ifun])
+            R[idx[m], rB[m]] = valA[m]
+        if present[IIRMOVQ]:
+            m = icode == IIRMOVQ
+            R[idx[m], rB[m]] = valC[m]
+        if present[IRMMOVQ]:
+            m = icode == IRMMOVQ
+            addr = valC + valB
+            fail = m & self._bad(addr)
+            done &= ~fail
+            m &= ~fail
+            self._store(idx[m], addr[m], valA[m])
+        if present[IMRMOVQ]:
+            m = icode == IMRMOVQ
+            addr = valC + valB
+            fail = m & self._bad(addr)
+            done &= ~fail
+            m &= ~fail
+            R[idx[m], rA[m]] = self._load(idx[m], addr[m])
+        if present[IOPQ]:
+            m = icode == IOPQ
+            a, b, f = valA[m], valB[m], ifun[m]
+            e = np.select([f == 0, f == 1, f == 2], [a + b, a - b, a & b], a ^ b)
+            overflow = np.where(f == 0, ((a > 0) & (b > 0) & (e < 0)) | ((a < 0) & (b < 0) & (e > 0)),
+                                (f == 1) & (((a > 0) & (b < 0) & (e < 0)) | ((a < 0) & (b > 0) & (e > 0))))
+            R[idx[m], rB[m]] = e
+            # CC[0] -> ZF, CC[1] -> SF, CC[2] -> OF
+            self.cc[idx[m]] = (e == 0) | (e < 0) << 1 | overflow << 2
+        if present[IJXX]:
+            m = (icode == IJXX) & COND[cc, ifun]
+            new_pc = np.where(m, valC, new_pc)
+        if present[ICALL] or present[IPUSHQ]:
+            m = (icode == ICALL) | (icode == IPUSHQ)
+            addr = rsp - 8
+            fail = m & self._bad(addr)
+            done &= ~fail
+            m &= ~fail
+            self._store(idx[m], addr[m], np.where(icode == ICALL, valP, valA)[m])
+            R[idx[m], RRSP] = addr[m]
+            new_pc = np.where(m & (icode == ICALL), valC, new_pc)
+        if present[IRET] or present[IPOPQ]:
+            m = (icode == IRET) | (icode == IPOPQ)
+            fail = m & self._bad(rsp)
+            done &= ~fail
+            m &= ~fail
+            valM = self._load(idx[m], rsp[m])
+            R[idx[m], RRSP] = rsp[m] + 8
+            pop = icode[m] == IPOPQ
+            R[idx[m][pop], rA[m][pop]] = valM[pop]
+            new_pc[m] = np.where(pop, new_pc[m], valM)
+        R[:, RNONE] = 0
+
+        if not done.all():
+            self.stat[idx[~done]] = SADR
+        self.pc[idx[done]] = new_pc[done]
+        self.instructions[idx[done]] += 1
+        return int(np.count_nonzero(self.stat == SAOK))
+
+    def run(self, max_instructions: int | None = None) -> np.ndarray:
+        """Step until every instance has stopped or max_instructions steps were made; returns Stat"""
+        steps = 0
+        while max_instructions is None or steps < max_instructions:
+            steps += 1
+            if not self.step():
+                break
+        return self.stat
+
+
+def main(argv: list[str] | None = None):
+    import argparse
+    import time
+    import yasm
+
+    parser = argparse.ArgumentParser(description="Run N copies of a Y86 program in lockstep")
+    parser.add_argument("path", help=".ys program")
+    parser.add_argument("-n", type=int, default=1000, help="number of instances")
+    parser.add_argument("--mem-size", type=int, default=MEM_SIZE)
+    parser.add_argument("--max-instructions", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    image, labels = yasm.assemble_file(args.path)
+    machine = VectorMachine(image, labels.get('main', -1), args.n, args.mem_size)
+    start = time.perf_counter()
+    machine.run(args.max_instructions)
+    seconds = time.perf_counter() - start
+    total = int(machine.instructions.sum())
+    print(f"{args.n} instances, {total} instructions in {seconds:.3f} s, {total / seconds:.0f} instructions/sec")
+    for code, count in zip(*np.unique(machine.stat, return_counts=True)):
+        print(f"{stat_names.get(int(code), str(code))}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import time
+
+_START = time.perf_counter()
+
+import argparse
+import sys
+
+import objcache
+import yasm
+from isa import *
+from ram import MEM_SIZE
+
+
+# HDL processor modes run through simulate.run(), functional models directly
+HDL_BACKENDS = ("multi", "seq", "pipe")
+FUNCTIONAL_BACKENDS = ("interp", "translate", "paged")
+BACKENDS = FUNCTIONAL_BACKENDS + HDL_BACKENDS
+OUTPUT_FORMATS = ("obj", "hex", "bin")
+
+
+def load_program(path: str) -> tuple[bytes | memoryview, int]:
+    """Machine code and main of a .ys source or a .y86o object file"""
+    if path.endswith(objcache.SUFFIX):
+        image, _, main = objcache.load_object(path)
+        return image, main
+    image, labels = yasm.assemble_file(path)
+    return image, labels.get('main', -1)
+
+
+def make_machine(backend: str, image: bytes | memoryview, main: int, mem_size: int):
+    """Functional model of the backend; only these are built without importing MyHDL"""
+    if backend == "translate":
+        from translator import Translator
+        return Translator(image, main, mem_size)
+    if backend == "paged":
+        from paged import PagedInterpreter
+        return PagedInterpreter(image, main, mem_size)
+    from interpreter import Interpreter
+    return Interpreter(image, main, mem_size)
+
+
+def report_startup(args: argparse.Namespace):
+    """Print the time from process start of this module to the point the command starts its work"""
+    if args.startup:
+        elapsed = (time.perf_counter() - _START) * 1000
+        myhdl = "imported" if "myhdl" in sys.modules else "not imported"
+        print(f"startup: {elapsed:.1f} ms, MyHDL {myhdl}", file=sys.stderr)
+
+
+def print_state(stat: int, instructions: int, pc: int, registers: list[int], cc: int, cycles: int | None = None):
+    print(f"Stat: {stat_names.get(stat, stat)}  instructions: {instructions}"
+          + (f"  cycles: {cycles}" if cycles is not None else "") + f"  PC: {pc}  CC: {cc:03b}")
+    for i in range(15):
+        print(f"%{regs[i]}: {registers[i]}")
+
+
+def cmd_assemble(args: argparse.Namespace):
+    report_startup(args)
+    image, labels = yasm.assemble_file(args.path)
+    if args.format == "obj":
+        out = args.out or args.path.rsplit('.', 1)[0] + objcache.SUFFIX
+        objcache.save_object(out, image, labels)
+    elif args.format == "bin":
+        if args.out is None:
+            sys.stdout.buffer.write(image)
+        else:
+            with open(args.out, 'wb') as file:
+                file.write(image)
+    else:
+        text = " ".join(f"{b:02x}" for b in image)
+        if args.out is None:
+            print(text)
+        else:
+            with open(args.out, 'w') as file:
+                file.write(text + "\n")
+
+
+def cmd_run(args: argparse.Namespace):
+    image, main = load_program(args.path)
+    if args.backend in HDL_BACKENDS:
+        from simulate import run
+        from interpreter import to_signed
+
+        report_startup(args)
+        result = run(image, main, max_instructions=args.max_instructions, mem_size=args.mem_size,
+                     verbose=False, mode=args.backend)
+        print_state(result.status, result.instructions, result.pc, [to_signed(r) for r in result.registers],
+                    result.cc, result.cycles)
+        return
+    machine = make_machine(args.backend, image, main, args.mem_size)
+    report_startup(args)
+    machine.run(args.max_instructions)
+    print_state(machine.stat, machine.instructions, machine.pc, machine.regs, machine.cc)
+
+
+def cmd_trace(args: argparse.Namespace):
+    from tracer import TraceWriter
+
+    image, main = load_program(args.path)
+    with TraceWriter(args.out) as writer:
+        if args.backend in HDL_BACKENDS:
+            from simulate import run
+
+            report_startup(args)
+            run(image, main, max_instructions=args.max_instructions, mem_size=args.mem_size, verbose=False,
+                mode=args.backend, trace=writer)
+        else:
+            from tracer import trace_run
+
+            machine = make_machine(args.backend, image, main, args.mem_size)
+            report_startup(args)
+            trace_run(machine, writer, args.max_instructions)
+    print(f"{writer.events} instructions -> {args.out}")
+
+
+def cmd_bench(args: argparse.Namespace):
+    import bench
+
+    report_startup(args)
+    argv = list(args.paths) + ["--backends", *(args.backend or bench.BACKENDS)]
+    if args.max_instructions is not None:
+        argv += ["--max-instructions", str(args.max_instructions)]
+    if args.out:
+        argv += ["--out", args.out]
+    if args.baseline:
+        argv += ["--baseline", args.baseline]
+    bench.main(argv)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="y86", description="Y86-64 assembler, simulators and tools")
+    parser.add_argument("--startup", action="store_true",
+                        help="print the startup time and whether MyHDL was imported to stderr")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    assemble = commands.add_parser("assemble", help="assemble a .ys program")
+    assemble.add_argument("path", help=".ys program")
+    assemble.add_argument("--format", choices=OUTPUT_FORMATS, default="obj",
+                          help=f"object file ({objcache.SUFFIX}), hex bytes or raw machine code")
+    assemble.add_argument("-o", "--out", help="output file (default: next to the source for obj, stdout otherwise)")
+    assemble.set_defaults(func=cmd_assemble)
+
+    for name, func, help_text in (("run", cmd_run, "run a program and print its final state"),
+                                  ("trace", cmd_trace, "run a program recording a binary instruction trace")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("path", help=f".ys program or {objcache.SUFFIX} object")
+        command.add_argument("--backend", choices=BACKENDS, default="interp",
+                             help="functional model or HDL processor; only the HDL ones import MyHDL")
+        command.add_argument("--mem-size", type=int, default=MEM_SIZE)
+        command.add_argument("--max-instructions", type=int, default=None)
+        command.set_defaults(func=func)
+    commands.choices["trace"].add_argument("-o", "--out", default="trace.y86t", help="trace file")
+
+    bench = commands.add_parser("bench", help="benchmark the assembler and the simulators")
+    bench.add_argument("paths", nargs="*", help=".ys workloads (default: the benchmarks directory)")
+    bench.add_argument("--backend", nargs="+", choices=HDL_BACKENDS + ("interp", "translate"), default=None)
+    bench.add_argument("--max-instructions", type=int, default=None)
+    bench.add_argument("--out", help="write the JSON results here instead of stdout")
+    bench.add_argument("--baseline", help="JSON results of an earlier run to check for regressions")
+    bench.set_defaults(func=cmd_bench)
+    return parser
+
+
+def main(argv: list[str] | None = None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
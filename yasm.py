@@ -1,6 +1,8 @@
-from myhdl import intbv
 import re
-from utils import write_8byte_number
+from typing import TYPE_CHECKING, Iterable
+
+if TYPE_CHECKING:
+    from myhdl import intbv
 
 
 commands = {"halt": 0x00, "nop": 0x10, "rrmovq": 0x20, "irmovq": 0x30, "mrmovq": 0x50, \
@@ -13,117 +15,130 @@ registers = {"%rax": 0, "%rcx": 1, "%rdx": 2, "%rbx": 3, "%rsp": 4, "%rbp": 5, "
      "%rdi": 7, "%r8": 8, "%r9": 9, "%r10": 0xA, "%r11": 0xB, "%r12": 0xC, "%r13": 0xD, \
         "%r14": 0xE}
 
-def yassembling(file_path: str) -> list[intbv]:
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-    machine_code = []
+# Bump when the encoding of any source changes, it is part of the object cache key
+VERSION = 2
+
+NO_ARGS = ("halt", "nop", "ret")
+JUMPS = ("jmp", "jle", "jl", "je", "jne", "jge", "jg", "call")
+REG_REG = ("rrmovq", "addq", "subq", "andq", "xorq", "cmovle", "cmovl", "cmove", "cmovne", "cmovge", "cmovg")
+MASK64 = (1 << 64) - 1
+
+_words = re.compile(r'[,\s; ]+')
+_memory = re.compile(r'[,\s;() ]+')
+_immediate = re.compile(r'[+-]?\d+')
+
+
+def _memory_operand(arg: str) -> tuple[int, int] | None:
+    """(displacement, register) of a D(rB) operand, or None if it is not one"""
+    parts = [x for x in _memory.split(arg.strip()) if x != '']
+    if len(parts) != 2 or not parts[0].isdigit() or parts[1] not in registers:
+        return None
+    return int(parts[0]), registers[parts[1]]
+
+
+def assemble(lines: Iterable[str]) -> tuple[bytes, dict[str, int]]:
+    """Assemble Y86 source lines into a machine code image and a symbol table.
+
+    Lines are consumed one at a time and encoded straight into a bytearray.
+    Jumps and calls to labels that are not defined yet are left as zero and
+    patched in a second pass over the recorded references, so labels may be
+    used before they are defined. The symbol table maps label names to
+    addresses.
+    """
+    code = bytearray()
     labels = {}
+    fixups = []
     for line in lines:
-        if line.startswith('#'):
+        line = line.split('#', 1)[0].strip()
+        if line == '':
             continue
-        if line.strip() == '':
+        if line.startswith('$') and line.endswith(':'):
+            name = line[1:-1]
+            if name in labels:
+                raise ValueError(f"Label defined twice: {line}")
+            labels[name] = len(code)
             continue
-        if line.strip().startswith('$') and line.strip().endswith(':'):
-            labels[line.strip()[1:-1]] = len(machine_code)
-            continue
-        words = re.split(r'[,\s; ]+', line.strip())
-        words = list(filter(lambda x: x != '', words))
-        if words[0] not in commands:
-            raise ValueError(f"Invalid command: {words[0]}")
-        m_command = intbv(commands[words[0]])[8:]
+        words = [x for x in _words.split(line) if x != '']
+        op = words[0]
+        if op not in commands:
+            raise ValueError(f"Invalid command: {op}")
+        opcode = commands[op]
         if len(words) == 1:
-            if words[0] in ["halt", "nop", "ret"]:
-                machine_code.append(m_command)
-            else:
+            if op not in NO_ARGS:
                 raise ValueError(f"Wrong number of arguments: {line}")
+            code.append(opcode)
         elif len(words) == 2:
-            if words[0] in ["jmp", "jle", "jl", "je", "jne", "jge", "jg", "call"]:
-                if words[1].isdigit():
-                    m_dest = intbv(int(words[1]))[64:]
-                    machine_code.append(m_command)
-                    for _ in range(8):
-                        machine_code.append(intbv(0)[8:])
-                    write_8byte_number(machine_code, len(machine_code) - 8, m_dest)
-                elif words[1] in labels:
-                    m_dest = intbv(labels[words[1]])[64:]
-                    machine_code.append(m_command)
-                    for _ in range(8):
-                        machine_code.append(intbv(0)[8:])
-                    write_8byte_number(machine_code, len(machine_code) - 8, m_dest)
-                else:
-                    raise ValueError(f"Second argument must be an addres of destination: {line}")
-            elif words[0] in ["pushq", "popq"]:
-                if words[1] in registers:
-                    m_reg = intbv(0)[8:]
-                    m_reg[8:4] = registers[words[1]]
-                    m_reg[4:0] = 0xF
-                    machine_code.append(m_command)
-                    machine_code.append(m_reg)
+            arg = words[1]
+            if op in JUMPS:
+                if arg.isdigit():
+                    dest = int(arg)
+                elif arg in labels:
+                    dest = labels[arg]
                 else:
+                    fixups.append((len(code) + 1, arg, line))
+                    dest = 0
+                code.append(opcode)
+                code += (dest & MASK64).to_bytes(8, 'little')
+            elif op in ("pushq", "popq"):
+                if arg not in registers:
                     raise ValueError(f"Second argument must be a register: {line}")
+                code.append(opcode)
+                code.append(registers[arg] << 4 | 0xF)
             else:
                 raise ValueError(f"Invalid command: {line}")
         elif len(words) == 3:
-            if words[0] in ["rrmovq", "addq", "subq", "andq", "xorq", "cmovle", \
-                "cmovl", "cmove", "cmovne", "cmovge", "cmovg"]:
-                if words[1] in registers and words[2] in registers:
-                    m_regs = intbv(0)[8:]
-                    m_regs[8:4] = registers[words[1]]
-                    m_regs[4:0] = registers[words[2]]
-                    machine_code.append(m_command)
-                    machine_code.append(m_regs)
-                else:
+            if op in REG_REG:
+                if words[1] not in registers or words[2] not in registers:
                     raise ValueError(f"Second and third arguments must be registers: {line}")
-            elif words[0] == "irmovq":
-                if re.fullmatch(r'[+-]?\d+', words[1]) and words[2] in registers:
-                    m_dest = intbv(int(words[1]))[64:]
-                    m_reg = intbv(0)[8:]
-                    m_reg[8:4] = 0xF
-                    m_reg[4:0] = registers[words[2]]
-                    machine_code.append(m_command)
-                    machine_code.append(m_reg)
-                    for _ in range(8):
-                        machine_code.append(intbv(0)[8:])
-                    write_8byte_number(machine_code, len(machine_code) - 8, m_dest)
-                else:
+                code.append(opcode)
+                code.append(registers[words[1]] << 4 | registers[words[2]])
+            elif op == "irmovq":
+                if not _immediate.fullmatch(words[1]) or words[2] not in registers:
                     raise ValueError(f"Second argument must be an immediate value and first argument must be an register: {line}")
-            elif words[0] == "mrmovq":
-                arg1 = re.split(r'[,\s;() ]+', words[1].strip())
-                arg1 = list(filter(lambda x: x != '', arg1))
-                if arg1[0].isdigit() and arg1[1] in registers and words[2] in registers:
-                    m_reg = intbv(0)[8:]
-                    m_reg[8:4] = registers[words[2]]
-                    m_reg[4:0] = registers[arg1[1]]
-                    machine_code.append(m_command)
-                    machine_code.append(m_reg)
-                    for _ in range(8):
-                        machine_code.append(intbv(0)[8:])
-                    write_8byte_number(machine_code, len(machine_code) - 8, intbv(arg1[0])[64:])
-                else:
+                code.append(opcode)
+                code.append(0xF0 | registers[words[2]])
+                code += (int(words[1]) & MASK64).to_bytes(8, 'little')
+            elif op == "mrmovq":
+                operand = _memory_operand(words[1])
+                if operand is None or words[2] not in registers:
                     raise ValueError(f"First argument must be an address and second argument must be a register - D(rB), rA: {line}")
-            elif words[0] == "rmmovq":
-                arg1 = re.split(r'[,\s;() ]+', words[2].strip())
-                arg1 = list(filter(lambda x: x != '', arg1))
-                if arg1[0].isdigit() and arg1[1] in registers and words[1] in registers:
-                    m_reg = intbv(0)[8:]
-                    m_reg[8:4] = registers[words[1]]
-                    m_reg[4:0] = registers[arg1[1]]
-                    machine_code.append(m_command)
-                    machine_code.append(m_reg)
-                    for _ in range(8):
-                        machine_code.append(intbv(0)[8:])
-                    write_8byte_number(machine_code, len(machine_code) - 8, intbv(arg1[0])[64:])
-                else:
+                code.append(opcode)
+                code.append(registers[words[2]] << 4 | operand[1])
+                code += operand[0].to_bytes(8, 'little')
+            elif op == "rmmovq":
+                operand = _memory_operand(words[2])
+                if operand is None or words[1] not in registers:
                     raise ValueError(f"First argument must be an address and second argument must be a register - rA, D(rB): {line}")
+                code.append(opcode)
+                code.append(registers[words[1]] << 4 | operand[1])
+                code += operand[0].to_bytes(8, 'little')
             else:
                 raise ValueError(f"This command should have 1 or 0 arguments, but has 2: {line}")
         else:
             raise ValueError(f"Too many arguments. Max is 2, but has {len(words) - 1}: {line}")
-    main = -1 if 'main' not in labels else labels['main']
-    return machine_code, main
+
+    # Second pass: resolve references to labels defined later
+    for offset, name, line in fixups:
+        if name not in labels:
+            raise ValueError(f"Second argument must be an addres of destination: {line}")
+        code[offset:offset + 8] = labels[name].to_bytes(8, 'little')
+    return bytes(code), labels
+
+
+def assemble_file(file_path: str) -> tuple[bytes, dict[str, int]]:
+    """Assemble a .ys file, reading it line by line"""
+    with open(file_path, 'r') as file:
+        return assemble(file)
+
+
+def yassembling(file_path: str) -> "tuple[list[intbv], int]":
+    """Program as one 8-bit intbv per byte and the address of main (-1 if there is none)"""
+    from myhdl import intbv
+    image, labels = assemble_file(file_path)
+    return [intbv(b)[8:] for b in image], labels.get('main', -1)
 
 if __name__ == "__main__":
     file_path = input("Enter the path to the file with the program: ")
     program, main = yassembling(file_path)
     for elem in program:
-        print(hex(int(elem)), end=" ")
\ No newline at end of file
+        print(hex(int(elem)), end=" ")